@@ -0,0 +1,114 @@
+"""Compares the banner reader of :class:`smtphealth.SmtpHealthCheck` against
+the original implementation, which concatenated strings as each part of the
+banner was received. Both readers run inside a check, with the same timeout
+handling. Each banner is sent over a local socket pair in
+fixed chunks, so the number of system calls made by each reader is part of
+what is measured.
+
+Usage::
+
+    $ python bench/bench_banner.py
+
+"""
+
+from __future__ import print_function
+
+import sys
+import socket
+import timeit
+
+from smtphealth import SmtpHealthCheck, BannerSyntaxError, Timeout
+
+
+class FeedingSocket(object):
+    """Wraps one end of a connected socket pair. Before each receive, the next
+    chunk of the banner is sent from the other end, so every receive is a
+    real system call that sees exactly the data that has arrived so far.
+
+    """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sock, self.peer = socket.socketpair()
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+    def _feed(self):
+        if self.chunks:
+            self.peer.sendall(self.chunks.pop(0))
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self, bufsize):
+        self._feed()
+        return self.sock.recv(bufsize)
+
+    def recv_into(self, view):
+        self._feed()
+        return self.sock.recv_into(view)
+
+
+class LegacyCheck(SmtpHealthCheck):
+
+    def _get_banner(self):
+        timeout_error = 'Receiving banner timed out.'
+        with Timeout(self.banner_timeout, timeout_error) as timer:
+            received = b''
+            while True:
+                self.sock.settimeout(timer.remaining())
+                part = self.sock.recv(1024)
+                received = received + part
+                if received.endswith(b'\n'):
+                    ret = received
+                    break
+                if len(received) > 10240:
+                    msg = 'Received too much data from banner.'
+                    raise BannerSyntaxError(msg)
+        self.results['Banner-Elapsed'] = timer.elapsed
+        return ret
+
+
+def split(data, size):
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+
+def bench(check_class, chunks, number):
+    def run():
+        check = check_class()
+        check.sock = FeedingSocket(chunks)
+        try:
+            check._get_banner()
+        finally:
+            check.sock.close()
+    return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def main():
+    large = b'220 ' + b'x' * 10000 + b'\r\n'
+    trickled = b'220 ' + b'x' * 2000 + b'\r\n'
+    small = b'220 mail.example.com ESMTP ready\r\n'
+    cases = [('small, one chunk', [small], 2000),
+             ('large, one chunk', [large], 500),
+             ('large, 1024-byte chunks', split(large, 1024), 500),
+             ('large, 64-byte chunks', split(large, 64), 100),
+             ('trickled, 1-byte chunks', split(trickled, 1), 20)]
+    print('{0:<26} {1:>12} {2:>12} {3:>8}'.format(
+        'case', 'legacy (us)', 'new (us)', 'speedup'))
+    for name, chunks, number in cases:
+        legacy = bench(LegacyCheck, chunks, number) * 1e6
+        new = bench(SmtpHealthCheck, chunks, number) * 1e6
+        print('{0:<26} {1:>12.1f} {2:>12.1f} {3:>7.2f}x'.format(
+            name, legacy, new, legacy / new))
+    multiline = b''.join(b'220-line ' + str(i).encode('ascii') + b'\r\n'
+                         for i in range(200)) + b'220 done\r\n'
+    new = bench(SmtpHealthCheck, split(multiline, 1024), 200) * 1e6
+    print('{0:<26} {1:>12} {2:>12.1f}'.format('multi-line, 200 lines',
+                                              'n/a', new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Measures the overhead of :class:`smtphealth.SmtpHealthCheck` itself, by
+checking thousands of fake SMTP servers on localhost. The servers in
+:mod:`farm` cover fast, slow, trickled and oversized banners, tarpits, 4xx and
+5xx banners, and TLS.
+
+For each scenario, every listener is checked through a
+:class:`~smtphealth.engine.CheckEngine`. The benchmark reports the checks per
+second, the CPU time used per check, and the peak memory of the process. By
+default the farm runs in a child process, so its CPU time and memory are not
+counted against the checks.
+
+Usage::
+
+    $ python bench/bench_checks.py --save bench/baseline.json
+    $ python bench/bench_checks.py --compare bench/baseline.json
+
+When comparing, the exit code is non-zero if any scenario regressed by more
+than the tolerance.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import platform
+import resource
+import multiprocessing
+from collections import OrderedDict
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from smtphealth import monotonic
+from smtphealth.engine import CheckEngine
+from smtphealth.targets import Target
+
+from farm import FakeSmtpFarm, SCENARIOS
+
+
+def _serve(pipe, count, names):
+    farm = FakeSmtpFarm(count, OrderedDict((name, SCENARIOS[name])
+                                           for name in names))
+    pipe.send(farm.start())
+    pipe.recv()
+    farm.stop()
+
+
+class ChildFarm(object):
+    """Runs a :class:`~farm.FakeSmtpFarm` in a child process."""
+
+    def __init__(self, count, names):
+        super(ChildFarm, self).__init__()
+        self.pipe, child_pipe = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(child_pipe, count, names))
+        self.process.daemon = True
+
+    def start(self):
+        self.process.start()
+        return self.pipe.recv()
+
+    def stop(self):
+        self.pipe.send(None)
+        self.process.join()
+
+
+def _raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_memory():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1048576.0
+    return peak / 1024.0
+
+
+def run_scenario(name, ports, options):
+    """Checks every port of one scenario.
+
+    :returns: The measurements of the scenario.
+    :rtype: dict
+
+    """
+    scenario = SCENARIOS[name]
+    targets = [Target('127.0.0.1', port, scenario.ssl)
+               for port in ports] * options.rounds
+    engine = CheckEngine(options.concurrency,
+                         dns_timeout=options.timeout,
+                         connect_timeout=options.timeout,
+                         ssl_timeout=options.timeout,
+                         banner_timeout=options.timeout)
+    healthy = 0
+    start_cpu = _cpu_time()
+    start = monotonic()
+    for target, check in engine.run(targets):
+        if check.results['Status'] == 'OK':
+            healthy += 1
+    elapsed = monotonic() - start
+    cpu = _cpu_time() - start_cpu
+    expected = len(targets) if scenario.healthy else 0
+    if healthy != expected:
+        print('warning: {0} had {1} healthy checks, expected {2}'.format(
+            name, healthy, expected), file=sys.stderr)
+    return OrderedDict([('checks', len(targets)),
+                        ('checks_per_sec', len(targets) / elapsed),
+                        ('cpu_ms_per_check', cpu * 1000.0 / len(targets)),
+                        ('peak_memory_mb', _peak_memory())])
+
+
+def compare(results, baseline, tolerance):
+    """Compares results against a recorded baseline.
+
+    :returns: A list of descriptions of each regression.
+    :rtype: list
+
+    """
+    regressions = []
+    for name, measured in results.items():
+        expected = baseline['scenarios'].get(name)
+        if expected is None:
+            continue
+        if measured['checks_per_sec'] < \
+                expected['checks_per_sec'] * (1.0 - tolerance):
+            regressions.append('{0}: checks/sec fell from {1:.1f} to '
+                               '{2:.1f}'.format(name,
+                                                expected['checks_per_sec'],
+                                                measured['checks_per_sec']))
+        for key, label in (('cpu_ms_per_check', 'CPU ms/check'),
+                           ('peak_memory_mb', 'peak memory MB')):
+            if measured[key] > expected[key] * (1.0 + tolerance):
+                regressions.append('{0}: {1} rose from {2:.3f} to '
+                                   '{3:.3f}'.format(name, label,
+                                                    expected[key],
+                                                    measured[key]))
+    return regressions
+
+
+def main():
+    op = OptionParser(usage='%prog [options]')
+    op.add_option('-n', '--endpoints',
+                  type='int', metavar='NUM', default=250,
+                  help='The number of fake servers for each scenario, '
+                  'default %default.')
+    op.add_option('-r', '--rounds',
+                  type='int', metavar='NUM', default=1,
+                  help='The number of times each server is checked, default '
+                  '%default.')
+    op.add_option('-j', '--concurrency',
+                  type='int', metavar='NUM', default=50,
+                  help='The number of checks to run at once, default '
+                  '%default.')
+    op.add_option('-t', '--timeout',
+                  type='float', metavar='SEC', default=0.5,
+                  help='The timeout of every stage, default %default.')
+    op.add_option('--scenario',
+                  action='append', dest='scenarios', metavar='NAME',
+                  choices=list(SCENARIOS), type='choice', default=None,
+                  help='Run only this scenario, may be given more than once.')
+    op.add_option('--in-process',
+                  action='store_true', default=False,
+                  help='Run the fake servers in this process, so their '
+                  'overhead is included in the measurements.')
+    op.add_option('--save',
+                  metavar='FILE', default=None,
+                  help='Record the results as a baseline in FILE.')
+    op.add_option('--compare',
+                  metavar='FILE', default=None,
+                  help='Compare the results against the baseline in FILE.')
+    op.add_option('--tolerance',
+                  type='float', metavar='FRAC', default=0.25,
+                  help='With --compare, the fraction by which a measurement '
+                  'may be worse than the baseline, default %default.')
+    options, extra = op.parse_args()
+    names = options.scenarios or list(SCENARIOS)
+
+    _raise_file_limit()
+    if options.in_process:
+        farm = FakeSmtpFarm(options.endpoints,
+                            OrderedDict((name, SCENARIOS[name])
+                                        for name in names))
+    else:
+        farm = ChildFarm(options.endpoints, names)
+    ports = farm.start()
+
+    results = OrderedDict()
+    print('{0:<10} {1:>8} {2:>12} {3:>14} {4:>14}'.format(
+        'scenario', 'checks', 'checks/sec', 'CPU ms/check', 'peak mem MB'))
+    try:
+        for name in names:
+            measured = run_scenario(name, ports[name], options)
+            results[name] = measured
+            print('{0:<10} {checks:>8} {checks_per_sec:>12.1f} '
+                  '{cpu_ms_per_check:>14.3f} {peak_memory_mb:>14.1f}'.format(
+                      name, **measured))
+    finally:
+        farm.stop()
+
+    if options.save:
+        baseline = OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('endpoints', options.endpoints),
+            ('rounds', options.rounds),
+            ('concurrency', options.concurrency),
+            ('timeout', options.timeout),
+            ('scenarios', results)])
+        with open(options.save, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""A farm of fake SMTP servers listening on localhost, for benchmarking
+:class:`smtphealth.SmtpHealthCheck` without any network noise. Every listener
+is served by a single thread running a ``poll()`` loop, so thousands of
+endpoints cost little more than their sockets.
+
+Each listener follows one of the :data:`SCENARIOS`, which describe what a
+server sends after accepting a connection, and when. After sending its
+banner, a server waits for the check to hang up.
+
+"""
+
+from __future__ import print_function
+
+import os
+import ssl
+import heapq
+import errno
+import select
+import socket
+import threading
+from collections import namedtuple, OrderedDict, deque
+
+from smtphealth import monotonic
+
+
+#: The self-signed certificate and key used by TLS listeners.
+CERTFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fake-smtp.pem')
+
+
+class Scenario(namedtuple('Scenario', 'steps ssl healthy')):
+    """Describes the behavior of a fake server.
+
+    :param steps: List of ``(delay, data)`` tuples, sent in order. Each delay
+                  is the number of seconds to wait after the previous step.
+                  An empty list is a tarpit, which never sends anything.
+    :param ssl: If True, the server expects an SSL handshake first.
+    :param healthy: If True, a check of this server should report ``OK``.
+
+    """
+    __slots__ = ()
+
+
+def _trickle(data, size, delay):
+    return [(delay, data[i:i+size]) for i in range(0, len(data), size)]
+
+
+_BANNER = b'220 fake.example.com ESMTP ready\r\n'
+_MULTILINE = b'220-fake.example.com ESMTP\r\n' \
+    b'220-This server is slow to say hello.\r\n' \
+    b'220 ready\r\n'
+
+#: The behaviors a fake server may have, by name.
+SCENARIOS = OrderedDict([
+    ('fast', Scenario([(0.0, _BANNER)], False, True)),
+    ('slow', Scenario([(0.05, _BANNER)], False, True)),
+    ('trickled', Scenario(_trickle(_MULTILINE, 8, 0.002), False, True)),
+    ('tarpit', Scenario([], False, False)),
+    ('4xx', Scenario([(0.0, b'421 4.3.2 Service not available\r\n')],
+                     False, False)),
+    ('5xx', Scenario([(0.0, b'554 5.7.1 No SMTP service here\r\n')],
+                     False, False)),
+    ('oversized', Scenario([(0.0, b'220-' + b'x' * 1020 + b'\r\n')] * 12,
+                           False, False)),
+    ('tls', Scenario([(0.0, _BANNER)], True, True)),
+])
+
+
+class _Connection(object):
+
+    def __init__(self, sock, scenario):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.steps = deque(scenario.steps)
+        self.handshaking = scenario.ssl
+        self.outgoing = b''
+
+
+class FakeSmtpFarm(object):
+    """Runs many fake SMTP servers on one thread.
+
+    :param count: The number of listeners for each scenario.
+    :type count: int
+    :param scenarios: The scenarios to listen for, by name.
+    :type scenarios: dict
+    :param address: The address to listen on.
+    :type address: str
+    :param certfile: The certificate and key used by TLS listeners.
+    :type certfile: str
+
+    """
+
+    def __init__(self, count=100, scenarios=SCENARIOS, address='127.0.0.1',
+                 certfile=CERTFILE):
+        super(FakeSmtpFarm, self).__init__()
+        self.count = count
+        self.scenarios = scenarios
+        self.address = address
+        self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        self.context.load_cert_chain(certfile)
+        #: The listening ports of each scenario, by name.
+        self.ports = OrderedDict()
+        self._listeners = {}
+        self._connections = {}
+        self._timers = []
+        self._poller = select.poll()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _listen(self, scenario):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.address, 0))
+        sock.listen(128)
+        sock.setblocking(0)
+        self._listeners[sock.fileno()] = (sock, scenario)
+        self._poller.register(sock, select.POLLIN)
+        return sock.getsockname()[1]
+
+    def start(self):
+        """Opens every listener and starts serving them on a daemon thread.
+
+        :returns: The listening ports of each scenario, by name.
+        :rtype: dict
+
+        """
+        for name, scenario in self.scenarios.items():
+            self.ports[name] = [self._listen(scenario)
+                                for i in range(self.count)]
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.ports
+
+    def stop(self):
+        """Stops serving and closes every socket."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for conn in list(self._connections.values()):
+            self._close(conn)
+        for sock, scenario in self._listeners.values():
+            sock.close()
+        self._listeners.clear()
+
+    def _update(self, conn):
+        events = select.POLLIN
+        if conn.outgoing or conn.handshaking == 'write':
+            events |= select.POLLOUT
+        self._poller.modify(conn.sock, events)
+
+    def _close(self, conn):
+        if self._connections.get(conn.fd) is conn:
+            del self._connections[conn.fd]
+            self._poller.unregister(conn.fd)
+            conn.sock.close()
+
+    def _accept(self, listener, scenario):
+        while True:
+            try:
+                sock, addr = listener.accept()
+            except socket.error as exc:
+                if exc.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(0)
+            if scenario.ssl:
+                sock = self.context.wrap_socket(
+                    sock, server_side=True, do_handshake_on_connect=False)
+            conn = _Connection(sock, scenario)
+            self._connections[conn.fd] = conn
+            self._poller.register(sock, select.POLLIN)
+            if conn.handshaking:
+                self._handshake(conn)
+            else:
+                self._schedule(conn)
+
+    def _handshake(self, conn):
+        try:
+            conn.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            conn.handshaking = 'read'
+        except ssl.SSLWantWriteError:
+            conn.handshaking = 'write'
+        except (ssl.SSLError, socket.error):
+            self._close(conn)
+            return
+        else:
+            conn.handshaking = False
+            self._schedule(conn)
+        self._update(conn)
+
+    def _schedule(self, conn):
+        if conn.steps:
+            delay, data = conn.steps[0]
+            heapq.heappush(self._timers, (monotonic() + delay, id(conn),
+                                          conn))
+
+    def _fire(self, conn):
+        if self._connections.get(conn.fd) is not conn:
+            return
+        delay, data = conn.steps.popleft()
+        conn.outgoing += data
+        self._send(conn)
+        self._schedule(conn)
+
+    def _send(self, conn):
+        try:
+            sent = conn.sock.send(conn.outgoing)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            sent = 0
+        except socket.error as exc:
+            if exc.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._close(conn)
+                return
+            sent = 0
+        conn.outgoing = conn.outgoing[sent:]
+        self._update(conn)
+
+    def _receive(self, conn):
+        try:
+            data = conn.sock.recv(4096)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        except (ssl.SSLError, socket.error):
+            data = b''
+        if not data:
+            self._close(conn)
+
+    def _handle(self, fd, event):
+        listener = self._listeners.get(fd)
+        if listener is not None:
+            self._accept(*listener)
+            return
+        conn = self._connections.get(fd)
+        if conn is None:
+            return
+        if conn.handshaking:
+            self._handshake(conn)
+        elif event & (select.POLLHUP | select.POLLERR):
+            self._close(conn)
+        elif event & select.POLLOUT and conn.outgoing:
+            self._send(conn)
+        elif event & select.POLLIN:
+            self._receive(conn)
+
+    def serve_forever(self):
+        """Serves every listener until :meth:`.stop` is called."""
+        while not self._stop.is_set():
+            now = monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                self._fire(heapq.heappop(self._timers)[2])
+            timeout = 100
+            if self._timers:
+                timeout = min(timeout, (self._timers[0][0] - now) * 1000.0)
+            for fd, event in self._poller.poll(max(0, int(timeout))):
+                self._handle(fd, event)
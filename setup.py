@@ -10,7 +10,12 @@ setup(name='smtp-health-check',
       url='https://github.com/icgood/smtp-health-check',
       packages=find_packages(),
       install_requires=[],
-      entry_points={'console_scripts': ['smtp-health-check = smtphealth.main:main']},
+      extras_require={'mx': ['dnspython']},
+      entry_points={'console_scripts': [
+          'smtp-health-check = smtphealth.main:main',
+          'smtp-health-check-batch = smtphealth.main:batch',
+          'smtp-health-monitor = smtphealth.main:monitor',
+          'smtp-health-check-server = smtphealth.main:server']},
       classifiers=['Development Status :: 3 - Alpha',
                    'Programming Language :: Python'])
 
@@ -27,13 +27,18 @@ based on its response times and banner codes.
 
 from __future__ import absolute_import
 
+import os
 import sys
 import re
+import errno
+import select
 import socket
-import ssl
 import time
-import signal
-import traceback
+import threading
+
+from .output import get_writer
+from .results import CheckResults
+from . import failures
 
 
 class BannerError(Exception):
@@ -60,13 +65,88 @@ class DNSError(Exception):
     pass
 
 
-class Timeout(Exception):
-    """This class may be used as a context manager in ``with`` statements. If
-    the given number of seconds elapses, the class itself (which inherits from
-    ``Exception``) is raised asynchronously using signals.
+def _linux_clock():
+    import ctypes
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL('librt.so.1', use_errno=True)
+    except OSError:
+        librt = ctypes.CDLL('libc.so.6', use_errno=True)
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+
+    def gettime():
+        ts = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts
+    gettime()
+    return gettime
+
+
+def _linux_monotonic():
+    gettime = _linux_clock()
+
+    def monotonic():
+        ts = gettime()
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+def _linux_monotonic_ns():
+    gettime = _linux_clock()
+
+    def monotonic_ns():
+        ts = gettime()
+        return ts.tv_sec * 1000000000 + ts.tv_nsec
+    return monotonic_ns
+
 
-    :param seconds: The number of seconds before timeout.
-    :type seconds: int
+def _time_ns():
+    return int(time.time() * 1e9)
+
+
+def _find_monotonic(name, linux_clock, fallback):
+    try:
+        return getattr(time, name)
+    except AttributeError:
+        pass
+    if sys.platform.startswith('linux'):
+        try:
+            return linux_clock()
+        except (OSError, AttributeError):
+            pass
+    return fallback
+
+
+#: Returns the current value, in fractional seconds, of a high-resolution
+#: clock that is not affected by system clock updates. Only the difference
+#: between two values is meaningful. On platforms that provide no such clock,
+#: this falls back to :func:`time.time`.
+monotonic = _find_monotonic('perf_counter', _linux_monotonic, time.time)
+
+#: Like :func:`monotonic`, but returns an integer number of nanoseconds, in
+#: the style of :func:`time.perf_counter_ns`.
+monotonic_ns = _find_monotonic('perf_counter_ns', _linux_monotonic_ns,
+                               _time_ns)
+
+
+class Timeout(Exception):
+    """This class may be used as a context manager in ``with`` statements to
+    enforce a deadline on the work done inside the block. No signals are used,
+    so it is safe to use from any thread. Instead, blocking calls in the block
+    should be bounded by :meth:`.remaining`, e.g. as a socket timeout. If the
+    block raises :exc:`socket.timeout` or finishes after the deadline, the
+    class itself (which inherits from ``Exception``) is raised.
+
+    :param seconds: The number of seconds before timeout, or ``None`` for no
+                    timeout.
+    :type seconds: float
     :param err: The error string to associate with the timeout exception.
     :type err: str
 
@@ -75,9 +155,12 @@ class Timeout(Exception):
     def __init__(self, seconds, err=None):
         super(Timeout, self).__init__(err or 'Request timed out')
         self._seconds = seconds
-        self._old = signal.SIG_DFL
         self._start = None
 
+        #: While in the context, the :func:`monotonic` time at which the
+        #: timeout expires, or ``None`` if there is no timeout.
+        self.deadline = None
+
         #: If successful, this is the total elapsed time taken by the context.
         #: For example::
         #:
@@ -87,21 +170,143 @@ class Timeout(Exception):
         #:
         self.elapsed = None
 
-    def _fire(self, signum, frame):
-        raise self
+    def remaining(self):
+        """Returns the number of seconds left before the deadline, suitable
+        for passing to :meth:`socket.socket.settimeout`.
+
+        :returns: The seconds remaining, or ``None`` if there is no timeout.
+        :rtype: float
+        :raises: :class:`Timeout`, if the deadline has already passed.
+
+        """
+        if self.deadline is None:
+            return None
+        left = self.deadline - monotonic()
+        if left <= 0.0:
+            raise self
+        return left
 
     def __enter__(self):
+        self._start = monotonic()
         if self._seconds is not None:
-            self._old = signal.signal(signal.SIGALRM, self._fire)
-            signal.alarm(self._seconds)
-        self._start = time.time()
+            self.deadline = self._start + self._seconds
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        self.elapsed = time.time() - self._start
-        if self._seconds is not None:
-            signal.signal(signal.SIGALRM, self._old)
-            signal.alarm(0)
+        self.elapsed = monotonic() - self._start
+        if exc_type is not None:
+            if issubclass(exc_type, socket.timeout):
+                raise self
+        elif self.deadline is not None and self.elapsed > self._seconds:
+            raise self
+
+
+def _call_with_timeout(timer, func, *args):
+    # Some blocking calls, like getaddrinfo(), cannot be given a timeout. They
+    # are run on a separate thread so that the deadline is still honored.
+    seconds = timer.remaining()
+    if seconds is None:
+        return func(*args)
+    ret = []
+
+    def target():
+        try:
+            ret.append((True, func(*args)))
+        except Exception as exc:
+            ret.append((False, exc))
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(seconds)
+    if not ret:
+        raise timer
+    success, value = ret[0]
+    if not success:
+        raise value
+    return value
+
+
+def _to_str(data):
+    # Received data is handled as a native string, which on Python 3 means
+    # decoding without any loss of the original bytes.
+    if bytes is str:
+        return data.tobytes()
+    return data.tobytes().decode('latin-1')
+
+
+def _split_lines(reply):
+    # Only LF ends a line of an SMTP reply. str.splitlines() would also split
+    # on form feeds and other control characters within a line.
+    lines = [line + '\n' for line in reply.split('\n')]
+    lines[-1] = lines[-1][0:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+_IN_PROGRESS = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+_NXDOMAIN_ERRORS = tuple(getattr(socket, name) for name in
+                         ('EAI_NONAME', 'EAI_NODATA')
+                         if hasattr(socket, name))
+
+_CONNECT_FAILURES = {errno.ECONNREFUSED: failures.CONNECT_REFUSED,
+                     errno.ETIMEDOUT: failures.CONNECT_TIMEOUT,
+                     errno.ENETUNREACH: failures.CONNECT_UNREACHABLE,
+                     errno.EHOSTUNREACH: failures.CONNECT_UNREACHABLE}
+
+_BANNER_FAILURES = {'4': failures.BANNER_4XX, '5': failures.BANNER_5XX}
+
+
+def _interleave_families(gai):
+    # As recommended by RFC 8305, the first address family in the sorted
+    # results goes first, and then the families alternate.
+    families = []
+    by_family = {}
+    for entry in gai:
+        if entry[0] not in by_family:
+            families.append(entry[0])
+            by_family[entry[0]] = []
+        by_family[entry[0]].append(entry)
+    ret = []
+    queues = [by_family[family] for family in families]
+    while queues:
+        for queue in queues:
+            ret.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return ret
+
+
+def _wait_writable(socks, timeout):
+    # poll() is preferred because select() cannot handle file descriptors
+    # above FD_SETSIZE, which is easily exceeded by large concurrent sweeps.
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        by_fd = {}
+        for sock in socks:
+            by_fd[sock.fileno()] = sock
+            poller.register(sock, select.POLLOUT)
+        if timeout is not None:
+            timeout = max(0, int(timeout * 1000.0 + 1.0))
+        return [by_fd[fd] for fd, event in poller.poll(timeout)]
+    else:
+        return select.select([], socks, [], timeout)[1]
+
+
+def get_default_context():
+    """Returns the shared context of
+    :func:`smtphealth.tls.get_default_context`. The :mod:`ssl` module is only
+    imported once it is needed, which keeps startup fast.
+
+    :rtype: :class:`ssl.SSLContext`
+
+    """
+    from .tls import get_default_context
+    return get_default_context()
+
+
+def _call_stage(check, stage, func, *args):
+    return func(*args)
 
 
 class SmtpHealthCheck(object):
@@ -112,82 +317,322 @@ class SmtpHealthCheck(object):
 
     :param dns_timeout: The timeout, in seconds, to wait for a DNS lookup of
                         the SMTP server hostname.
-    :type dns_timeout: int
+    :type dns_timeout: float
     :param connect_timeout: The timeout, in seconds, to wait for the socket
                             connection to the SMTP server.
-    :type connect_timeout: int
+    :type connect_timeout: float
     :param ssl_timeout: If using SSL, the timeout, in seconds, to wait for the
                         handshake with the SMTP server to finish.
-    :type ssl_timeout: int
+    :type ssl_timeout: float
     :param banner_timeout: The timeout, in seconds, to wait for connected
                            socket to receive a complete banner message from the
                            SMTP server.
-    :type banner_timeout: int
+    :type banner_timeout: float
+    :param dns_cache: If given, DNS lookups are served from this cache when
+                      possible, and the ``Dns-Cached`` result shows whether
+                      the lookup was a cache hit.
+    :type dns_cache: :class:`~smtphealth.dnscache.DnsCache`
+    :param family: The address family to resolve, e.g. ``socket.AF_INET6``.
+                   Use ``socket.AF_UNSPEC`` for both IPv4 and IPv6 addresses.
+    :param happy_eyeballs: If ``True`` and DNS returns multiple addresses,
+                           connections are raced in the style of RFC 8305 and
+                           the first to succeed is used. Otherwise, only the
+                           first address is tried.
+    :type happy_eyeballs: bool
+    :param ssl_context: The context used to initiate SSL, which may be shared
+                        by many checks. By default, a shared context that does
+                        not verify certificates is used.
+    :type ssl_context: :class:`ssl.SSLContext`
+    :param ssl_sessions: If given, SSL sessions are saved here and resumed by
+                         later checks of the same server, and the
+                         ``Ssl-Resumed`` result shows whether the session was
+                         resumed.
+    :type ssl_sessions: :class:`~smtphealth.tls.SslSessionCache`
+    :param hooks: If given, its callbacks are called at the start and end of
+                  each stage of the check.
+    :type hooks: :class:`~smtphealth.hooks.StageHooks`
+    :param adaptive_timeouts: If given, :meth:`.run` derives the timeout of
+                              each stage from the latency previously observed
+                              from the same host, using the timeouts above as
+                              ceilings, and records the latency of this check.
+    :type adaptive_timeouts: :class:`~smtphealth.adaptive.AdaptiveTimeouts`
+    :param limiter: If given, the connection waits until the limiter allows
+                    it, and the ``Limit-Elapsed`` result shows how long that
+                    took. With ``happy_eyeballs``, the per-address limits
+                    apply to the first address tried.
+    :type limiter: :class:`~smtphealth.limits.ConnectionLimiter`
+    :param tracebacks: If ``True``, a failed check also reports the formatted
+                       traceback of its exception as ``Exception-Traceback``.
+                       This is costly, so by default only the ``Failure``
+                       code and the exception type and message are reported.
+    :type tracebacks: bool
 
     """
 
     banner_pattern = re.compile(r'^(\d{3})(?:\s+|-)(.*?)\r?\n$')
 
+    #: The maximum number of bytes to receive while waiting for a complete
+    #: banner, which may span multiple lines.
+    max_banner_size = 10240
+
+    #: With ``happy_eyeballs``, the number of seconds to wait for a connection
+    #: attempt before starting the next one in parallel.
+    attempt_delay = 0.25
+
     def __init__(self, dns_timeout=None, connect_timeout=None,
-                 ssl_timeout=None, banner_timeout=None):
+                 ssl_timeout=None, banner_timeout=None, dns_cache=None,
+                 family=socket.AF_INET, happy_eyeballs=False,
+                 ssl_context=None, ssl_sessions=None, hooks=None,
+                 adaptive_timeouts=None, limiter=None, tracebacks=False):
         super(SmtpHealthCheck, self).__init__()
         self.sock = None
         self.dns_timeout = dns_timeout
         self.connect_timeout = connect_timeout
         self.ssl_timeout = ssl_timeout
         self.banner_timeout = banner_timeout
-        self.results = {'Status': 'CRITICAL'}
+        self.dns_cache = dns_cache
+        self.family = family
+        self.happy_eyeballs = happy_eyeballs
+        self.ssl_context = ssl_context
+        self.ssl_sessions = ssl_sessions
+        self.hooks = hooks
+        self.adaptive_timeouts = adaptive_timeouts
+        self.limiter = limiter
+        self.tracebacks = tracebacks
+        self._ssl_key = None
+        self._limit_key = None
+        self._idle_limit_key = None
+        self._open_ssl = None
+        self.results = CheckResults(Status='CRITICAL')
 
     def _lookup(self, host, port):
-        sockfam = socket.AF_INET
+        sockfam = self.family
         socktype = socket.SOCK_STREAM
+        args = (host, port, sockfam, socktype)
         with Timeout(self.dns_timeout, 'DNS lookup timed out.') as timer:
-            ret = socket.getaddrinfo(host, port, sockfam, socktype)
+            if self.dns_cache is not None:
+                ret = self._cached_lookup(timer, args)
+            else:
+                ret = _call_with_timeout(timer, socket.getaddrinfo, *args)
         self.results['Dns-Elapsed'] = timer.elapsed
         return ret
 
+    def _cached_lookup(self, timer, args):
+        self.results['Dns-Cached'] = True
+        try:
+            return self.dns_cache.get(args)
+        except KeyError:
+            pass
+        self.results['Dns-Cached'] = False
+        try:
+            ret = _call_with_timeout(timer, socket.getaddrinfo, *args)
+        except socket.gaierror as exc:
+            self.dns_cache.set_error(args, exc)
+            raise
+        self.dns_cache.set(args, ret)
+        return ret
+
     def _connect(self, gai):
         if len(gai) < 1:
             raise DNSError('DNS lookup returned no results.')
         with Timeout(self.connect_timeout, 'Connection timed out.') as timer:
-            self.sock = socket.socket(*gai[0][0:3])
-            self.sock.connect(gai[0][4])
+            if self.happy_eyeballs and len(gai) > 1:
+                self.sock, entry = self._race_connect(timer, gai)
+                self.results['Address'] = entry[4][0]
+            else:
+                self.results['Address'] = gai[0][4][0]
+                self.sock = socket.socket(*gai[0][0:3])
+                self.sock.settimeout(timer.remaining())
+                self.sock.connect(gai[0][4])
         self.results['Connect-Elapsed'] = timer.elapsed
 
-    def _wrap_ssl(self):
+    def _race_connect(self, timer, gai):
+        remaining = _interleave_families(gai)
+        pending = {}
+        error = None
+        next_attempt = 0.0
+        try:
+            while remaining or pending:
+                timeout = timer.remaining()
+                now = monotonic()
+                if remaining and (not pending or now >= next_attempt):
+                    entry = remaining.pop(0)
+                    sock = socket.socket(*entry[0:3])
+                    sock.setblocking(0)
+                    err = sock.connect_ex(entry[4])
+                    if err not in _IN_PROGRESS:
+                        sock.close()
+                        error = socket.error(err, os.strerror(err))
+                        continue
+                    pending[sock] = entry
+                    next_attempt = now + self.attempt_delay
+                if remaining:
+                    wait = max(0.0, next_attempt - now)
+                    timeout = wait if timeout is None else min(timeout, wait)
+                for sock in _wait_writable(list(pending), timeout):
+                    entry = pending.pop(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        sock.setblocking(1)
+                        return sock, entry
+                    sock.close()
+                    error = socket.error(err, os.strerror(err))
+                    next_attempt = monotonic()
+            raise error
+        finally:
+            for sock in pending:
+                sock.close()
+
+    def _acquire_limit(self, host, gai):
+        if not gai:
+            return
+        key = (gai[0][4][0], host)
+        self.results['Limit-Elapsed'] = self.limiter.acquire(*key)
+        self._limit_key = key
+
+    def _release_limit(self):
+        if self._limit_key is not None:
+            self.limiter.release(*self._limit_key)
+            self._limit_key = None
+
+    def suspend_limit(self):
+        """Releases the slot under the limiter's caps held by the connection
+        left open by :meth:`.open`, while the connection is idle. The slot
+        must be taken again with :meth:`.resume_limit` before more commands
+        are sent.
+
+        """
+        if self._limit_key is not None:
+            self._idle_limit_key = self._limit_key
+            self._release_limit()
+
+    def resume_limit(self):
+        """Waits for the slot released by :meth:`.suspend_limit` and takes
+        it again. Since the connection is already open, the limiter's rates
+        do not apply.
+
+        """
+        key = self._idle_limit_key
+        if key is not None:
+            self._idle_limit_key = None
+            self.limiter.acquire(*key, paced=False)
+            self._limit_key = key
+
+    def _wrap_ssl(self, host=None):
+        context = self.ssl_context or get_default_context()
+        kwargs = {'server_hostname': host,
+                  'do_handshake_on_connect': False}
+        if self.ssl_sessions is not None:
+            self._ssl_key = (host, ) + tuple(self.sock.getpeername()[0:2])
+            session = self.ssl_sessions.get(self._ssl_key)
+            if session is not None:
+                kwargs['session'] = session
         with Timeout(self.ssl_timeout, 'SSL handshake timed out.') as timer:
-            self.sock = ssl.wrap_socket(self.sock)
+            self.sock.settimeout(timer.remaining())
+            self.sock = context.wrap_socket(self.sock, **kwargs)
             self.sock.do_handshake()
         self.results['Ssl-Elapsed'] = timer.elapsed
+        if self.ssl_sessions is not None and self.ssl_sessions.supported:
+            self.results['Ssl-Resumed'] = self.sock.session_reused
+
+    def _save_ssl_session(self):
+        # With TLS 1.3, the session ticket is only received after the
+        # handshake, so the session is saved once the banner has been read.
+        if self._ssl_key is not None:
+            session = getattr(self.sock, 'session', None)
+            self.ssl_sessions.set(self._ssl_key, session)
+
+    def _read_reply(self, timer):
+        buf = bytearray(self.max_banner_size)
+        view = memoryview(buf)
+        find = buf.find
+        recv_into = self.sock.recv_into
+        settimeout = self.sock.settimeout
+        length = 0
+        line_start = 0
+        end = None
+        while end is None:
+            if length >= len(buf):
+                msg = 'Received too much data from banner.'
+                raise BannerSyntaxError(msg)
+            settimeout(timer.remaining())
+            received = recv_into(view[length:])
+            if not received:
+                msg = 'Connection closed while receiving banner.'
+                raise BannerSyntaxError(msg)
+            newline = find(b'\n', length, length + received)
+            length += received
+            # Only the newly received bytes are scanned for line endings.
+            # Lines of a multi-line reply have a hyphen after the code, so
+            # the first line without one ends the reply.
+            while newline >= 0:
+                if buf[line_start+3:line_start+4] != b'-':
+                    end = newline + 1
+                    break
+                line_start = newline + 1
+                newline = find(b'\n', line_start, length)
+        return _to_str(view[0:end])
 
     def _get_banner(self):
         timeout_error = 'Receiving banner timed out.'
         with Timeout(self.banner_timeout, timeout_error) as timer:
-            received = ''
-            while True:
-                part = self.sock.recv(1024)
-                received = received + part
-                if received.endswith('\n'):
-                    ret = received
-                    break
-                if len(received) > 10240:
-                    msg = 'Received too much data from banner.'
-                    raise BannerSyntaxError(msg)
+            ret = self._read_reply(timer)
         self.results['Banner-Elapsed'] = timer.elapsed
         return ret
 
     def _check_banner(self, banner):
-        match = self.banner_pattern.match(banner)
-        if not match:
+        lines = _split_lines(banner)
+        matches = [self.banner_pattern.match(line) for line in lines]
+        if not lines or not all(matches):
+            raise BannerSyntaxError('Invalid banner received: '+repr(banner))
+        code = matches[0].group(1)
+        if any(match.group(1) != code for match in matches):
             raise BannerSyntaxError('Invalid banner received: '+repr(banner))
-        code = match.group(1)
-        message = match.group(2)
+        message = matches[0].group(2)
         self.results['Banner-Code'] = code
         self.results['Banner-Message'] = message
+        if len(lines) > 1:
+            self.results['Banner'] = banner
         if not code.startswith('2'):
             raise BannerError('Banner reported failure code: '+code)
         self.results['Status'] = 'OK'
 
+    def _classify_failure(self, stage, exc):
+        if isinstance(exc, BannerSyntaxError):
+            return failures.BANNER_SYNTAX
+        elif isinstance(exc, BannerError):
+            code = self.results.get('Banner-Code') or ''
+            return _BANNER_FAILURES.get(code[0:1], failures.BANNER_FAILED)
+        elif isinstance(exc, DNSError):
+            return failures.DNS_NO_ADDRESS
+        elif isinstance(exc, (Timeout, socket.timeout)):
+            return failures.TIMEOUTS.get(stage, failures.INTERNAL_ERROR)
+        elif stage == 'dns':
+            if isinstance(exc, socket.gaierror) and exc.args and \
+                    exc.args[0] in _NXDOMAIN_ERRORS:
+                return failures.DNS_NXDOMAIN
+            return failures.DNS_FAILED
+        elif stage == 'connect':
+            if isinstance(exc, socket.error) and exc.args:
+                return _CONNECT_FAILURES.get(exc.args[0],
+                                             failures.CONNECT_FAILED)
+            return failures.CONNECT_FAILED
+        elif stage == 'ssl':
+            return failures.TLS_FAILED
+        elif stage == 'banner' and isinstance(exc, socket.error):
+            return failures.BANNER_FAILED
+        return failures.INTERNAL_ERROR
+
+    def _record_exception(self, stage=None):
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        self.results['Failure'] = self._classify_failure(stage, exc_value)
+        self.results['Exception-Type'] = str(exc_type.__name__)
+        self.results['Exception-Value'] = str(exc_value)
+        if self.tracebacks:
+            import traceback
+            self.results['Exception-Traceback'] = \
+                repr(traceback.format_exc())
+
     def _close(self, with_ssl):
         if not self.sock:
             return
@@ -195,6 +640,7 @@ class SmtpHealthCheck(object):
         # important, and errors would short-circuit the proper output of the
         # health check.
         if with_ssl:
+            self._save_ssl_session()
             try:
                 self.sock = self.sock.unwrap()
             except socket.error:
@@ -217,47 +663,143 @@ class SmtpHealthCheck(object):
         :type with_ssl: bool
 
         """
+        adaptive = self.adaptive_timeouts
+        if adaptive is None:
+            self._run(with_ssl, host, port)
+            return
+        adaptive.apply((host, port), self)
+        self._run(with_ssl, host, port)
+        adaptive.update((host, port), self.results, with_ssl)
+
+    def run_address(self, address, with_ssl=False, host=None):
+        """Executes a single health check against one address that has
+        already been resolved, skipping the DNS lookup. This method may only be
+        called once per object.
+
+        :param address: One of the entries returned by
+                        :func:`socket.getaddrinfo`.
+        :type address: tuple
+        :param with_ssl: If ``True``, SSL will be initiated before attempting
+                         to get the banner message.
+        :type with_ssl: bool
+        :param host: The hostname the address was resolved from, which is used
+                     to verify the server certificate when using SSL.
+        :type host: str
+
+        """
+        adaptive = self.adaptive_timeouts
+        if adaptive is None:
+            self._run(with_ssl, host, gai=[address])
+            return
+        # Each address of a multi-homed host has timings of its own.
+        key = tuple(address[4][0:2])
+        adaptive.apply(key, self)
+        self._run(with_ssl, host, gai=[address])
+        adaptive.update(key, self.results, with_ssl, with_dns=False)
+
+    def open(self, host, port=25, with_ssl=False):
+        """Executes a single health check like :meth:`.run`, but if the
+        check succeeds, the connection is left open so that more commands may
+        be sent on :attr:`.sock`. The caller must then call :meth:`.close`.
+        This method may only be called once per object.
+
+        :param host: The hostname or IP address of the SMTP server to check.
+        :type host: str
+        :param port: The port number of the SMTP server to check.
+        :type port: int
+        :param with_ssl: If ``True``, SSL will be initiated before attempting
+                         to get the banner message.
+        :type with_ssl: bool
+        :returns: True if the connection was left open.
+        :rtype: bool
+
+        """
+        self._run(with_ssl, host, port, keep_open=True)
+        return self._open_ssl is not None
+
+    def close(self):
+        """Closes the connection left open by :meth:`.open`."""
+        with_ssl = self._open_ssl
+        if with_ssl is not None:
+            self._open_ssl = None
+            self._close(with_ssl)
+            self._release_limit()
+
+    def _get_stage_caller(self):
+        if self.hooks is None:
+            return _call_stage
+        return self.hooks.call
+
+    def _run(self, with_ssl, host=None, port=None, gai=None, keep_open=False):
+        call = self._get_stage_caller()
+        stage = None
         try:
-            dns_rec = self._lookup(host, port)
-            self._connect(dns_rec)
+            if gai is None:
+                stage = 'dns'
+                gai = call(self, stage, self._lookup, host, port)
+            if self.limiter is not None:
+                self._acquire_limit(host, gai)
+            stage = 'connect'
+            call(self, stage, self._connect, gai)
             if with_ssl:
-                self._wrap_ssl()
-            banner = self._get_banner()
-            self._check_banner(banner)
+                stage = 'ssl'
+                call(self, stage, self._wrap_ssl, host)
+            stage = 'banner'
+            banner = call(self, stage, self._get_banner)
+            stage = 'check'
+            call(self, stage, self._check_banner, banner)
         except Exception:
-            exc_type, exc_value, exc_tb = sys.exc_info()
-            self.results['Exception-Type'] = str(exc_type.__name__)
-            self.results['Exception-Value'] = str(exc_value)
-            self.results['Exception-Traceback'] = repr(traceback.format_exc())
+            self._record_exception(stage)
         finally:
-            self._close(with_ssl)
+            if keep_open and self.results['Status'] == 'OK':
+                self._open_ssl = with_ssl
+            else:
+                self._close(with_ssl)
+                self._release_limit()
+
+    def __getstate__(self):
+        # Only the results of a finished check are pickled, e.g. to be sent
+        # back from another process. Sockets and SSL contexts cannot be.
+        return {'results': self.results}
 
-    def output(self, stream):
-        """Outputs the results of :meth:`.run` to the given stream. The results
-        are presented similarly to HTTP headers, where each line has a key and
-        value, separated by ``: ``. The ``Status`` key will always be available
-        in the output.
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def write(self, writer, target=None):
+        """Writes the results of :meth:`.run` using the given writer.
+
+        :param writer: The writer for the desired output format.
+        :type writer: :class:`~smtphealth.output.ResultWriter`
+        :param target: If given, the target that was checked is included in
+                       the output.
+        :returns: A return code that would be appropriate to return to the
+                  operating system, e.g. zero means success, non-zero means
+                  failure.
+        :rtype: int
+
+        """
+        return writer.write(self.results, target)
+
+    def output(self, stream, fmt='header'):
+        """Outputs the results of :meth:`.run` to the given stream. By default,
+        the results are presented similarly to HTTP headers, where each line
+        has a key and value, separated by ``: ``. The ``Status`` key will
+        always be available in the output.
 
         :param stream: The output file to write to.
+        :param fmt: The output format, one of the keys of
+                    :data:`smtphealth.output.FORMATS`.
+        :type fmt: str
         :returns: A return code that would be appropriate to return to the
                   operating system, e.g. zero means success, non-zero means
                   failure.
         :rtype: int
 
         """
-        for key, val in self.results.items():
-            if isinstance(val, basestring):
-                print >> stream, '{0}: {1!s}'.format(key, val)
-            elif isinstance(val, float):
-                print >> stream, '{0}: {1:.5f}'.format(key, val)
-            elif val is None:
-                print >> stream, '{0}: '.format(key)
-            else:
-                print >> stream, '{0}: {1!s}'.format(key, val)
-        if self.results['Status'] == 'OK':
-            return 0
-        else:
-            return 1
+        writer = get_writer(fmt, stream)
+        ret = self.write(writer)
+        writer.flush()
+        return ret
 
 
 # vim:et:sts=4:sw=4:ts=4
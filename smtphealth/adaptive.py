@@ -0,0 +1,213 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Module containing timeouts that adapt to the latency observed from each
+host.
+
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+# Each stage of a check, with the key of its elapsed time in the results and
+# the attribute of its timeout on the check.
+_STAGES = (('dns', 'Dns-Elapsed', 'dns_timeout'),
+           ('connect', 'Connect-Elapsed', 'connect_timeout'),
+           ('ssl', 'Ssl-Elapsed', 'ssl_timeout'),
+           ('banner', 'Banner-Elapsed', 'banner_timeout'))
+
+
+class _Estimate(object):
+
+    __slots__ = ('mean', 'deviation', 'samples', 'backoff')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.deviation = 0.0
+        self.samples = 0
+        self.backoff = 1
+
+
+class AdaptiveTimeouts(object):
+    """Learns the latency of each stage of the checks of each host, and
+    derives timeouts from it, so that a hung host is given up on long before
+    a static timeout would expire. The estimate is a smoothed mean and mean
+    deviation, as used for TCP retransmission timeouts in RFC 6298, and the
+    timeout is the mean plus ``multiplier`` deviations.
+
+    When a stage times out, its timeout is doubled for the next check of the
+    host, up to the ceiling, so that a host that has become slower is not
+    failed forever. The next successful sample resets it.
+
+    The object is thread-safe and may be passed to any number of
+    :class:`~smtphealth.SmtpHealthCheck` objects, which use it in
+    :meth:`~smtphealth.SmtpHealthCheck.run`.
+
+    :param floor: The minimum timeout, in seconds, of any stage.
+    :type floor: float
+    :param ceiling: The maximum timeout, in seconds, of any stage. The static
+                    timeout given to each check is also a ceiling.
+    :type ceiling: float
+    :param multiplier: The number of mean deviations allowed above the mean.
+    :type multiplier: float
+    :param min_samples: The number of samples of a stage needed before its
+                        timeout adapts. Until then, the static timeout is
+                        used.
+    :type min_samples: int
+    :param gain: The weight of each new sample in the mean.
+    :type gain: float
+    :param deviation_gain: The weight of each new sample in the deviation.
+    :type deviation_gain: float
+
+    """
+
+    def __init__(self, floor=0.5, ceiling=None, multiplier=4.0,
+                 min_samples=3, gain=0.125, deviation_gain=0.25):
+        super(AdaptiveTimeouts, self).__init__()
+        self.floor = floor
+        self.ceiling = ceiling
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.gain = gain
+        self.deviation_gain = deviation_gain
+        self._estimates = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._estimates)
+
+    def _get_estimate(self, key, stage):
+        estimate = self._estimates.get((key, stage))
+        if estimate is None:
+            estimate = self._estimates[(key, stage)] = _Estimate()
+        return estimate
+
+    def get(self, key, stage, default=None):
+        """Returns the timeout of one stage of checks of a host.
+
+        :param key: Identifies the host, e.g. its name and port.
+        :param stage: The stage, one of ``dns``, ``connect``, ``ssl`` or
+                      ``banner``.
+        :type stage: str
+        :param default: The static timeout of the stage, which is also a
+                        ceiling.
+        :type default: float
+        :rtype: float
+
+        """
+        ceiling = self.ceiling
+        if default is not None and (ceiling is None or default < ceiling):
+            ceiling = default
+        with self._lock:
+            estimate = self._estimates.get((key, stage))
+            if estimate is None or estimate.samples < self.min_samples:
+                return ceiling
+            timeout = (estimate.mean + self.multiplier * estimate.deviation) \
+                * estimate.backoff
+        timeout = max(timeout, self.floor)
+        if ceiling is not None:
+            timeout = min(timeout, ceiling)
+        return timeout
+
+    def sample(self, key, stage, elapsed):
+        """Records the time taken by one stage of a check of a host.
+
+        :param key: Identifies the host.
+        :param stage: The stage.
+        :type stage: str
+        :param elapsed: The time taken by the stage, in seconds.
+        :type elapsed: float
+
+        """
+        with self._lock:
+            estimate = self._get_estimate(key, stage)
+            if estimate.samples == 0:
+                estimate.mean = elapsed
+                estimate.deviation = elapsed / 2.0
+            else:
+                error = abs(estimate.mean - elapsed)
+                estimate.deviation += self.deviation_gain * \
+                    (error - estimate.deviation)
+                estimate.mean += self.gain * (elapsed - estimate.mean)
+            estimate.samples += 1
+            estimate.backoff = 1
+
+    def timed_out(self, key, stage):
+        """Records that one stage of a check of a host timed out, doubling
+        its next timeout.
+
+        :param key: Identifies the host.
+        :param stage: The stage.
+        :type stage: str
+
+        """
+        with self._lock:
+            estimate = self._get_estimate(key, stage)
+            if estimate.samples >= self.min_samples:
+                estimate.backoff = min(estimate.backoff * 2, 1024)
+
+    def apply(self, key, check):
+        """Sets the timeout of each stage of the check from the estimates of
+        the host. The check's existing timeouts act as ceilings.
+
+        :param key: Identifies the host.
+        :param check: The check about to run.
+        :type check: :class:`~smtphealth.SmtpHealthCheck`
+
+        """
+        for stage, elapsed_key, attr in _STAGES:
+            setattr(check, attr, self.get(key, stage, getattr(check, attr)))
+
+    def update(self, key, results, with_ssl=False, with_dns=True):
+        """Records the stage timings from the results of a check of a host.
+        Cached DNS lookups are not counted, and if the check timed out, the
+        first stage without a timing is counted as timing out.
+
+        :param key: Identifies the host.
+        :param results: The :attr:`~smtphealth.SmtpHealthCheck.results` of a
+                        finished check.
+        :type results: dict
+        :param with_ssl: Whether the check initiated SSL.
+        :type with_ssl: bool
+        :param with_dns: Whether the check looked up the host, rather than
+                         being given its address.
+        :type with_dns: bool
+
+        """
+        timed_out = results.get('Exception-Type') == 'Timeout'
+        for stage, elapsed_key, attr in _STAGES:
+            if stage == 'ssl' and not with_ssl:
+                continue
+            if stage == 'dns' and not with_dns:
+                continue
+            elapsed = results.get(elapsed_key)
+            if elapsed is None:
+                if timed_out:
+                    self.timed_out(key, stage)
+                break
+            if stage != 'dns' or not results.get('Dns-Cached'):
+                self.sample(key, stage, elapsed)
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,138 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing a health check that covers every address of a
+multi-homed SMTP service.
+
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from . import SmtpHealthCheck, DNSError
+from . import failures
+
+
+class AllAddressesCheck(SmtpHealthCheck):
+    """Resolves the SMTP server hostname and then checks every address it
+    resolves to in parallel, rather than only the first. The service is only
+    considered healthy if every address is healthy. The constructor takes the
+    same arguments as :class:`~smtphealth.SmtpHealthCheck`, which are also used
+    for each per-address check.
+
+    After :meth:`.run`, the :attr:`.results` summarize the whole service and
+    :attr:`.checks` holds the check of each address, in DNS order.
+
+    """
+
+    #: The class instantiated for each address.
+    check_class = SmtpHealthCheck
+
+    def __init__(self, *args, **kwargs):
+        super(AllAddressesCheck, self).__init__(*args, **kwargs)
+        self._check_args = args
+        self._check_kwargs = kwargs
+
+        #: List of the :class:`~smtphealth.SmtpHealthCheck` objects run
+        #: against each resolved address.
+        self.checks = []
+
+    def __getstate__(self):
+        return {'results': self.results, 'checks': self.checks}
+
+    def _check_address(self, check, address, with_ssl, host):
+        check.run_address(address, with_ssl, host)
+
+    def run(self, host, port=25, with_ssl=False):
+        """Resolves the hostname and checks each of its addresses in
+        parallel. This method may only be called once per object.
+
+        :param host: The hostname or IP address of the SMTP server to check.
+        :type host: str
+        :param port: The port number of the SMTP server to check.
+        :type port: int
+        :param with_ssl: If ``True``, SSL will be initiated before attempting
+                         to get the banner message.
+        :type with_ssl: bool
+
+        """
+        adaptive = self.adaptive_timeouts
+        if adaptive is None:
+            self._run_addresses(host, port, with_ssl)
+            return
+        # Only the lookup uses the estimates of the host. The check of each
+        # address keeps estimates of its own.
+        adaptive.apply((host, port), self)
+        self._run_addresses(host, port, with_ssl)
+        adaptive.update((host, port), self.results, with_ssl)
+
+    def _run_addresses(self, host, port, with_ssl):
+        stage = self._get_stage_caller()
+        try:
+            gai = stage(self, 'dns', self._lookup, host, port)
+            if len(gai) < 1:
+                raise DNSError('DNS lookup returned no results.')
+        except Exception:
+            self._record_exception('dns')
+            return
+        self.checks = [self.check_class(*self._check_args,
+                                        **self._check_kwargs)
+                       for address in gai]
+        threads = []
+        for check, address in zip(self.checks, gai):
+            thread = threading.Thread(target=self._check_address,
+                                      args=(check, address, with_ssl, host))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        healthy = [check for check in self.checks
+                   if check.results['Status'] == 'OK']
+        self.results['Addresses'] = len(self.checks)
+        self.results['Addresses-Ok'] = len(healthy)
+        if self.checks and len(healthy) == len(self.checks):
+            self.results['Status'] = 'OK'
+        else:
+            self.results['Failure'] = failures.ADDRESSES_FAILED
+
+    def write(self, writer, target=None):
+        """Writes the summary :attr:`.results` followed by the results of
+        each address. See :meth:`smtphealth.SmtpHealthCheck.write`.
+
+        :param writer: The writer for the desired output format.
+        :type writer: :class:`~smtphealth.output.ResultWriter`
+        :param target: If given, the target that was checked is included in
+                       the summary.
+        :returns: A return code that would be appropriate to return to the
+                  operating system, zero only if every address was healthy.
+        :rtype: int
+
+        """
+        ret = super(AllAddressesCheck, self).write(writer, target)
+        for check in self.checks:
+            check.write(writer)
+        return ret
+
+
+# vim:et:sts=4:sw=4:ts=4
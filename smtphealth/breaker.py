@@ -0,0 +1,216 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Module containing a circuit breaker, which stops checking targets that
+keep failing and re-checks them with exponential backoff.
+
+"""
+
+from __future__ import absolute_import
+
+import random
+import threading
+
+from . import monotonic
+
+#: The circuit of a target that is checked normally.
+CLOSED = 'CLOSED'
+
+#: The circuit of a target that is skipped until its next retry.
+OPEN = 'OPEN'
+
+#: The circuit of a target whose retry check is in progress.
+HALF_OPEN = 'HALF-OPEN'
+
+
+class _Circuit(object):
+
+    __slots__ = ('state', 'failures', 'delay', 'retry_at', 'results')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.delay = 0.0
+        self.retry_at = 0.0
+        self.results = None
+
+
+class CircuitBreaker(object):
+    """Tracks the circuit of each target. A target's circuit opens after it
+    fails ``failures`` checks in a row, and while it is open the target is
+    skipped rather than checked. Once its retry delay passes, the circuit is
+    half-open and one check is allowed through. If that check succeeds the
+    circuit closes, otherwise it opens again with double the delay, up to
+    ``max_delay``. Each delay is shortened by a random fraction, up to
+    ``jitter``, so that targets that failed together are not all retried
+    together.
+
+    The breaker is thread-safe. It is usually given to a
+    :class:`~smtphealth.engine.CheckEngine`, which reports skipped targets
+    with their last known results.
+
+    :param failures: The number of failed checks in a row that opens the
+                     circuit of a target.
+    :type failures: int
+    :param delay: The number of seconds to wait before the first retry.
+    :type delay: float
+    :param max_delay: The maximum number of seconds between retries.
+    :type max_delay: float
+    :param jitter: The maximum fraction of each delay removed at random.
+    :type jitter: float
+
+    """
+
+    def __init__(self, failures=3, delay=30.0, max_delay=600.0, jitter=0.5):
+        super(CircuitBreaker, self).__init__()
+        if failures < 1:
+            raise ValueError('Failures must be at least one.')
+        self.failures = failures
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._circuits)
+
+    def state(self, target):
+        """Returns the state of the circuit of a target.
+
+        :param target: The target.
+        :returns: :data:`CLOSED`, :data:`OPEN` or :data:`HALF_OPEN`.
+
+        """
+        circuit = self._circuits.get(target)
+        if circuit is None:
+            return CLOSED
+        return circuit.state
+
+    def allow(self, target, now=None):
+        """Decides whether a target should be checked now. An open circuit
+        whose retry delay has passed becomes half-open, and allows one check.
+
+        :param target: The target.
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :rtype: bool
+
+        """
+        with self._lock:
+            return self._allow(self._circuits.get(target), now)
+
+    def _allow(self, circuit, now):
+        if circuit is None or circuit.state == CLOSED:
+            return True
+        if now is None:
+            now = monotonic()
+        if circuit.state == OPEN and now >= circuit.retry_at:
+            circuit.state = HALF_OPEN
+            return True
+        return False
+
+    def skip(self, target, now=None):
+        """Decides whether a target should be checked now, as with
+        :meth:`.allow`, and if not, returns the results to report instead, as
+        with :meth:`.skipped`. Both happen at once, so a check of the same
+        target that finishes in between cannot close the circuit before its
+        results are taken.
+
+        :param target: The target.
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :returns: ``None`` if the target should be checked, otherwise the
+                  results of a skipped check.
+        :rtype: dict
+
+        """
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if self._allow(circuit, now):
+                return None
+            results, retry_at = self._skipped(circuit)
+        results['Circuit-Retry'] = max(0.0, retry_at - now)
+        return results
+
+    def _open(self, circuit, now):
+        if circuit.state == HALF_OPEN:
+            circuit.delay = min(circuit.delay * 2.0, self.max_delay)
+        else:
+            circuit.delay = min(self.delay, self.max_delay)
+        circuit.state = OPEN
+        delay = circuit.delay * (1.0 - random.uniform(0.0, self.jitter))
+        circuit.retry_at = now + delay
+
+    def record(self, target, results, now=None):
+        """Records the results of a check of a target.
+
+        :param target: The target.
+        :param results: The :attr:`~smtphealth.SmtpHealthCheck.results` of
+                        the finished check.
+        :type results: dict
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+
+        """
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if results.get('Status') == 'OK':
+                if circuit is not None:
+                    del self._circuits[target]
+                return
+            if circuit is None:
+                circuit = self._circuits[target] = _Circuit()
+            circuit.failures += 1
+            circuit.results = results
+            if circuit.state == HALF_OPEN or \
+                    circuit.failures >= self.failures:
+                self._open(circuit, monotonic() if now is None else now)
+
+    def _skipped(self, circuit):
+        results = dict(circuit.results)
+        results['Circuit'] = circuit.state
+        return results, circuit.retry_at
+
+    def skipped(self, target, now=None):
+        """Returns the results to report for a target that was skipped, which
+        are its last known results with the ``Circuit`` and ``Circuit-Retry``
+        keys added. The retry is the number of seconds until the next check.
+
+        :param target: The target.
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :rtype: dict
+
+        """
+        with self._lock:
+            results, retry_at = self._skipped(self._circuits[target])
+        if now is None:
+            now = monotonic()
+        results['Circuit-Retry'] = max(0.0, retry_at - now)
+        return results
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,130 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing a cache of DNS lookup results that may be shared by many
+health checks.
+
+"""
+
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+
+from . import monotonic
+
+
+class DnsCache(object):
+    """Caches the results of DNS lookups, so that checks run repeatedly
+    against the same hosts do not wait on the resolver every time. Failed
+    lookups are cached as well, for a separate length of time. The cache is
+    thread-safe and may be passed to any number of
+    :class:`~smtphealth.SmtpHealthCheck` objects.
+
+    :param max_size: The maximum number of entries to keep. Once full, the
+                     least recently used entry is evicted.
+    :type max_size: int
+    :param ttl: The number of seconds to cache successful lookups.
+    :type ttl: float
+    :param negative_ttl: The number of seconds to cache failed lookups.
+    :type negative_ttl: float
+
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0, negative_ttl=30.0):
+        super(DnsCache, self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        #: The number of lookups that were served from the cache.
+        self.hits = 0
+
+        #: The number of lookups that were not in the cache, or had expired.
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached result of a lookup.
+
+        :param key: Identifies the lookup, e.g. the arguments given to
+                    :func:`socket.getaddrinfo`.
+        :returns: The cached result.
+        :raises: :exc:`KeyError` if the result is not cached or has expired.
+                 If the cached lookup failed, a copy of its exception is
+                 raised instead.
+
+        """
+        with self._lock:
+            try:
+                expires, value, error = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            if expires <= monotonic():
+                self.misses += 1
+                raise KeyError(key)
+            self._entries[key] = (expires, value, error)
+            self.hits += 1
+        if error is not None:
+            raise type(error)(*error.args)
+        return value
+
+    def _store(self, key, ttl, value, error):
+        if ttl <= 0.0 or self.max_size < 1:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+            self._entries[key] = (monotonic() + ttl, value, error)
+
+    def set(self, key, value):
+        """Caches the result of a successful lookup.
+
+        :param key: Identifies the lookup.
+        :param value: The result of the lookup.
+
+        """
+        self._store(key, self.ttl, value, None)
+
+    def set_error(self, key, error):
+        """Caches the exception raised by a failed lookup.
+
+        :param key: Identifies the lookup.
+        :param error: The exception raised by the lookup.
+        :type error: :exc:`Exception`
+
+        """
+        self._store(key, self.negative_ttl, None, error)
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+
+# vim:et:sts=4:sw=4:ts=4
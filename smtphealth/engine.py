@@ -0,0 +1,179 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing an engine for running many health checks concurrently
+from a single process.
+
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+from . import SmtpHealthCheck
+
+
+_DONE = object()
+
+# Blocking forever on a queue cannot be interrupted by signals in Python 2, so
+# waits are broken up into intervals of this many seconds.
+_POLL_INTERVAL = 1.0
+
+
+class CheckEngine(object):
+    """Runs the :class:`~smtphealth.SmtpHealthCheck` pipeline against many
+    targets at once, using a fixed number of worker threads. Each target gets
+    its own check object, so the results contain the same keys as a single
+    :meth:`~smtphealth.SmtpHealthCheck.run`.
+
+    :param concurrency: The maximum number of checks in progress at once.
+    :type concurrency: int
+    :param breaker: If given, targets whose circuit is open are not checked.
+                    Instead, their check is given the results from
+                    :meth:`~smtphealth.breaker.CircuitBreaker.skip`.
+    :type breaker: :class:`~smtphealth.breaker.CircuitBreaker`
+    :param check_kwargs: Keyword arguments passed in to the constructor of
+                         each :class:`~smtphealth.SmtpHealthCheck`, e.g.
+                         ``connect_timeout``.
+
+    """
+
+    #: The class instantiated for each target.
+    check_class = SmtpHealthCheck
+
+    def __init__(self, concurrency=100, breaker=None, **check_kwargs):
+        super(CheckEngine, self).__init__()
+        if concurrency < 1:
+            raise ValueError('Concurrency must be at least one.')
+        self.concurrency = concurrency
+        self.breaker = breaker
+        self.check_kwargs = check_kwargs
+
+    def _check(self, target):
+        host, port, with_ssl = target
+        check = self.check_class(**self.check_kwargs)
+        breaker = self.breaker
+        if breaker is None:
+            check.run(host, port, with_ssl)
+            return check
+        skipped = breaker.skip(target)
+        if skipped is None:
+            check.run(host, port, with_ssl)
+            breaker.record(target, check.results)
+        else:
+            check.results = skipped
+        return check
+
+    def _feed(self, items, pending, stop):
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                pending.put(item)
+        finally:
+            for i in range(self.concurrency):
+                pending.put(_DONE)
+
+    def _finish(self, finished, item, stop):
+        while not stop.is_set():
+            try:
+                finished.put(item, True, _POLL_INTERVAL)
+            except Full:
+                continue
+            break
+
+    def _work(self, pending, finished, stop):
+        try:
+            while True:
+                item = pending.get()
+                if item is _DONE:
+                    break
+                elif stop.is_set():
+                    continue
+                key, target = item
+                self._finish(finished, (key, self._check(target)), stop)
+        finally:
+            self._finish(finished, _DONE, stop)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _run(self, items):
+        pending = Queue(self.concurrency)
+        finished = Queue(self.concurrency)
+        stop = threading.Event()
+        self._start(self._feed, items, pending, stop)
+        for i in range(self.concurrency):
+            self._start(self._work, pending, finished, stop)
+        workers = self.concurrency
+        try:
+            while workers > 0:
+                try:
+                    item = finished.get(True, _POLL_INTERVAL)
+                except Empty:
+                    continue
+                if item is _DONE:
+                    workers -= 1
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+    def run(self, targets):
+        """Checks every target, yielding each one as soon as its check
+        finishes. Results are therefore produced in completion order, not in
+        the order of ``targets``. If the caller is slow to consume them, the
+        workers wait rather than buffering finished checks without limit.
+
+        :param targets: Iterable of ``(host, port, with_ssl)`` tuples. This
+                        is consumed lazily, so it may be a generator.
+        :returns: Generator of ``(target, check)`` tuples, where ``check``
+                  is the finished :class:`~smtphealth.SmtpHealthCheck`.
+
+        """
+        return self._run((target, target) for target in targets)
+
+    def run_all(self, targets):
+        """Checks every target and waits for all of them to finish.
+
+        :param targets: Iterable of ``(host, port, with_ssl)`` tuples.
+        :returns: List of finished :class:`~smtphealth.SmtpHealthCheck`
+                  objects, in the same order as ``targets``.
+        :rtype: list
+
+        """
+        targets = list(targets)
+        checks = [None] * len(targets)
+        for i, check in self._run(enumerate(targets)):
+            checks[i] = check
+        return checks
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,328 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing an HTTP endpoint that exposes the latest health check
+results in the OpenMetrics text format, e.g. for Prometheus to scrape.
+
+"""
+
+from __future__ import absolute_import
+
+import time
+import bisect
+import threading
+from collections import OrderedDict
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+#: The content type of the rendered metrics.
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+#: The default upper bounds, in seconds, of the stage latency buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+_STAGES = (('Dns-Elapsed', 'dns'), ('Connect-Elapsed', 'connect'),
+           ('Ssl-Elapsed', 'ssl'), ('Banner-Elapsed', 'banner'),
+           ('Session-Rtt', 'probe'))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _labels(**labels):
+    return ','.join('{0}="{1}"'.format(key, _escape(val))
+                    for key, val in sorted(labels.items()))
+
+
+def _number(value):
+    return repr(float(value))
+
+
+class _TargetMetrics(object):
+
+    __slots__ = ('up', 'banner_code', 'checks', 'timestamp', 'exceptions',
+                 'stages', 'rendered')
+
+    def __init__(self):
+        self.up = 0
+        self.banner_code = ''
+        self.checks = 0
+        self.timestamp = 0.0
+        self.exceptions = {}
+        # Only the stages that a target has reached are kept.
+        self.stages = {}
+        # The number of checks and the lines rendered from them.
+        self.rendered = None
+
+    def copy(self):
+        copy = _TargetMetrics()
+        copy.up = self.up
+        copy.banner_code = self.banner_code
+        copy.checks = self.checks
+        copy.timestamp = self.timestamp
+        copy.exceptions = self.exceptions.copy()
+        copy.stages = dict((stage, [list(counts), total]) for
+                           stage, (counts, total) in self.stages.items())
+        return copy
+
+
+def _observe(stages, stage, index, elapsed, size):
+    histogram = stages.get(stage)
+    if histogram is None:
+        histogram = stages[stage] = [[0] * size, 0.0]
+    histogram[0][index] += 1
+    histogram[1] += elapsed
+
+
+class MetricsExporter(object):
+    """Keeps the latest results of every target, along with counters and
+    latency histograms accumulated from all previous results, and renders
+    them in the OpenMetrics text format. The lines of each target are cached
+    until its next result, so a scrape only renders the targets checked since
+    the previous one, and checks only wait for the exporter while it copies
+    those targets.
+
+    :param buckets: The upper bounds, in seconds, of the stage latency
+                    histogram buckets.
+    :type buckets: tuple
+    :param target_histograms: If false, a single latency histogram of each
+                              stage is kept for all targets, rather than one
+                              for each target. This makes scrapes of a large
+                              inventory many times smaller.
+    :type target_histograms: bool
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, target_histograms=True):
+        super(MetricsExporter, self).__init__()
+        self.buckets = tuple(sorted(buckets))
+        self.target_histograms = target_histograms
+        self._bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+        self._targets = OrderedDict()
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot = None
+
+    def update(self, target, results):
+        """Records the results of a finished check.
+
+        :param target: The target that was checked, whose string form is used
+                       as the ``target`` label.
+        :param results: The :attr:`~smtphealth.SmtpHealthCheck.results` of
+                        the check.
+        :type results: dict
+
+        """
+        name = str(target)
+        size = len(self.buckets) + 1
+        with self._lock:
+            metrics = self._targets.get(name)
+            if metrics is None:
+                metrics = self._targets[name] = _TargetMetrics()
+            metrics.up = 1 if results.get('Status') == 'OK' else 0
+            metrics.banner_code = results.get('Banner-Code') or ''
+            metrics.checks += 1
+            metrics.timestamp = time.time()
+            exc_type = results.get('Exception-Type')
+            if exc_type is not None:
+                metrics.exceptions[exc_type] = \
+                    metrics.exceptions.get(exc_type, 0) + 1
+            if self.target_histograms:
+                stages = metrics.stages
+            else:
+                stages = self._stages
+            for key, stage in _STAGES:
+                elapsed = results.get(key)
+                if elapsed is None:
+                    continue
+                index = bisect.bisect_left(self.buckets, elapsed)
+                _observe(stages, stage, index, elapsed, size)
+            self._version += 1
+            self._snapshot = None
+
+    def remove(self, target):
+        """Stops exposing the metrics of a target.
+
+        :param target: The target to remove.
+
+        """
+        with self._lock:
+            if self._targets.pop(str(target), None) is not None:
+                self._version += 1
+                self._snapshot = None
+
+    def _render_histogram(self, lines, stage, counts, total, target=None):
+        add = lines.append
+        if target is None:
+            labels = _labels(stage=stage)
+        else:
+            labels = _labels(stage=stage, target=target)
+        cumulative = 0
+        for bound, count in zip(self._bounds, counts):
+            cumulative += count
+            add('smtp_health_stage_seconds_bucket{le="')
+            add(bound)
+            add('",')
+            add(labels)
+            add('} ')
+            add(str(cumulative))
+            add('\n')
+        add('smtp_health_stage_seconds_count{{{0}}} {1}\n'
+            'smtp_health_stage_seconds_sum{{{0}}} {2}\n'.format(
+                labels, cumulative, _number(total)))
+
+    def _render_target(self, name, metrics):
+        target = _labels(target=name)
+        up = 'smtp_health_up{{{0}}} {1}\n'.format(
+            _labels(target=name, banner_code=metrics.banner_code),
+            metrics.up)
+        timestamp = 'smtp_health_last_check_timestamp_seconds{{{0}}} ' \
+            '{1}\n'.format(target, _number(metrics.timestamp))
+        checks = 'smtp_health_checks_total{{{0}}} {1}\n'.format(
+            target, metrics.checks)
+        exceptions = ''.join(
+            'smtp_health_exceptions_total{{{0}}} {1}\n'.format(
+                _labels(target=name, type=exc_type), count)
+            for exc_type, count in sorted(metrics.exceptions.items()))
+        histograms = []
+        for key, stage in _STAGES:
+            histogram = metrics.stages.get(stage)
+            if histogram is not None:
+                self._render_histogram(histograms, stage, *histogram,
+                                       target=name)
+        return tuple(part.encode('utf-8') for part in
+                     (up, timestamp, checks, exceptions,
+                      ''.join(histograms)))
+
+    def _render(self, rendered, stages):
+        lines = []
+        add = lines.append
+        families = list(zip(*rendered)) or [()] * 5
+        add(b'# TYPE smtp_health_up gauge\n')
+        add(b'# HELP smtp_health_up Whether the last check was healthy.\n')
+        lines.extend(families[0])
+        add(b'# TYPE smtp_health_last_check_timestamp_seconds gauge\n')
+        add(b'# HELP smtp_health_last_check_timestamp_seconds '
+            b'When the last check finished.\n')
+        lines.extend(families[1])
+        add(b'# TYPE smtp_health_checks counter\n')
+        add(b'# HELP smtp_health_checks The number of checks run.\n')
+        lines.extend(families[2])
+        add(b'# TYPE smtp_health_exceptions counter\n')
+        add(b'# HELP smtp_health_exceptions The number of failed checks, '
+            b'by exception type.\n')
+        lines.extend(families[3])
+        add(b'# TYPE smtp_health_stage_seconds histogram\n')
+        add(b'# HELP smtp_health_stage_seconds The time taken by each stage '
+            b'of the checks.\n')
+        lines.extend(families[4])
+        histograms = []
+        for key, stage in _STAGES:
+            histogram = stages.get(stage)
+            if histogram is not None:
+                self._render_histogram(histograms, stage, *histogram)
+        add(''.join(histograms).encode('utf-8'))
+        add(b'# EOF\n')
+        return b''.join(lines)
+
+    def render(self):
+        """Returns the current metrics in the OpenMetrics text format.
+
+        :rtype: bytes
+
+        """
+        rendered = []
+        stale = []
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            version = self._version
+            for name, metrics in self._targets.items():
+                cached = metrics.rendered
+                if cached is not None and cached[0] == metrics.checks:
+                    rendered.append(cached[1])
+                else:
+                    stale.append((len(rendered), name, metrics,
+                                  metrics.copy()))
+                    rendered.append(None)
+            stages = dict((stage, [list(counts), total]) for
+                          stage, (counts, total) in self._stages.items())
+        for i, name, metrics, copy in stale:
+            lines = self._render_target(name, copy)
+            metrics.rendered = (copy.checks, lines)
+            rendered[i] = lines
+        snapshot = self._render(rendered, stages)
+        with self._lock:
+            if self._version == version:
+                self._snapshot = snapshot
+        return snapshot
+
+    def serve(self, address='', port=9465):
+        """Starts serving the rendered metrics over HTTP, at any path, from a
+        background thread.
+
+        :param address: The address to listen on.
+        :type address: str
+        :param port: The port to listen on.
+        :type port: int
+        :returns: The HTTP server, which may be stopped with its
+                  ``shutdown()`` method.
+
+        """
+        server = _MetricsServer((address, port), _MetricsHandler)
+        server.exporter = self
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = self.server.exporter.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# vim:et:sts=4:sw=4:ts=4
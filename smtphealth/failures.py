@@ -0,0 +1,118 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing the codes that classify why a health check failed. A
+failed check reports one of these as its ``Failure`` result, which is much
+cheaper to produce and to compare than a formatted traceback.
+
+"""
+
+#: The hostname does not exist.
+DNS_NXDOMAIN = 'DNS_NXDOMAIN'
+
+#: The DNS lookup did not finish in time.
+DNS_TIMEOUT = 'DNS_TIMEOUT'
+
+#: The hostname exists but has no addresses of the requested family.
+DNS_NO_ADDRESS = 'DNS_NO_ADDRESS'
+
+#: The DNS lookup failed for any other reason, e.g. a server failure.
+DNS_FAILED = 'DNS_FAILED'
+
+#: The server actively refused the connection.
+CONNECT_REFUSED = 'CONNECT_REFUSED'
+
+#: The connection was not established in time.
+CONNECT_TIMEOUT = 'CONNECT_TIMEOUT'
+
+#: There is no route to the server.
+CONNECT_UNREACHABLE = 'CONNECT_UNREACHABLE'
+
+#: The connection failed for any other reason.
+CONNECT_FAILED = 'CONNECT_FAILED'
+
+#: The SSL handshake did not finish in time.
+TLS_TIMEOUT = 'TLS_TIMEOUT'
+
+#: The SSL handshake failed, e.g. because the certificate was not trusted.
+TLS_FAILED = 'TLS_FAILED'
+
+#: The complete banner was not received in time.
+BANNER_TIMEOUT = 'BANNER_TIMEOUT'
+
+#: The banner was malformed, too long, or cut off by the server.
+BANNER_SYNTAX = 'BANNER_SYNTAX'
+
+#: The banner reported a temporary failure code, e.g. 421.
+BANNER_4XX = 'BANNER_4XX'
+
+#: The banner reported a permanent failure code, e.g. 554.
+BANNER_5XX = 'BANNER_5XX'
+
+#: The banner could not be received, or reported another non-2xx code.
+BANNER_FAILED = 'BANNER_FAILED'
+
+#: The check itself raised an unexpected error.
+INTERNAL_ERROR = 'INTERNAL_ERROR'
+
+#: The mail domain publishes a null MX record, so it does not accept mail.
+MX_NULL = 'MX_NULL'
+
+#: Too few of the MX hosts of a mail domain were healthy to satisfy the
+#: policy of the check.
+MX_FAILED = 'MX_FAILED'
+
+#: A probe of a kept-alive session received no reply in time.
+SESSION_TIMEOUT = 'SESSION_TIMEOUT'
+
+#: A probe of a kept-alive session failed, e.g. because the connection was
+#: reset.
+SESSION_FAILED = 'SESSION_FAILED'
+
+#: The reply to a probe was malformed.
+REPLY_SYNTAX = 'REPLY_SYNTAX'
+
+#: The reply to a probe reported a temporary failure code, e.g. 421.
+REPLY_4XX = 'REPLY_4XX'
+
+#: The reply to a probe reported a permanent failure code, e.g. 502.
+REPLY_5XX = 'REPLY_5XX'
+
+#: At least one of the addresses of a multi-homed host was unhealthy.
+ADDRESSES_FAILED = 'ADDRESSES_FAILED'
+
+#: Every failure code. Compact formats identify codes by their index here, so
+#: new codes must only be appended.
+FAILURES = (DNS_NXDOMAIN, DNS_TIMEOUT, DNS_NO_ADDRESS, DNS_FAILED,
+            CONNECT_REFUSED, CONNECT_TIMEOUT, CONNECT_UNREACHABLE,
+            CONNECT_FAILED, TLS_TIMEOUT, TLS_FAILED, BANNER_TIMEOUT,
+            BANNER_SYNTAX, BANNER_4XX, BANNER_5XX, BANNER_FAILED,
+            INTERNAL_ERROR, MX_NULL, MX_FAILED, SESSION_TIMEOUT,
+            SESSION_FAILED, REPLY_SYNTAX, REPLY_4XX, REPLY_5XX,
+            ADDRESSES_FAILED)
+
+#: The failure code of a timeout in each stage of a check.
+TIMEOUTS = {'dns': DNS_TIMEOUT, 'connect': CONNECT_TIMEOUT,
+            'ssl': TLS_TIMEOUT, 'banner': BANNER_TIMEOUT}
+
+
+# vim:et:sts=4:sw=4:ts=4
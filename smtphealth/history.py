@@ -0,0 +1,309 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Module containing a compact, persistent history of the recent results of
+each target.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import mmap
+import math
+import time
+import struct
+import threading
+from collections import namedtuple
+
+from .failures import FAILURES
+
+_MAGIC = b'SMTPHIST'
+_HEADER = struct.Struct('=8sIII')
+_SLOT = struct.Struct('=256sII')
+_RECORD = struct.Struct('=dBBH4f')
+
+_KEY_SIZE = 256
+_NAN = float('nan')
+
+_FLAG_OK = 0x1
+_FLAG_DNS_CACHED = 0x2
+_FLAG_SSL_RESUMED = 0x4
+
+# Failure codes are stored as one plus their index, so that zero means none.
+_FAILURE_IDS = dict((code, i + 1) for i, code in enumerate(FAILURES))
+
+_TIMINGS = ('Dns-Elapsed', 'Connect-Elapsed', 'Ssl-Elapsed',
+            'Banner-Elapsed')
+
+
+def _timing(value):
+    if math.isnan(value):
+        return None
+    return value
+
+
+class HistoryRecord(namedtuple('HistoryRecord', 'timestamp status '
+                                                'banner_code dns_cached '
+                                                'ssl_resumed dns_elapsed '
+                                                'connect_elapsed ssl_elapsed '
+                                                'banner_elapsed failure')):
+    """One result kept by a :class:`ResultHistory`. Timings are ``None`` if
+    the stage did not finish, ``banner_code`` is ``None`` if no banner was
+    received, and ``failure`` is the code from :mod:`smtphealth.failures`, or
+    ``None``. Timings are stored with single precision.
+
+    """
+    __slots__ = ()
+
+    @property
+    def healthy(self):
+        """True if the check reported an ``OK`` status."""
+        return self.status == 'OK'
+
+
+class ResultHistory(object):
+    """Keeps the last ``size`` results of each target in fixed-size records,
+    arranged as one ring buffer per target. Appending a result and reading
+    the most recent results are both constant-time, regardless of how much
+    history has been kept. The history is thread-safe.
+
+    If ``filename`` is given, the history lives in that file, memory-mapped,
+    and survives restarts. An existing file must have been created with the
+    same ``size`` and ``max_targets``.
+
+    :param filename: The file to keep the history in, or ``None`` to keep it
+                     only in memory.
+    :type filename: str
+    :param size: The number of results kept for each target.
+    :type size: int
+    :param max_targets: The maximum number of targets that may be kept.
+    :type max_targets: int
+    :raises: ValueError
+
+    """
+
+    def __init__(self, filename=None, size=64, max_targets=1024):
+        super(ResultHistory, self).__init__()
+        if size < 1 or max_targets < 1:
+            raise ValueError('History size and targets must be at least one.')
+        self.size = size
+        self.max_targets = max_targets
+        self._ring_size = size * _RECORD.size
+        self._slots_offset = _HEADER.size
+        self._rings_offset = self._slots_offset + max_targets * _SLOT.size
+        length = self._rings_offset + max_targets * self._ring_size
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._file = None
+        if filename is None:
+            self._map = mmap.mmap(-1, length)
+            self._initialize()
+            return
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self._file = open(filename, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(length)
+        elif os.path.getsize(filename) != length:
+            self._file.close()
+            raise ValueError('History file does not match size and targets.')
+        self._map = mmap.mmap(self._file.fileno(), length)
+        if exists:
+            self._load()
+        else:
+            self._initialize()
+
+    def _initialize(self):
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.size, self.max_targets,
+                          0)
+
+    def _load(self):
+        magic, size, max_targets, used = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or size != self.size or \
+                max_targets != self.max_targets:
+            self.close()
+            raise ValueError('History file does not match size and targets.')
+        for index in range(used):
+            key = _SLOT.unpack_from(self._map, self._slot_offset(index))[0]
+            self._slots[key.rstrip(b'\0')] = index
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, target):
+        return self._key(target) in self._slots
+
+    def _key(self, target):
+        key = str(target)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return key
+
+    def _slot_offset(self, index):
+        return self._slots_offset + index * _SLOT.size
+
+    def _record_offset(self, index, position):
+        return self._rings_offset + index * self._ring_size + \
+            position * _RECORD.size
+
+    def _add_slot(self, key):
+        if len(key) > _KEY_SIZE:
+            raise ValueError('Target is too long: ' + repr(key))
+        index = len(self._slots)
+        if index >= self.max_targets:
+            raise ValueError('History is full.')
+        _SLOT.pack_into(self._map, self._slot_offset(index), key, 0, 0)
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.size, self.max_targets,
+                          index + 1)
+        self._slots[key] = index
+        return index
+
+    def targets(self):
+        """Returns the keys of every target with history, which are the
+        targets converted to strings.
+
+        :rtype: list
+
+        """
+        return [key.decode('utf-8') for key in self._slots]
+
+    def append(self, target, results, timestamp=None):
+        """Records the results of a check of the target, replacing its oldest
+        record if its history is full.
+
+        :param target: The target that was checked.
+        :param results: The :attr:`~smtphealth.SmtpHealthCheck.results` of
+                        the check.
+        :type results: dict
+        :param timestamp: The time of the check, by default the current time.
+        :type timestamp: float
+        :raises: ValueError
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        flags = 0
+        if results.get('Status') == 'OK':
+            flags |= _FLAG_OK
+        if results.get('Dns-Cached'):
+            flags |= _FLAG_DNS_CACHED
+        if results.get('Ssl-Resumed'):
+            flags |= _FLAG_SSL_RESUMED
+        try:
+            code = int(results.get('Banner-Code'))
+        except (TypeError, ValueError):
+            code = 0
+        failure = _FAILURE_IDS.get(results.get('Failure'), 0)
+        timings = [results.get(key) for key in _TIMINGS]
+        timings = [_NAN if value is None else value for value in timings]
+        key = self._key(target)
+        with self._lock:
+            index = self._slots.get(key)
+            if index is None:
+                index = self._add_slot(key)
+            offset = self._slot_offset(index)
+            key, head, count = _SLOT.unpack_from(self._map, offset)
+            _RECORD.pack_into(self._map, self._record_offset(index, head),
+                              timestamp, flags, failure, code, *timings)
+            _SLOT.pack_into(self._map, offset, key, (head + 1) % self.size,
+                            min(count + 1, self.size))
+
+    def _unpack(self, index, position):
+        timestamp, flags, failure, code, dns, connect, ssl, banner = \
+            _RECORD.unpack_from(self._map, self._record_offset(index,
+                                                                position))
+        return HistoryRecord(timestamp,
+                             'OK' if flags & _FLAG_OK else 'CRITICAL',
+                             str(code) if code else None,
+                             bool(flags & _FLAG_DNS_CACHED),
+                             bool(flags & _FLAG_SSL_RESUMED),
+                             _timing(dns), _timing(connect), _timing(ssl),
+                             _timing(banner),
+                             FAILURES[failure - 1] if failure else None)
+
+    def recent(self, target, count=None):
+        """Returns the most recent records of the target. Only the requested
+        records are read, so the cost does not depend on ``size``.
+
+        :param target: The target that was checked.
+        :param count: The maximum number of records to return, by default
+                      every record that is kept.
+        :type count: int
+        :returns: List of :class:`HistoryRecord`, oldest first.
+        :rtype: list
+
+        """
+        key = self._key(target)
+        with self._lock:
+            index = self._slots.get(key)
+            if index is None:
+                return []
+            key, head, kept = _SLOT.unpack_from(self._map,
+                                                self._slot_offset(index))
+            if count is None or count > kept:
+                count = kept
+            return [self._unpack(index, (head - i) % self.size)
+                    for i in range(count, 0, -1)]
+
+    def last(self, target):
+        """Returns the most recent record of the target.
+
+        :param target: The target that was checked.
+        :returns: The record, or ``None`` if the target has no history.
+        :rtype: :class:`HistoryRecord`
+
+        """
+        records = self.recent(target, 1)
+        if records:
+            return records[0]
+
+    def transitions(self, target, count=None):
+        """Counts the number of times the status of the target changed over
+        its most recent records, e.g. to detect flapping.
+
+        :param target: The target that was checked.
+        :param count: The number of records to consider, by default every
+                      record that is kept.
+        :type count: int
+        :rtype: int
+
+        """
+        records = self.recent(target, count)
+        return sum(1 for before, after in zip(records, records[1:])
+                   if before.status != after.status)
+
+    def flush(self):
+        """Writes any changes out to the file, if there is one."""
+        if self._file is not None:
+            self._map.flush()
+
+    def close(self):
+        """Writes any changes out and releases the file."""
+        self.flush()
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,187 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Module containing the hooks that instrument each stage of a health check,
+e.g. to feed tracing spans or profilers.
+
+"""
+
+from __future__ import absolute_import
+
+import socket
+import struct
+from collections import namedtuple
+
+from . import monotonic_ns
+
+#: The stages of a check, in the order they run.
+STAGES = ('dns', 'connect', 'ssl', 'banner', 'check')
+
+_TCP_INFO = getattr(socket, 'TCP_INFO', None)
+
+# The offset and size of the tcpi_bytes_acked and tcpi_bytes_received fields
+# of the Linux tcp_info struct, available since Linux 4.2.
+_TCP_INFO_BYTES = struct.Struct('=QQ')
+_TCP_INFO_BYTES_OFFSET = 120
+_TCP_INFO_SIZE = _TCP_INFO_BYTES_OFFSET + _TCP_INFO_BYTES.size
+
+
+def _tcp_bytes(sock):
+    if sock is None:
+        return 0, 0
+    if _TCP_INFO is None:
+        return None, None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, _TCP_INFO, _TCP_INFO_SIZE)
+    except (socket.error, AttributeError):
+        return None, None
+    if len(info) < _TCP_INFO_SIZE:
+        return None, None
+    acked, received = _TCP_INFO_BYTES.unpack_from(info, _TCP_INFO_BYTES_OFFSET)
+    # The SYN of a connected socket is counted as one acknowledged byte.
+    return max(0, acked - 1), received
+
+
+def _delta(before, after):
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+class StageEvent(namedtuple('StageEvent', 'stage start end bytes_sent '
+                                          'bytes_received exception')):
+    """Describes one finished stage of a check.
+
+    :param stage: The name of the stage, one of :data:`STAGES`.
+    :param start: The :func:`~smtphealth.monotonic_ns` timestamp when the
+                  stage started.
+    :param end: The :func:`~smtphealth.monotonic_ns` timestamp when the stage
+                finished.
+    :param bytes_sent: The number of bytes sent to, and acknowledged by, the
+                       server during the stage, or ``None`` if the platform
+                       does not report it.
+    :param bytes_received: The number of bytes the operating system received
+                           from the server during the stage, or ``None`` if
+                           the platform does not report it. Data that arrives
+                           early is counted by the stage that was running,
+                           even if a later stage reads it. Both byte counts
+                           include any SSL records.
+    :param exception: The exception raised by the stage, or ``None``.
+
+    """
+    __slots__ = ()
+
+    @property
+    def elapsed(self):
+        """The number of nanoseconds the stage took."""
+        return self.end - self.start
+
+
+class StageHooks(object):
+    """Holds the callbacks that are called at the start and end of each stage
+    of a :class:`~smtphealth.SmtpHealthCheck`. One object may be shared by
+    many checks, so the callbacks may be called from many threads at once.
+    Callbacks should be registered before any checks are run, and must not
+    raise exceptions.
+
+    Checks created without hooks skip all of this, so instrumentation costs
+    nothing unless it is used.
+
+    """
+
+    def __init__(self):
+        super(StageHooks, self).__init__()
+        self._start = dict((stage, []) for stage in STAGES)
+        self._end = dict((stage, []) for stage in STAGES)
+
+    def _register(self, callbacks, callback, stages):
+        if stages is None:
+            stages = STAGES
+        for stage in stages:
+            try:
+                callbacks[stage].append(callback)
+            except KeyError:
+                raise ValueError('Unknown stage: ' + repr(stage))
+
+    def on_start(self, callback, stages=None):
+        """Registers a callback for the start of stages. It is called with
+        the check, the name of the stage, and the
+        :func:`~smtphealth.monotonic_ns` timestamp.
+
+        :param callback: The function to call.
+        :param stages: The names of the stages to call it for, by default
+                       all of :data:`STAGES`.
+        :raises: ValueError
+
+        """
+        self._register(self._start, callback, stages)
+
+    def on_end(self, callback, stages=None):
+        """Registers a callback for the end of stages, whether they finished
+        successfully or not. It is called with the check and a
+        :class:`StageEvent`.
+
+        :param callback: The function to call.
+        :param stages: The names of the stages to call it for, by default
+                       all of :data:`STAGES`.
+        :raises: ValueError
+
+        """
+        self._register(self._end, callback, stages)
+
+    def call(self, check, stage, func, *args):
+        """Runs one stage of a check, calling the registered callbacks around
+        it. This is called by the check itself.
+
+        :param check: The check that is running.
+        :type check: :class:`~smtphealth.SmtpHealthCheck`
+        :param stage: The name of the stage.
+        :type stage: str
+        :param func: The function that runs the stage.
+        :returns: The return value of ``func``.
+
+        """
+        sent, received = _tcp_bytes(check.sock)
+        start = monotonic_ns()
+        for callback in self._start[stage]:
+            callback(check, stage, start)
+        exception = None
+        try:
+            return func(*args)
+        except Exception as exc:
+            exception = exc
+            raise
+        finally:
+            end = monotonic_ns()
+            end_callbacks = self._end[stage]
+            if end_callbacks:
+                end_sent, end_received = _tcp_bytes(check.sock)
+                event = StageEvent(stage, start, end,
+                                   _delta(sent, end_sent),
+                                   _delta(received, end_received),
+                                   exception)
+                for callback in end_callbacks:
+                    callback(check, event)
+
+
+# vim:et:sts=4:sw=4:ts=4
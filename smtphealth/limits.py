@@ -0,0 +1,301 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing a limiter that paces the connections of many health
+checks, so that large providers do not throttle or block the checks for
+opening too many connections at once.
+
+"""
+
+from __future__ import absolute_import
+
+import time
+import socket
+import threading
+
+from . import monotonic
+
+
+def _is_address(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+        except (socket.error, ValueError):
+            continue
+        return True
+    return False
+
+
+#: Second-level labels under which country-code top-level domains commonly
+#: register names, e.g. ``co`` in ``co.uk``.
+SECOND_LEVEL_LABELS = frozenset(['ac', 'co', 'com', 'edu', 'gob', 'gov',
+                                 'go', 'ltd', 'mil', 'ne', 'net', 'nic',
+                                 'or', 'org', 'plc', 'sch'])
+
+
+def destination_domain(host, labels=None):
+    """Returns the domain that a host is grouped under, e.g. ``google.com``
+    for ``alt1.aspmx.l.google.com``. IP addresses are their own domain.
+
+    By default, the domain is the last two labels of the host, or the last
+    three when the top-level domain is a country code and the label before it
+    is one of :data:`SECOND_LEVEL_LABELS`, e.g. ``example.co.uk``. This is a
+    rough guess at the registered domain, not the public suffix list, so some
+    unrelated hosts may still share a domain.
+
+    :param host: The hostname or IP address.
+    :type host: str
+    :param labels: If given, the number of labels to keep instead.
+    :type labels: int
+    :rtype: str
+
+    """
+    host = host.rstrip('.').lower()
+    if _is_address(host):
+        return host
+    parts = host.split('.')
+    if labels is None:
+        labels = 2
+        if len(parts) > 2 and len(parts[-1]) == 2 and \
+                parts[-2] in SECOND_LEVEL_LABELS:
+            labels = 3
+    return '.'.join(parts[-labels:])
+
+
+class TokenBucket(object):
+    """Allows events at a steady ``rate``, with bursts of up to ``burst``
+    events after a quiet period. The bucket is not thread-safe.
+
+    :param rate: The number of events allowed per second.
+    :type rate: float
+    :param burst: The number of events allowed at once. By default, one
+                  second's worth of events.
+    :type burst: float
+
+    """
+
+    def __init__(self, rate, burst=None):
+        super(TokenBucket, self).__init__()
+        if rate <= 0:
+            raise ValueError('Rate must be positive.')
+        if burst is None:
+            burst = max(1.0, rate)
+        if burst < 1:
+            raise ValueError('Burst must be at least one.')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            elapsed = max(0.0, now - self.updated)
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self, now=None):
+        """Takes a token for one event. If none is available, the token is
+        borrowed from the future, so that waiting events are served in the
+        order they arrived.
+
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :returns: The number of seconds to wait before the event.
+        :rtype: float
+
+        """
+        self._refill(monotonic() if now is None else now)
+        self.tokens -= 1.0
+        if self.tokens >= 0.0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def idle(self, now=None):
+        """Checks whether the bucket has refilled completely, in which case
+        it behaves the same as a new bucket.
+
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :rtype: bool
+
+        """
+        self._refill(monotonic() if now is None else now)
+        return self.tokens >= self.burst
+
+
+class ConnectionLimiter(object):
+    """Limits the connections opened by health checks. Connections wait for
+    a slot under the concurrency caps, then for a token from the global and
+    per-destination rates. A destination is one IP address, and addresses
+    are grouped into domains by :func:`destination_domain`.
+
+    The limiter is thread-safe and may be passed to any number of
+    :class:`~smtphealth.SmtpHealthCheck` objects, which hold their slots from
+    connecting until they disconnect.
+
+    :param rate: The number of connections per second, in total.
+    :type rate: float
+    :param burst: The burst size of ``rate``.
+    :type burst: float
+    :param destination_rate: The number of connections per second to each
+                             IP address.
+    :type destination_rate: float
+    :param destination_burst: The burst size of ``destination_rate``.
+    :type destination_burst: float
+    :param per_address: The number of open connections allowed to each IP
+                        address.
+    :type per_address: int
+    :param per_domain: The number of open connections allowed to each
+                       domain.
+    :type per_domain: int
+    :param domain_labels: If given, the number of labels of each hostname that
+                          make up its domain. By default, the domain is
+                          guessed by :func:`destination_domain`.
+    :type domain_labels: int
+
+    """
+
+    #: Idle per-destination buckets are discarded once there are more than
+    #: this many.
+    min_prune_size = 256
+
+    def __init__(self, rate=None, burst=None, destination_rate=None,
+                 destination_burst=None, per_address=None, per_domain=None,
+                 domain_labels=None):
+        super(ConnectionLimiter, self).__init__()
+        for cap in (per_address, per_domain):
+            if cap is not None and cap < 1:
+                raise ValueError('Connection caps must be at least one.')
+        self.bucket = None
+        if rate is not None:
+            self.bucket = TokenBucket(rate, burst)
+        if destination_rate is not None:
+            # Buckets are created per destination, but the arguments are
+            # checked up front.
+            TokenBucket(destination_rate, destination_burst)
+        self.destination_rate = destination_rate
+        self.destination_burst = destination_burst
+        self.per_address = per_address
+        self.per_domain = per_domain
+        self.domain_labels = domain_labels
+        self._buckets = {}
+        self._prune_size = self.min_prune_size
+        self._addresses = {}
+        self._domains = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def _domain(self, address, host):
+        return destination_domain(host or address, self.domain_labels)
+
+    def _has_slot(self, address, domain):
+        if self.per_address is not None and \
+                self._addresses.get(address, 0) >= self.per_address:
+            return False
+        if self.per_domain is not None and \
+                self._domains.get(domain, 0) >= self.per_domain:
+            return False
+        return True
+
+    def _take_slot(self, address, domain):
+        with self._released:
+            while not self._has_slot(address, domain):
+                self._released.wait()
+            if self.per_address is not None:
+                self._addresses[address] = self._addresses.get(address, 0) + 1
+            if self.per_domain is not None:
+                self._domains[domain] = self._domains.get(domain, 0) + 1
+
+    def _prune(self, now):
+        for address, bucket in list(self._buckets.items()):
+            if bucket.idle(now):
+                del self._buckets[address]
+        self._prune_size = max(self.min_prune_size, len(self._buckets) * 2)
+
+    def _reserve(self, address):
+        with self._lock:
+            now = monotonic()
+            delay = 0.0
+            if self.bucket is not None:
+                delay = self.bucket.reserve(now)
+            if self.destination_rate is not None:
+                bucket = self._buckets.get(address)
+                if bucket is None:
+                    if len(self._buckets) >= self._prune_size:
+                        self._prune(now)
+                    bucket = self._buckets[address] = TokenBucket(
+                        self.destination_rate, self.destination_burst)
+                delay = max(delay, bucket.reserve(now))
+            return delay
+
+    def acquire(self, address, host=None, paced=True):
+        """Waits until a connection to an address is allowed, and takes its
+        slot under the concurrency caps. Every call must be followed by a
+        call to :meth:`.release` with the same arguments.
+
+        :param address: The IP address to connect to.
+        :type address: str
+        :param host: The hostname the address was resolved from, which
+                     determines its domain.
+        :type host: str
+        :param paced: If false, only the slot is taken, without waiting for
+                      the rates, e.g. to reuse a connection that is already
+                      open.
+        :type paced: bool
+        :returns: The number of seconds spent waiting.
+        :rtype: float
+
+        """
+        start = monotonic()
+        self._take_slot(address, self._domain(address, host))
+        if paced:
+            delay = self._reserve(address)
+            if delay > 0.0:
+                time.sleep(delay)
+        return monotonic() - start
+
+    def _return_slot(self, counts, key):
+        count = counts[key] - 1
+        if count > 0:
+            counts[key] = count
+        else:
+            del counts[key]
+
+    def release(self, address, host=None):
+        """Releases the slot taken by :meth:`.acquire`, once the connection
+        is closed.
+
+        :param address: The IP address that was connected to.
+        :type address: str
+        :param host: The hostname the address was resolved from.
+        :type host: str
+
+        """
+        with self._released:
+            if self.per_address is not None:
+                self._return_slot(self._addresses, address)
+            if self.per_domain is not None:
+                self._return_slot(self._domains, self._domain(address, host))
+            self._released.notify_all()
+
+
+# vim:et:sts=4:sw=4:ts=4
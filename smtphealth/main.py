@@ -21,22 +21,46 @@
 # SOFTWARE.
 
 import sys
+import signal
+import socket
+import itertools
 from optparse import OptionParser
-import pkg_resources
 
-from . import SmtpHealthCheck
+from .output import FORMATS, ChangeWriter, get_writer
 
+# Everything else is imported only where it is needed, so that a client passing
+# a check to the server with --server, or running a single check, starts fast.
 
-def main():
-    version = pkg_resources.require('smtp-health-check')[0].version
-    description = """\
-Connects to a remote SMTP server, verifying that it responds with a banner code
-that indicates a healthy system (e.g. 220). Each step of the connection may be
-timed. The output of this health check shows the results of the check, and the
-length of time taken by each piece of the operation.
-"""
-    op = OptionParser(usage='%prog [options] <host>', version=version,
-                      description=description)
+
+# The policies of smtphealth.mx, which is only imported if --mx is given.
+_MX_POLICIES = ('all', 'any', 'primary')
+
+# Streamed results are buffered for at most this many seconds before being
+# written out, as long as more results keep arriving.
+_FLUSH_DELAY = 1.0
+
+
+def _get_version():
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        import pkg_resources
+        return pkg_resources.require('smtp-health-check')[0].version
+    return version('smtp-health-check')
+
+
+class _OptionParser(OptionParser):
+    # Looking up the installed version scans every installed distribution,
+    # so it is only done if --version is given.
+
+    def __init__(self, **kwargs):
+        OptionParser.__init__(self, version='%prog', **kwargs)
+
+    def get_version(self):
+        return _get_version()
+
+
+def _add_check_options(op):
     op.add_option('-p', '--port',
                   type='int', metavar='NUM', default=25,
                   help='The port to connect to, default %default.')
@@ -44,29 +68,612 @@ length of time taken by each piece of the operation.
                   action='store_true', default=False,
                   help='Initiate an SSL handshake before getting the banner.')
     op.add_option('-d', '--dns-timeout',
-                  type='int', metavar='SEC', default=10,
+                  type='float', metavar='SEC', default=10,
                   help='The DNS lookup failure timeout, default %default.')
     op.add_option('-c', '--connect-timeout',
-                  type='int', metavar='SEC', default=10,
+                  type='float', metavar='SEC', default=10,
                   help='The connection failure timeout, default %default.')
     op.add_option('-e', '--ssl-timeout',
-                  type='int', metavar='SEC', default=10,
+                  type='float', metavar='SEC', default=10,
                   help='The SSL handshake failure timeout, default %default.')
     op.add_option('-b', '--banner-timeout',
-                  type='int', metavar='SEC', default=10,
+                  type='float', metavar='SEC', default=10,
                   help='The banner failure timeout, default %default.')
-    options, extra = op.parse_args()
+    op.add_option('--ssl-verify',
+                  action='store_true', default=False,
+                  help='Verify the SSL certificate and hostname.')
+    op.add_option('--ssl-cafile',
+                  metavar='FILE', default=None,
+                  help='With --ssl-verify, the CA certificates to trust.')
+    op.add_option('-6', '--ipv6',
+                  action='store_true', default=False,
+                  help='Resolve IPv6 as well as IPv4 addresses.')
+    op.add_option('-r', '--race',
+                  action='store_true', default=False,
+                  help='Race connections to all resolved addresses, using '
+                  'the first to succeed.')
+    op.add_option('-a', '--all-addresses',
+                  action='store_true', default=False,
+                  help='Check every resolved address in parallel, instead '
+                  'of only one.')
+    op.add_option('-m', '--mx',
+                  action='store_true', default=False,
+                  help='Treat each host as a mail domain, and check every '
+                  'one of its MX hosts in parallel. Requires dnspython.')
+    op.add_option('--mx-policy',
+                  type='choice', choices=list(_MX_POLICIES), default='all',
+                  help='With --mx, the MX hosts that must be healthy, one of: '
+                  '{0}. Default %default.'.format(', '.join(_MX_POLICIES)))
+    op.add_option('--mx-backups',
+                  type='int', metavar='NUM', default=0,
+                  help='With --mx-policy primary, the number of other MX '
+                  'hosts that must be healthy, default %default.')
+    op.add_option('--traceback',
+                  action='store_true', default=False,
+                  help='Include the traceback of any exception that caused a '
+                  'check to fail.')
+
+
+def _add_concurrency_option(op, default):
+    op.add_option('-j', '--concurrency',
+                  type='int', metavar='NUM', default=default,
+                  help='The number of checks to run at once, default '
+                  '%default.')
+
+
+def _add_cache_options(op):
+    op.add_option('--dns-cache-size',
+                  type='int', metavar='NUM', default=0,
+                  help='Cache up to NUM DNS lookups between checks, default '
+                  '%default (disabled).')
+    op.add_option('--dns-cache-ttl',
+                  type='float', metavar='SEC', default=300,
+                  help='The time to cache successful DNS lookups, default '
+                  '%default.')
+    op.add_option('--dns-negative-ttl',
+                  type='float', metavar='SEC', default=30,
+                  help='The time to cache failed DNS lookups, default '
+                  '%default.')
+    op.add_option('--ssl-resume',
+                  action='store_true', default=False,
+                  help='Resume SSL sessions from previous checks of the '
+                  'same server.')
+
+
+def _add_output_option(op):
+    op.add_option('-f', '--format',
+                  type='choice', choices=list(FORMATS), default='header',
+                  help='The output format, one of: {0}. Default '
+                  '%default.'.format(', '.join(FORMATS)))
+
+
+def _get_writer(options, stream, max_delay=None):
+    if options.format == 'binary':
+        stream = getattr(stream, 'buffer', stream)
+    return get_writer(options.format, stream, max_delay=max_delay)
+
+
+def _add_adaptive_options(op):
+    op.add_option('--adaptive-timeouts',
+                  action='store_true', default=False,
+                  help='Learn the latency of each host and time out stages '
+                  'that take much longer than usual. The timeouts above '
+                  'become ceilings.')
+    op.add_option('--timeout-floor',
+                  type='float', metavar='SEC', default=0.5,
+                  help='With --adaptive-timeouts, the minimum timeout of any '
+                  'stage, default %default.')
+
+
+def _add_limit_options(op):
+    op.add_option('--rate',
+                  type='float', metavar='NUM', default=None,
+                  help='Open at most NUM connections per second, in total.')
+    op.add_option('--destination-rate',
+                  type='float', metavar='NUM', default=None,
+                  help='Open at most NUM connections per second to each IP '
+                  'address.')
+    op.add_option('--per-address',
+                  type='int', metavar='NUM', default=None,
+                  help='Keep at most NUM connections open to each IP '
+                  'address.')
+    op.add_option('--per-domain',
+                  type='int', metavar='NUM', default=None,
+                  help='Keep at most NUM connections open to each domain, '
+                  'e.g. google.com for all of its mail servers.')
+    op.add_option('--domain-labels',
+                  type='int', metavar='NUM', default=None,
+                  help='With --per-domain, group hosts by their last NUM '
+                  'labels. By default, the last two, or three for names '
+                  'like example.co.uk.')
+
+
+def _check_mx_options(op, options):
+    if not options.mx:
+        return
+    if options.mx_backups < 0:
+        op.error('The --mx-backups must not be negative.')
+    try:
+        import dns.resolver
+    except ImportError:
+        op.error('The --mx option requires the dnspython package.')
+
+
+def _check_limit_options(op, options):
+    for name in ('rate', 'destination_rate'):
+        value = getattr(options, name)
+        if value is not None and value <= 0:
+            op.error('The --{0} must be positive.'.format(
+                name.replace('_', '-')))
+    for name in ('per_address', 'per_domain', 'domain_labels'):
+        value = getattr(options, name)
+        if value is not None and value < 1:
+            op.error('The --{0} must be at least one.'.format(
+                name.replace('_', '-')))
+
+
+def _divide_limit_options(op, options, processes):
+    # Each worker process gets its own copy of the limiter, so each one is
+    # given an equal share of the limits rather than all of them.
+    for name in ('rate', 'destination_rate'):
+        value = getattr(options, name)
+        if value is not None:
+            setattr(options, name, value / processes)
+    for name in ('per_address', 'per_domain'):
+        value = getattr(options, name)
+        if value is not None:
+            if value < processes:
+                op.error('The --{0} must be at least --processes.'.format(
+                    name.replace('_', '-')))
+            setattr(options, name, value // processes)
+
+
+def _get_limiter(options):
+    from .limits import ConnectionLimiter
+    return ConnectionLimiter(options.rate,
+                             destination_rate=options.destination_rate,
+                             per_address=options.per_address,
+                             per_domain=options.per_domain,
+                             domain_labels=options.domain_labels)
+
+
+def _get_check_kwargs(options):
+    kwargs = {'dns_timeout': options.dns_timeout,
+              'connect_timeout': options.connect_timeout,
+              'ssl_timeout': options.ssl_timeout,
+              'banner_timeout': options.banner_timeout,
+              'happy_eyeballs': options.race,
+              'tracebacks': options.traceback}
+    if options.ipv6:
+        kwargs['family'] = socket.AF_UNSPEC
+    if options.ssl_verify:
+        from .tls import create_context
+        kwargs['ssl_context'] = create_context(True, options.ssl_cafile)
+    if getattr(options, 'ssl_resume', False):
+        from .tls import SslSessionCache
+        kwargs['ssl_sessions'] = SslSessionCache()
+    if getattr(options, 'adaptive_timeouts', False):
+        from .adaptive import AdaptiveTimeouts
+        kwargs['adaptive_timeouts'] = AdaptiveTimeouts(options.timeout_floor)
+    if options.mx:
+        from .mx import get_default_resolver
+        kwargs.update(policy=options.mx_policy, backups=options.mx_backups,
+                      resolver=get_default_resolver())
+    if any(getattr(options, name, None) is not None
+           for name in ('rate', 'destination_rate', 'per_address',
+                        'per_domain')):
+        kwargs['limiter'] = _get_limiter(options)
+    if getattr(options, 'dns_cache_size', 0) > 0:
+        from .dnscache import DnsCache
+        kwargs['dns_cache'] = DnsCache(options.dns_cache_size,
+                                       options.dns_cache_ttl,
+                                       options.dns_negative_ttl)
+    return kwargs
+
+
+def _get_engine(options):
+    from .engine import CheckEngine
+    breaker = None
+    if getattr(options, 'breaker_failures', 0) > 0:
+        from .breaker import CircuitBreaker
+        breaker = CircuitBreaker(options.breaker_failures,
+                                 options.breaker_delay,
+                                 options.breaker_max_delay)
+    engine = CheckEngine(options.concurrency, breaker,
+                         **_get_check_kwargs(options))
+    if options.mx:
+        from .mx import MxCheck
+        engine.check_class = MxCheck
+    elif options.all_addresses:
+        from .addresses import AllAddressesCheck
+        engine.check_class = AllAddressesCheck
+    return engine
+
+
+def _output_shard_stats(stats, stream):
+    for shard in stats:
+        line = 'Shard {0}: {1} checks, {2} healthy, {3:.1f} checks/sec, ' \
+            '{4:.2f} CPU seconds'.format(shard.shard, shard.checks,
+                                         shard.healthy, shard.rate,
+                                         shard.cpu)
+        if shard.exitcode is not None:
+            line += ', exited with {0}'.format(shard.exitcode)
+        stream.write(line + '\n')
+    stream.flush()
+
+
+def _parse_main(argv):
+    description = """\
+Connects to a remote SMTP server, verifying that it responds with a banner code
+that indicates a healthy system (e.g. 220). Each step of the connection may be
+timed. The output of this health check shows the results of the check, and the
+length of time taken by each piece of the operation.
+"""
+    op = _OptionParser(usage='%prog [options] <host> [<host> ...]',
+                       description=description)
+    _add_check_options(op)
+    _add_concurrency_option(op, 50)
+    _add_output_option(op)
+    op.add_option('-n', '--count',
+                  type='int', metavar='NUM', default=1,
+                  help='Check the host NUM times and summarize the latency '
+                  'of each stage, default %default.')
+    op.add_option('-i', '--interval',
+                  type='float', metavar='SEC', default=1.0,
+                  help='With --count, the time between the start of each '
+                  'check, default %default.')
+    _add_adaptive_options(op)
+    _add_limit_options(op)
+    op.add_option('--server',
+                  metavar='SOCKET', default=None,
+                  help='Send the check to the smtp-health-check-server '
+                  'listening on SOCKET, falling back to running it here if '
+                  'the server is not running.')
+    options, extra = op.parse_args(argv)
+    _check_limit_options(op, options)
+    _check_mx_options(op, options)
 
     if len(extra) < 1:
         op.error('At least one host must be provided.')
+    if options.count < 1:
+        op.error('The --count must be at least one.')
+    if options.count > 1:
+        if len(extra) > 1:
+            op.error('Only one host may be given with --count.')
+        if options.all_addresses:
+            op.error('The --all-addresses option may not be used with '
+                     '--count.')
+        if options.mx:
+            op.error('The --mx option may not be used with --count.')
+    return options, extra
+
+
+def _run_main(options, extra, stream):
+    writer = _get_writer(options, stream)
+    if options.count > 1:
+        from .stats import repeat_check
+        latencies = repeat_check(extra[0], options.port, options.ssl,
+                                 options.count, options.interval,
+                                 **_get_check_kwargs(options))
+        ret = latencies.write(writer)
+        writer.flush()
+        return ret
+
+    if len(extra) == 1:
+        if options.mx:
+            from .mx import MxCheck
+            check = MxCheck(**_get_check_kwargs(options))
+        elif options.all_addresses:
+            from .addresses import AllAddressesCheck
+            check = AllAddressesCheck(**_get_check_kwargs(options))
+        else:
+            from . import SmtpHealthCheck
+            check = SmtpHealthCheck(**_get_check_kwargs(options))
+        check.run(extra[0], options.port, options.ssl)
+        ret = check.write(writer)
+        writer.flush()
+        return ret
+
+    from .targets import Target
+    engine = _get_engine(options)
+    targets = [Target(host, options.port, options.ssl) for host in extra]
+    ret = 0
+    for target, check in zip(targets, engine.run_all(targets)):
+        ret = max(ret, check.write(writer, target))
+    writer.flush()
+    return ret
+
+
+def _run_check(argv, stream):
+    options, extra = _parse_main(argv)
+    return _run_main(options, extra, stream)
+
+
+def main():
+    argv = sys.argv[1:]
+    options, extra = _parse_main(argv)
+    if options.server is not None:
+        from .server import send_check
+        try:
+            ret, output = send_check(options.server, argv)
+        except (socket.error, ValueError):
+            pass
+        else:
+            stream = getattr(sys.stdout, 'buffer', sys.stdout)
+            stream.write(output)
+            stream.flush()
+            return ret
+    return _run_main(options, extra, sys.stdout)
+
+
+def server():
+    description = """\
+Runs forever, listening on a Unix domain socket for checks sent by
+smtp-health-check --server. Checks sent to this server produce the same output
+and exit code, without the cost of starting a new process for each one.
+"""
+    op = _OptionParser(usage='%prog [options] <socket>',
+                       description=description)
+    options, extra = op.parse_args()
+    if len(extra) != 1:
+        op.error('One socket path must be provided.')
+
+    from .server import CheckServer
+    from . import get_default_context
+    get_default_context()
+    check_server = CheckServer(extra[0], _run_check)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        check_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        check_server.server_close()
+    return 0
+
+
+def _open_inputs(op, filenames):
+    if not filenames:
+        filenames = ['-']
+    for filename in filenames:
+        if filename == '-':
+            yield sys.stdin
+            continue
+        try:
+            with open(filename, 'r') as f:
+                yield f
+        except IOError as exc:
+            op.error(str(exc))
+
+
+def batch():
+    description = """\
+Checks every SMTP server listed in the given files, or on standard input if no
+files are given. Each line is a target of the form host[:port][,ssl], and
+blank lines or lines starting with # are ignored. The checks run concurrently,
+and the results of each one are written out as soon as it finishes, preceded
+by a Target line.
+"""
+    op = _OptionParser(usage='%prog [options] [<file> ...]',
+                       description=description)
+    _add_check_options(op)
+    _add_concurrency_option(op, 100)
+    _add_cache_options(op)
+    _add_adaptive_options(op)
+    _add_limit_options(op)
+    _add_output_option(op)
+    op.add_option('-P', '--processes',
+                  type='int', metavar='NUM', default=1,
+                  help='Split the targets across NUM worker processes, each '
+                  'running --concurrency checks at once, default %default.')
+    options, extra = op.parse_args()
+    if options.processes < 1:
+        op.error('The --processes must be at least one.')
+    _check_limit_options(op, options)
+    _check_mx_options(op, options)
+    if options.processes > 1:
+        _divide_limit_options(op, options, options.processes)
+
+    from .targets import read_targets
+
+    def bad_target(line, exc):
+        sys.stderr.write('Skipping target: {0!s}\n'.format(exc))
+
+    targets = itertools.chain.from_iterable(
+        read_targets(f, options.port, options.ssl, bad_target)
+        for f in _open_inputs(op, extra))
+    engine = _get_engine(options)
+    if options.processes > 1:
+        from .shards import ShardedEngine
+        engine = ShardedEngine(engine, options.processes)
+    writer = _get_writer(options, sys.stdout, _FLUSH_DELAY)
+    ret = 0
+    try:
+        for target, check in engine.run(targets):
+            ret = max(ret, check.write(writer, target))
+    finally:
+        writer.flush()
+    if options.processes > 1:
+        _output_shard_stats(engine.stats, sys.stderr)
+    return ret
+
+
+def monitor():
+    description = """\
+Runs forever, re-checking every SMTP server listed in the given inventory
+files, or on standard input if no files are given. Each line is a target of the
+form host[:port][,ssl], optionally followed by the number of seconds between
+its checks. Probes are spread out over each interval rather than run all at
+once, and the results of each one are written out as soon as it finishes.
+"""
+    op = _OptionParser(usage='%prog [options] [<inventory> ...]',
+                       description=description)
+    _add_check_options(op)
+    _add_concurrency_option(op, 100)
+    _add_cache_options(op)
+    _add_adaptive_options(op)
+    _add_limit_options(op)
+    _add_output_option(op)
+    op.add_option('-i', '--interval',
+                  type='float', metavar='SEC', default=60,
+                  help='The default time between checks of a target, default '
+                  '%default.')
+    op.add_option('--jitter',
+                  type='float', metavar='FRAC', default=0.1,
+                  help='The fraction of the interval each check may be moved '
+                  'randomly, default %default.')
+    op.add_option('--metrics-port',
+                  type='int', metavar='NUM', default=None,
+                  help='Serve the latest results as OpenMetrics over HTTP on '
+                  'this port.')
+    op.add_option('--metrics-address',
+                  metavar='ADDR', default='',
+                  help='The address to serve metrics on, default all.')
+    op.add_option('--metrics-aggregate',
+                  action='store_true', default=False,
+                  help='Serve one latency histogram of each stage for all '
+                  'targets, rather than one for each target.')
+    op.add_option('--breaker-failures',
+                  type='int', metavar='NUM', default=0,
+                  help='Skip a target after NUM failed checks in a row, '
+                  'retrying it with exponential backoff, default %default '
+                  '(disabled). Skipped targets report their last result.')
+    op.add_option('--breaker-delay',
+                  type='float', metavar='SEC', default=30,
+                  help='With --breaker-failures, the delay before the first '
+                  'retry, default %default.')
+    op.add_option('--breaker-max-delay',
+                  type='float', metavar='SEC', default=600,
+                  help='With --breaker-failures, the maximum delay between '
+                  'retries, default %default.')
+    op.add_option('--history',
+                  metavar='FILE', default=None,
+                  help='Keep the recent results of each target in FILE, '
+                  'which persists across restarts.')
+    op.add_option('--history-size',
+                  type='int', metavar='NUM', default=64,
+                  help='With --history, the number of results kept for each '
+                  'target, default %default.')
+    op.add_option('--history-targets',
+                  type='int', metavar='NUM', default=1024,
+                  help='With --history, the number of targets the file has '
+                  'room for, default %default.')
+    op.add_option('--sessions',
+                  type='int', metavar='NUM', default=0,
+                  help='Keep up to NUM SMTP sessions open to each target, and '
+                  'check it by probing them with --probe-command, default '
+                  '%default (disabled).')
+    op.add_option('--probe-command',
+                  type='choice', choices=['NOOP', 'EHLO'], default='NOOP',
+                  help='With --sessions, the command sent by each probe, NOOP '
+                  'or EHLO. Default %default.')
+    op.add_option('--deep-interval',
+                  type='float', metavar='SEC', default=300,
+                  help='With --sessions, the time between full checks of a '
+                  'target, default %default.')
+    op.add_option('--session-max-idle',
+                  type='float', metavar='SEC', default=None,
+                  help='With --sessions, reuse a session only if it was idle '
+                  'at most SEC seconds. By default, 1.5 times --interval, up '
+                  'to 300.')
+    op.add_option('-q', '--quiet',
+                  action='store_true', default=False,
+                  help='Do not write the result of each check.')
+    op.add_option('--changes',
+                  action='store_true', default=False,
+                  help='Only write the result of a check when the status, '
+                  'failure or reply code of its target changed.')
+    op.add_option('--snapshot-interval',
+                  type='float', metavar='SEC', default=3600,
+                  help='With --changes, also write the result of a target '
+                  'that has not been written for SEC seconds, default '
+                  '%default. Use 0 to disable.')
+    options, extra = op.parse_args()
+    _check_limit_options(op, options)
+    _check_mx_options(op, options)
+    if options.sessions < 0:
+        op.error('The --sessions must not be negative.')
+    if options.sessions > 0 and (options.mx or options.all_addresses):
+        op.error('The --sessions option may not be used with --mx or '
+                 '--all-addresses.')
+    if options.changes and (options.mx or options.all_addresses):
+        op.error('The --changes option may not be used with --mx or '
+                 '--all-addresses.')
+    if options.snapshot_interval < 0:
+        op.error('The --snapshot-interval must not be negative.')
+    if options.session_max_idle is not None and options.session_max_idle < 0:
+        op.error('The --session-max-idle must not be negative.')
+
+    from .monitor import Monitor, read_inventory
+    engine = _get_engine(options)
+    sessions = None
+    if options.sessions > 0:
+        from .sessions import SessionPools, SessionCheck, default_max_idle
+        max_idle = options.session_max_idle
+        if max_idle is None:
+            max_idle = default_max_idle(options.interval)
+        sessions = SessionPools(options.sessions, options.probe_command,
+                                options.deep_interval, max_idle)
+        engine.check_class = SessionCheck
+        engine.check_kwargs['sessions'] = sessions
+    mon = Monitor(engine, options.jitter)
+    for f in _open_inputs(op, extra):
+        try:
+            for target, interval in read_inventory(f, options.interval,
+                                                   options.port, options.ssl):
+                mon.add(target, interval)
+        except ValueError as exc:
+            op.error(str(exc))
+    if len(mon.scheduler) < 1:
+        op.error('At least one target must be provided.')
+
+    history = None
+    if options.history is not None:
+        from .history import ResultHistory
+        try:
+            history = ResultHistory(options.history, options.history_size,
+                                    options.history_targets)
+        except (ValueError, IOError) as exc:
+            op.error(str(exc))
+        if len(mon.scheduler) > options.history_targets:
+            op.error('The --history-targets must be at least the number of '
+                     'targets.')
+
+    exporter = None
+    if options.metrics_port is not None:
+        from .exporter import MetricsExporter
+        exporter = MetricsExporter(
+            target_histograms=not options.metrics_aggregate)
+        exporter.serve(options.metrics_address, options.metrics_port)
 
-    check = SmtpHealthCheck(dns_timeout=options.dns_timeout,
-                            connect_timeout=options.connect_timeout,
-                            ssl_timeout=options.ssl_timeout,
-                            banner_timeout=options.banner_timeout)
-    for host in extra:
-        check.run(host, options.port, options.ssl)
-        return check.output(sys.stdout)
+    writer = _get_writer(options, sys.stdout, _FLUSH_DELAY)
+    if options.changes:
+        writer = ChangeWriter(writer, options.snapshot_interval or None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: mon.stop())
+    try:
+        for target, check in mon.run():
+            # Targets skipped by the circuit breaker report their last known
+            # results, which have already been recorded.
+            skipped = 'Circuit' in check.results
+            if exporter is not None and not skipped:
+                exporter.update(target, check.results)
+            if history is not None and not skipped:
+                try:
+                    history.append(target, check.results)
+                except ValueError:
+                    # The file is full of targets from an older inventory.
+                    pass
+            if not options.quiet:
+                check.write(writer, target)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.flush()
+        if history is not None:
+            history.close()
+        if sessions is not None:
+            sessions.close()
+    return 0
 
 
 # vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,251 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing a long-running monitor that re-checks a fixed inventory
+of SMTP servers, each on its own interval.
+
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import random
+import itertools
+import threading
+
+from . import monotonic
+from .targets import parse_target
+
+
+class ProbeScheduler(object):
+    """Keeps a heap of targets ordered by the time of their next probe. Each
+    target is first scheduled at a random offset within its interval, so that
+    a large inventory is spread evenly instead of bursting at once, and every
+    later probe is randomly shifted by up to ``jitter`` of the interval so
+    that targets do not drift back into lockstep.
+
+    :param jitter: The fraction of the interval by which each probe may be
+                   moved earlier or later, e.g. ``0.1`` for 10%.
+    :type jitter: float
+
+    """
+
+    def __init__(self, jitter=0.1):
+        super(ProbeScheduler, self).__init__()
+        self.jitter = jitter
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, due, target, interval):
+        entry = (due, next(self._counter), target, interval)
+        with self._lock:
+            heapq.heappush(self._heap, entry)
+        self._changed.set()
+
+    def add(self, target, interval, delay=None):
+        """Adds a target to be probed repeatedly.
+
+        :param target: The target to probe, e.g. a
+                       :class:`~smtphealth.targets.Target`.
+        :param interval: The number of seconds between probes.
+        :type interval: float
+        :param delay: The number of seconds until the first probe. By default,
+                      a random delay within ``interval`` is chosen.
+        :type delay: float
+
+        """
+        if interval <= 0.0:
+            raise ValueError('Interval must be positive.')
+        if delay is None:
+            delay = random.uniform(0.0, interval)
+        self._push(monotonic() + delay, target, interval)
+
+    def _reschedule(self, due, interval, now):
+        spread = self.jitter * interval
+        next_due = due + interval + random.uniform(-spread, spread)
+        # A probe that fell far behind, e.g. while checks were saturated, is
+        # not made up with a burst of catch-up probes.
+        return max(next_due, now)
+
+    def pop_due(self, now=None):
+        """Removes every target whose probe is due and schedules its next
+        probe.
+
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :returns: List of the targets that are due, earliest first.
+        :rtype: list
+
+        """
+        if now is None:
+            now = monotonic()
+        popped = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                popped.append(heapq.heappop(self._heap))
+            for when, count, target, interval in popped:
+                next_due = self._reschedule(when, interval, now)
+                entry = (next_due, next(self._counter), target, interval)
+                heapq.heappush(self._heap, entry)
+        return [entry[2] for entry in popped]
+
+    def next_due(self):
+        """Returns the :func:`~smtphealth.monotonic` time of the next probe,
+        or ``None`` if there are no targets.
+
+        """
+        with self._lock:
+            if self._heap:
+                return self._heap[0][0]
+
+    def stop(self):
+        """Causes :meth:`.__iter__` to stop yielding targets."""
+        self._stopped.set()
+        self._changed.set()
+
+    def __iter__(self):
+        """Blocks until each probe is due and yields its target, forever or
+        until :meth:`.stop` is called. This may be given directly to
+        :meth:`smtphealth.engine.CheckEngine.run`.
+
+        """
+        while not self._stopped.is_set():
+            self._changed.clear()
+            for target in self.pop_due():
+                yield target
+            next_due = self.next_due()
+            if next_due is None:
+                self._changed.wait()
+            else:
+                wait = next_due - monotonic()
+                if wait > 0.0:
+                    self._changed.wait(wait)
+
+
+def parse_inventory_line(line, default_interval=60.0, default_port=25,
+                         default_ssl=False):
+    """Parses an inventory line of the form ``host[:port][,ssl] [interval]``,
+    where ``interval`` is the number of seconds between probes.
+
+    :param line: The inventory line to parse.
+    :type line: str
+    :param default_interval: The interval to use if none is given.
+    :type default_interval: float
+    :param default_port: The port to use if none is given.
+    :type default_port: int
+    :param default_ssl: Whether to use SSL if ``,ssl`` is not given.
+    :type default_ssl: bool
+    :returns: Tuple of the :class:`~smtphealth.targets.Target` and interval.
+    :raises: ValueError
+
+    """
+    parts = line.split()
+    if len(parts) not in (1, 2):
+        raise ValueError('Invalid inventory line: ' + repr(line))
+    target = parse_target(parts[0], default_port, default_ssl)
+    interval = default_interval
+    if len(parts) > 1:
+        try:
+            interval = float(parts[1])
+        except ValueError:
+            raise ValueError('Invalid interval: ' + repr(line))
+    if interval <= 0.0:
+        raise ValueError('Invalid interval: ' + repr(line))
+    return target, interval
+
+
+def read_inventory(stream, default_interval=60.0, default_port=25,
+                   default_ssl=False):
+    """Reads an inventory from a stream, one target per line, as parsed by
+    :func:`parse_inventory_line`. Blank lines and lines starting with ``#``
+    are ignored.
+
+    :param stream: The input file to read from.
+    :param default_interval: The interval to use if a line does not give one.
+    :type default_interval: float
+    :param default_port: The port to use if a line does not give one.
+    :type default_port: int
+    :param default_ssl: Whether to use SSL if a line does not say.
+    :type default_ssl: bool
+    :returns: Generator of ``(target, interval)`` tuples.
+    :raises: ValueError
+
+    """
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        yield parse_inventory_line(line, default_interval, default_port,
+                                   default_ssl)
+
+
+class Monitor(object):
+    """Re-checks an inventory of targets forever, each on its own interval,
+    using a :class:`ProbeScheduler` to decide when each probe is due and a
+    :class:`~smtphealth.engine.CheckEngine` to run the probes.
+
+    :param engine: The engine that runs each probe.
+    :type engine: :class:`~smtphealth.engine.CheckEngine`
+    :param jitter: See :class:`ProbeScheduler`.
+    :type jitter: float
+
+    """
+
+    def __init__(self, engine, jitter=0.1):
+        super(Monitor, self).__init__()
+        self.engine = engine
+        self.scheduler = ProbeScheduler(jitter)
+
+    def add(self, target, interval):
+        """Adds a target to the inventory.
+
+        :param target: The ``(host, port, with_ssl)`` target to check.
+        :param interval: The number of seconds between checks.
+        :type interval: float
+
+        """
+        self.scheduler.add(target, interval)
+
+    def stop(self):
+        """Stops scheduling new probes. Probes already in progress finish,
+        and then :meth:`.run` returns.
+
+        """
+        self.scheduler.stop()
+
+    def run(self):
+        """Probes the inventory until :meth:`.stop` is called.
+
+        :returns: Generator of ``(target, check)`` tuples, produced as each
+                  probe finishes.
+
+        """
+        return self.engine.run(self.scheduler)
+
+
+# vim:et:sts=4:sw=4:ts=4
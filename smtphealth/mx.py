@@ -0,0 +1,315 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing a health check of a whole mail domain, which resolves
+the MX records of the domain and checks every MX host in parallel.
+
+"""
+
+from __future__ import absolute_import
+
+import socket
+import threading
+from collections import namedtuple
+
+from . import SmtpHealthCheck, DNSError, Timeout, _call_with_timeout
+from .addresses import AllAddressesCheck
+from .targets import Target
+from . import failures
+
+#: Every MX host must be healthy.
+ALL = 'all'
+
+#: At least one MX host must be healthy.
+ANY = 'any'
+
+#: The most preferred MX host must be healthy, along with some number of the
+#: others.
+PRIMARY = 'primary'
+
+#: Every aggregation policy.
+POLICIES = (ALL, ANY, PRIMARY)
+
+
+class NullMxError(DNSError):
+    """This error is thrown when a mail domain publishes a null MX record,
+    which means that it does not accept mail.
+
+    """
+    pass
+
+
+class MxRecord(namedtuple('MxRecord', 'preference host')):
+    """One MX record of a mail domain. Lower preferences are tried first.
+
+    :param preference: The preference of the host.
+    :type preference: int
+    :param host: The hostname of the mail server.
+    :type host: str
+
+    """
+    __slots__ = ()
+
+
+def _sort_records(records):
+    ret = []
+    seen = set()
+    for record in sorted(MxRecord(*record) for record in records):
+        if record.host not in seen:
+            seen.add(record.host)
+            ret.append(record)
+    return ret
+
+
+class StaticResolver(object):
+    """Resolves MX records from a fixed mapping rather than DNS, e.g. to
+    check mail domains of a private network, or in tests.
+
+    :param records: Maps each domain to a list of ``(preference, host)``
+                    tuples. An empty list is a null MX record.
+    :type records: dict
+
+    """
+
+    def __init__(self, records):
+        super(StaticResolver, self).__init__()
+        self.records = records
+
+    def resolve_mx(self, domain):
+        """Returns the MX records of a domain, most preferred first.
+
+        :param domain: The mail domain.
+        :type domain: str
+        :rtype: list
+        :raises: :exc:`socket.gaierror` if the domain is not known.
+
+        """
+        try:
+            records = self.records[domain.rstrip('.').lower()]
+        except KeyError:
+            raise socket.gaierror(socket.EAI_NONAME, 'Domain not found.')
+        return _sort_records(records)
+
+
+class DnsPythonResolver(object):
+    """Resolves MX records with the optional ``dnspython`` package. As in RFC
+    5321, a domain with no MX records is its own mail server, and as in RFC
+    7505, a single MX record of ``.`` is a null MX record.
+
+    :param resolver: The ``dns.resolver.Resolver`` to use, by default one
+                     configured from the system.
+    :raises: ImportError, if ``dnspython`` is not installed.
+
+    """
+
+    def __init__(self, resolver=None):
+        super(DnsPythonResolver, self).__init__()
+        import dns.name
+        import dns.resolver
+        import dns.exception
+        self._dns = dns
+        self.resolver = resolver or dns.resolver.Resolver()
+
+    def _query(self, domain):
+        resolver = self.resolver
+        query = getattr(resolver, 'resolve', None) or resolver.query
+        return query(domain, 'MX')
+
+    def resolve_mx(self, domain):
+        """Returns the MX records of a domain, most preferred first.
+
+        :param domain: The mail domain.
+        :type domain: str
+        :rtype: list
+        :raises: :exc:`socket.gaierror` if the lookup fails.
+
+        """
+        dns = self._dns
+        try:
+            answer = self._query(domain)
+        except dns.resolver.NXDOMAIN:
+            raise socket.gaierror(socket.EAI_NONAME, 'Domain not found.')
+        except dns.resolver.NoAnswer:
+            return [MxRecord(0, domain.rstrip('.'))]
+        except dns.exception.DNSException as exc:
+            raise socket.gaierror(socket.EAI_FAIL, str(exc))
+        exchanges = [rdata.exchange for rdata in answer]
+        if exchanges == [dns.name.root]:
+            return []
+        return _sort_records([(rdata.preference, rdata.exchange.to_text(True))
+                              for rdata in answer])
+
+
+def get_default_resolver():
+    """Returns a :class:`DnsPythonResolver`.
+
+    :raises: ImportError, if ``dnspython`` is not installed.
+
+    """
+    return DnsPythonResolver()
+
+
+class MxCheck(SmtpHealthCheck):
+    """Checks whether a mail domain can receive mail. The MX records of the
+    domain are resolved, and then every MX host is checked in parallel with
+    an :class:`~smtphealth.addresses.AllAddressesCheck`, which also checks
+    each of its addresses in parallel. A domain check therefore takes about
+    as long as its slowest MX host.
+
+    The results of the MX hosts are combined by the ``policy``:
+
+    * :data:`ALL`: every MX host must be healthy.
+    * :data:`ANY`: at least one MX host must be healthy.
+    * :data:`PRIMARY`: the most preferred MX host must be healthy, along
+      with at least ``backups`` of the others, or all of them if there are
+      fewer.
+
+    After :meth:`.run`, the :attr:`.results` summarize the domain and
+    :attr:`.checks` holds the check of each MX host, most preferred first.
+    Other keyword arguments are the same as those of
+    :class:`~smtphealth.SmtpHealthCheck`, and are also used for the check of
+    each MX host.
+
+    :param policy: How the results of the MX hosts are combined.
+    :type policy: str
+    :param backups: With :data:`PRIMARY`, the number of other MX hosts that
+                    must be healthy.
+    :type backups: int
+    :param resolver: Resolves MX records with a ``resolve_mx(domain)``
+                     method, by default :func:`get_default_resolver`.
+
+    """
+
+    #: The class instantiated for each MX host.
+    check_class = AllAddressesCheck
+
+    def __init__(self, policy=ALL, backups=0, resolver=None, **kwargs):
+        super(MxCheck, self).__init__(**kwargs)
+        if policy not in POLICIES:
+            raise ValueError('Unknown MX policy: ' + repr(policy))
+        self.policy = policy
+        self.backups = backups
+        self.resolver = resolver
+        self._check_kwargs = kwargs
+
+        #: List of the :class:`~smtphealth.mx.MxRecord` of the domain, most
+        #: preferred first.
+        self.records = []
+
+        #: List of the checks run against each MX host, in the same order as
+        #: :attr:`.records`.
+        self.checks = []
+        self._targets = []
+
+    def __getstate__(self):
+        return {'results': self.results, 'records': self.records,
+                'checks': self.checks, '_targets': self._targets}
+
+    def _resolve(self, domain):
+        resolver = self.resolver
+        if resolver is None:
+            resolver = self.resolver = get_default_resolver()
+        with Timeout(self.dns_timeout, 'MX lookup timed out.') as timer:
+            records = _call_with_timeout(timer, resolver.resolve_mx, domain)
+        self.results['Dns-Elapsed'] = timer.elapsed
+        if not records:
+            raise NullMxError('Domain does not accept mail.')
+        return records
+
+    def _classify_failure(self, stage, exc):
+        if isinstance(exc, NullMxError):
+            return failures.MX_NULL
+        return super(MxCheck, self)._classify_failure(stage, exc)
+
+    def _satisfied(self, healthy):
+        if self.policy == ANY:
+            return any(healthy)
+        elif self.policy == PRIMARY:
+            backups = min(self.backups, len(healthy) - 1)
+            return healthy[0] and sum(healthy[1:]) >= backups
+        return all(healthy)
+
+    def _check_host(self, check, record, port, with_ssl):
+        check.run(record.host, port, with_ssl)
+        check.results['Mx-Preference'] = record.preference
+
+    def run(self, domain, port=25, with_ssl=False):
+        """Resolves the MX records of the domain and checks each MX host in
+        parallel. This method may only be called once per object.
+
+        :param domain: The mail domain to check.
+        :type domain: str
+        :param port: The port number of each MX host to check.
+        :type port: int
+        :param with_ssl: If ``True``, SSL will be initiated before attempting
+                         to get the banner message.
+        :type with_ssl: bool
+
+        """
+        stage = self._get_stage_caller()
+        try:
+            self.records = stage(self, 'dns', self._resolve, domain)
+        except Exception:
+            self._record_exception('dns')
+            return
+        self._targets = [Target(record.host, port, with_ssl)
+                         for record in self.records]
+        self.checks = [self.check_class(**self._check_kwargs)
+                       for record in self.records]
+        threads = []
+        for check, record in zip(self.checks, self.records):
+            thread = threading.Thread(target=self._check_host,
+                                      args=(check, record, port, with_ssl))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        healthy = [check.results['Status'] == 'OK' for check in self.checks]
+        self.results['Mx-Hosts'] = len(self.checks)
+        self.results['Mx-Hosts-Ok'] = sum(healthy)
+        if self._satisfied(healthy):
+            self.results['Status'] = 'OK'
+        else:
+            self.results['Failure'] = failures.MX_FAILED
+
+    def write(self, writer, target=None):
+        """Writes the summary :attr:`.results` followed by the results of
+        each MX host, each with its own target. See
+        :meth:`smtphealth.SmtpHealthCheck.write`.
+
+        :param writer: The writer for the desired output format.
+        :type writer: :class:`~smtphealth.output.ResultWriter`
+        :param target: If given, the target that was checked is included in
+                       the summary.
+        :returns: A return code that would be appropriate to return to the
+                  operating system, zero only if the policy was satisfied.
+        :rtype: int
+
+        """
+        ret = super(MxCheck, self).write(writer, target)
+        for host_target, check in zip(self._targets, self.checks):
+            check.write(writer, host_target)
+        return ret
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,472 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing the formats that health check results may be written
+in, and a buffered writer for each.
+
+"""
+
+from __future__ import absolute_import
+
+import json
+import time
+import struct
+import threading
+from collections import OrderedDict
+
+#: The order in which known result keys are written. Any other keys follow,
+#: sorted by name, unless the results are already ordered. The binary format
+#: identifies keys by their index here, so new keys must only be appended.
+FIELD_ORDER = ('Target', 'Status', 'Address', 'Addresses', 'Addresses-Ok',
+               'Dns-Cached', 'Dns-Elapsed', 'Connect-Elapsed', 'Ssl-Elapsed',
+               'Ssl-Resumed', 'Banner-Elapsed', 'Banner-Code',
+               'Banner-Message', 'Banner', 'Exception-Type',
+               'Exception-Value', 'Exception-Traceback', 'Circuit',
+               'Circuit-Retry', 'Limit-Elapsed', 'Failure', 'Mx-Hosts',
+               'Mx-Hosts-Ok', 'Mx-Preference', 'Session-Reused',
+               'Session-Reconnected', 'Session-Rtt', 'Reply-Code',
+               'Reply-Message', 'Pool-Rtt', 'Pool-Sessions', 'Change')
+
+#: The keys compared by :class:`ChangeWriter` to decide whether the state of a
+#: target has changed. Timings differ on every check, so they are not compared.
+STATE_KEYS = ('Status', 'Failure', 'Banner-Code', 'Reply-Code', 'Circuit')
+
+#: The keys of :data:`STATE_KEYS` that only some kinds of results have, e.g.
+#: ``Reply-Code`` of session probes but not of full checks. When one of these
+#: is missing, the previous value is kept rather than counted as a change.
+STICKY_STATE_KEYS = ('Banner-Code', 'Reply-Code')
+
+_FIELD_RANK = dict((key, i) for i, key in enumerate(FIELD_ORDER))
+
+try:
+    _string_types = (basestring, )
+except NameError:
+    _string_types = (str, )
+
+
+def _to_text(value):
+    # Received data is kept as a native string, which on Python 2 is bytes
+    # that need not be valid UTF-8. Decoding as Latin-1 never fails, and
+    # gives the same text as Python 3 does.
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return value
+
+
+def ordered_items(results, target=None):
+    """Returns the items of the results in a stable order. Ordered results,
+    e.g. an :class:`~collections.OrderedDict`, keep their order. Otherwise,
+    the keys in :data:`FIELD_ORDER` come first, followed by any others sorted
+    by name.
+
+    :param results: The results of a check.
+    :type results: dict
+    :param target: If given, a ``Target`` item is included first.
+    :rtype: list
+
+    """
+    if isinstance(results, OrderedDict):
+        items = list(results.items())
+    else:
+        items = sorted(results.items(), key=lambda item: (
+            _FIELD_RANK.get(item[0], len(FIELD_ORDER)), item[0]))
+    if target is not None:
+        items.insert(0, ('Target', str(target)))
+    return items
+
+
+def _exit_code(results):
+    if results['Status'] == 'OK':
+        return 0
+    else:
+        return 1
+
+
+class ResultWriter(object):
+    """Base class for writing results to a stream. Encoded results are
+    collected in a buffer, which is written out with a single call once it
+    grows past ``buffer_size``, once a result has waited ``max_delay``
+    seconds, or when :meth:`.flush` is called.
+
+    :param stream: The output file to write to.
+    :param buffer_size: The number of buffered characters or bytes that
+                        causes the buffer to be written out. Use ``0`` to
+                        write out every result immediately.
+    :type buffer_size: int
+    :param max_delay: If given, the buffer is also written out once the
+                      oldest buffered result has waited this many seconds,
+                      even if nothing else is written. A background thread
+                      is started for this on the first buffered result.
+    :type max_delay: float
+
+    """
+
+    def __init__(self, stream, buffer_size=65536, max_delay=None):
+        super(ResultWriter, self).__init__()
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.max_delay = max_delay
+        self._buffer = []
+        self._buffered = 0
+        self._buffered_at = None
+        self._records = 0
+        self._lock = threading.Condition()
+        self._flusher = None
+
+    def _encode(self, results, target):
+        raise NotImplementedError()
+
+    def _flush_delayed(self):
+        with self._lock:
+            while True:
+                if self._buffered_at is None:
+                    self._lock.wait()
+                    continue
+                remaining = self._buffered_at + self.max_delay - time.time()
+                if remaining > 0.0:
+                    self._lock.wait(remaining)
+                else:
+                    self._flush()
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._flush_delayed)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def write(self, results, target=None):
+        """Writes the results of one check.
+
+        :param results: The results of a check.
+        :type results: dict
+        :param target: If given, the target that was checked is included in
+                       the output.
+        :returns: A return code that would be appropriate to return to the
+                  operating system, e.g. zero means success, non-zero means
+                  failure.
+        :rtype: int
+
+        """
+        data = self._encode(results, target)
+        self._records += 1
+        with self._lock:
+            if not self._buffer and self.max_delay is not None:
+                self._buffered_at = time.time()
+                if self._flusher is None:
+                    self._start_flusher()
+                self._lock.notify()
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.buffer_size:
+                self._flush()
+            elif self.max_delay is not None and \
+                    time.time() - self._buffered_at >= self.max_delay:
+                self._flush()
+        return _exit_code(results)
+
+    def _flush(self):
+        if self._buffer:
+            data = self._buffer[0][0:0].join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._buffered_at = None
+            self.stream.write(data)
+        self.stream.flush()
+
+    def flush(self):
+        """Writes out any buffered results and flushes the stream."""
+        with self._lock:
+            self._flush()
+
+
+def _escape_lines(value):
+    if '\n' not in value and '\r' not in value:
+        return value
+    return value.replace('\\', '\\\\').replace('\r', '\\r') \
+        .replace('\n', '\\n')
+
+
+class HeaderWriter(ResultWriter):
+    """Writes results similarly to HTTP headers, where each line has a key
+    and value, separated by ``: ``. Consecutive results are separated by a
+    blank line. Values that span several lines, e.g. a multi-line
+    ``Banner``, are written on one line with backslash escapes.
+
+    """
+
+    def _encode(self, results, target):
+        lines = []
+        if self._records > 0:
+            lines.append('')
+        for key, val in ordered_items(results, target):
+            if isinstance(val, _string_types):
+                lines.append('{0}: {1!s}'.format(key, _escape_lines(val)))
+            elif isinstance(val, float):
+                lines.append('{0}: {1:.5f}'.format(key, val))
+            elif val is None:
+                lines.append('{0}: '.format(key))
+            else:
+                lines.append('{0}: {1!s}'.format(key, val))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class JsonLinesWriter(ResultWriter):
+    """Writes each result as a JSON object on its own line."""
+
+    def _encode(self, results, target):
+        items = OrderedDict((key, _to_text(val)) for key, val in
+                            ordered_items(results, target))
+        return json.dumps(items, separators=(',', ':')) + '\n'
+
+
+class BinaryWriter(ResultWriter):
+    """Writes each result as a compact binary record, for high-volume
+    pipelines. The stream must accept bytes. Each record is a 4-byte
+    big-endian length followed by that many bytes of fields. Each field is:
+
+    * A 1-byte key: the index of a key in :data:`FIELD_ORDER`, or ``255``
+      followed by a string holding any other key.
+    * A 1-byte type: ``s`` for a string, ``f`` for a float, ``i`` for an
+      integer, ``b`` for a boolean, or ``n`` for ``None``.
+    * The value: strings are a 2-byte big-endian length followed by UTF-8
+      bytes, floats are 8-byte doubles, integers are 8-byte signed integers,
+      booleans are 1 byte, and ``None`` is empty.
+
+    Records may be read back with :func:`read_binary_records`.
+
+    """
+
+    def _encode_string(self, value):
+        value = _to_text(value).encode('utf-8')
+        if len(value) > 65535:
+            # Do not cut a multi-byte character in half.
+            value = value[0:65535].decode('utf-8', 'ignore').encode('utf-8')
+        return struct.pack('>H', len(value)) + value
+
+    def _encode(self, results, target):
+        parts = []
+        for key, val in ordered_items(results, target):
+            rank = _FIELD_RANK.get(key)
+            if rank is None:
+                parts.append(b'\xff' + self._encode_string(key))
+            else:
+                parts.append(struct.pack('>B', rank))
+            if isinstance(val, bool):
+                parts.append(b'b' + struct.pack('>?', val))
+            elif isinstance(val, float):
+                parts.append(b'f' + struct.pack('>d', val))
+            elif isinstance(val, int):
+                parts.append(b'i' + struct.pack('>q', val))
+            elif val is None:
+                parts.append(b'n')
+            elif isinstance(val, _string_types):
+                parts.append(b's' + self._encode_string(val))
+            else:
+                parts.append(b's' + self._encode_string(str(val)))
+        payload = b''.join(parts)
+        return struct.pack('>I', len(payload)) + payload
+
+
+class ChangeWriter(object):
+    """Wraps another writer so that the results of a target are only written
+    when its state changes, e.g. from ``OK`` to ``CRITICAL`` or to a different
+    banner code, rather than after every check. The state of each target is a
+    tuple of its values for ``keys``, so each check is compared with the last
+    one in constant time however many targets there are. Identical states are
+    shared between targets, so unchanged targets cost one dictionary entry.
+    Missing values of ``sticky_keys`` keep their previous value, and their
+    first value is not counted as a change.
+
+    Written results are copied and given a ``Change`` key: ``new`` for the
+    first results of a target, ``changed`` for a change of state, or
+    ``snapshot`` for results written only because of ``snapshot_interval``.
+    Results written without a target are always passed through. Unchanged
+    results never reach ``writer``, so a change is only written out promptly
+    if ``writer`` has a ``max_delay``, not by the writes that follow it.
+
+    :param writer: The writer for the desired output format.
+    :type writer: :class:`ResultWriter`
+    :param snapshot_interval: If given, the results of a target are also
+                              written when they have not been written for this
+                              many seconds, so that the full state of every
+                              target can be rebuilt from recent output.
+    :type snapshot_interval: float
+    :param keys: The result keys that make up the state of a target.
+    :type keys: tuple
+    :param sticky_keys: The keys whose missing values are not a change.
+    :type sticky_keys: tuple
+
+    """
+
+    def __init__(self, writer, snapshot_interval=None, keys=STATE_KEYS,
+                 sticky_keys=STICKY_STATE_KEYS):
+        super(ChangeWriter, self).__init__()
+        from . import monotonic
+        self.writer = writer
+        self.snapshot_interval = snapshot_interval
+        self.keys = keys
+        self._sticky = frozenset(i for i, key in enumerate(keys)
+                                 if key in sticky_keys)
+        self._monotonic = monotonic
+
+        #: The number of results that were not written because the state of
+        #: their target had not changed.
+        self.unchanged = 0
+
+        self._states = {}
+        self._interned = {}
+
+    def _get_state(self, results, previous):
+        state = [results.get(key) for key in self.keys]
+        if previous is not None:
+            for i in self._sticky:
+                if state[i] is None:
+                    state[i] = previous[i]
+        state = tuple(state)
+        return self._interned.setdefault(state, state)
+
+    def _changed(self, old, new):
+        # The first value of a sticky key is learned without a change.
+        for i, value in enumerate(old):
+            if value != new[i] and (value is not None or
+                                    i not in self._sticky):
+                return True
+        return False
+
+    def write(self, results, target=None):
+        """Writes the results of one check, if the state of the target has
+        changed. See :meth:`ResultWriter.write`.
+
+        :param results: The results of a check.
+        :type results: dict
+        :param target: The target that was checked, which identifies the
+                       previous results to compare with.
+        :returns: A return code that would be appropriate to return to the
+                  operating system, whether or not the results were written.
+        :rtype: int
+
+        """
+        if target is None:
+            return self.writer.write(results)
+        now = self._monotonic()
+        previous = self._states.get(target)
+        state = self._get_state(results,
+                                None if previous is None else previous[0])
+        # States are interned, so equal states are the same object.
+        if previous is None:
+            change = 'new'
+        elif previous[0] is not state and \
+                self._changed(previous[0], state):
+            change = 'changed'
+        elif self.snapshot_interval is not None and \
+                now - previous[1] >= self.snapshot_interval:
+            change = 'snapshot'
+        else:
+            if previous[0] is not state:
+                self._states[target] = (state, previous[1])
+            self.unchanged += 1
+            return _exit_code(results)
+        self._states[target] = (state, now)
+        results = results.copy()
+        results['Change'] = change
+        return self.writer.write(results, target)
+
+    def flush(self):
+        """Writes out any buffered results and flushes the stream."""
+        self.writer.flush()
+
+
+def _decode_string(data, pos):
+    length, = struct.unpack_from('>H', data, pos)
+    pos += 2
+    return data[pos:pos+length].decode('utf-8'), pos + length
+
+
+def read_binary_records(stream):
+    """Reads the records written by a :class:`BinaryWriter`.
+
+    :param stream: The input file to read bytes from.
+    :returns: Generator of :class:`~collections.OrderedDict` results.
+
+    """
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+        length, = struct.unpack('>I', header)
+        data = stream.read(length)
+        pos = 0
+        results = OrderedDict()
+        while pos < length:
+            rank = ord(data[pos:pos+1])
+            pos += 1
+            if rank == 255:
+                key, pos = _decode_string(data, pos)
+            else:
+                key = FIELD_ORDER[rank]
+            kind = data[pos:pos+1]
+            pos += 1
+            if kind == b's':
+                val, pos = _decode_string(data, pos)
+            elif kind == b'f':
+                val, = struct.unpack_from('>d', data, pos)
+                pos += 8
+            elif kind == b'i':
+                val, = struct.unpack_from('>q', data, pos)
+                pos += 8
+            elif kind == b'b':
+                val, = struct.unpack_from('>?', data, pos)
+                pos += 1
+            else:
+                val = None
+            results[key] = val
+        yield results
+
+
+#: Maps the name of each output format to its writer class.
+FORMATS = OrderedDict([('header', HeaderWriter),
+                       ('json', JsonLinesWriter),
+                       ('binary', BinaryWriter)])
+
+
+def get_writer(fmt, stream, buffer_size=65536, max_delay=None):
+    """Creates a writer for the named output format.
+
+    :param fmt: The output format, one of the keys of :data:`FORMATS`.
+    :type fmt: str
+    :param stream: The output file to write to.
+    :param buffer_size: See :class:`ResultWriter`.
+    :type buffer_size: int
+    :param max_delay: See :class:`ResultWriter`.
+    :type max_delay: float
+    :rtype: :class:`ResultWriter`
+    :raises: ValueError
+
+    """
+    try:
+        writer_class = FORMATS[fmt]
+    except KeyError:
+        raise ValueError('Unknown output format: ' + repr(fmt))
+    return writer_class(stream, buffer_size, max_delay)
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,187 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing the compact mapping that holds the results of a health
+check.
+
+"""
+
+from __future__ import absolute_import
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from .output import FIELD_ORDER
+
+_KEYS = tuple(key for key in FIELD_ORDER if key != 'Target')
+_ATTRS = dict((key, key.lower().replace('-', '_')) for key in _KEYS)
+
+
+class CheckResults(object):
+    """Holds the results of a check, e.g. ``Status`` and ``Dns-Elapsed``.
+    It behaves like a :class:`dict`, but the keys in
+    :data:`~smtphealth.output.FIELD_ORDER` are kept in slots rather than a
+    hash table, which uses a fraction of the memory when many results are
+    kept at once. Any other keys are kept in an ordinary dictionary.
+
+    Iterating yields the known keys in the order of
+    :data:`~smtphealth.output.FIELD_ORDER`, followed by any others sorted by
+    name.
+
+    :param args: Optional mapping or iterable of ``(key, value)`` pairs to
+                 initialize the results with, as with :class:`dict`.
+
+    """
+
+    __slots__ = tuple(_ATTRS[key] for key in _KEYS) + ('_extra', )
+
+    __hash__ = None
+
+    def __init__(self, *args, **kwargs):
+        super(CheckResults, self).__init__()
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            try:
+                return getattr(self, attr)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            setattr(self, attr, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            return hasattr(self, attr)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in _KEYS:
+            if hasattr(self, _ATTRS[key]):
+                yield key
+        if self._extra:
+            for key in sorted(self._extra):
+                yield key
+
+    def __len__(self):
+        count = len(self._extra) if self._extra else 0
+        for key in _KEYS:
+            if hasattr(self, _ATTRS[key]):
+                count += 1
+        return count
+
+    def __eq__(self, other):
+        if not isinstance(other, (dict, MutableMapping)):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        if ret is NotImplemented:
+            return ret
+        return not ret
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, dict(self.items()))
+
+    def __reduce__(self):
+        return type(self), (self.items(), )
+
+    def get(self, key, default=None):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            return getattr(self, attr, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def update(self, *args, **kwargs):
+        if args:
+            other, = args
+            if hasattr(other, 'keys'):
+                other = [(key, other[key]) for key in other.keys()]
+            for key, value in other:
+                self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def copy(self):
+        return type(self)(self)
+
+
+MutableMapping.register(CheckResults)
+
+
+# vim:et:sts=4:sw=4:ts=4
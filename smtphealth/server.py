@@ -0,0 +1,145 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Module containing a resident server that runs health checks sent to it
+over a Unix domain socket, and the client that sends them. This avoids the
+cost of starting the interpreter and importing modules for every check.
+
+Each request is one line of JSON with the command-line arguments of the
+check. The response is the exit code on its own line, followed by the
+output of the check until the connection closes.
+
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import sys
+import json
+import stat
+import socket
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+
+def _native_args(argv):
+    if sys.version_info[0] < 3:
+        return [arg.encode('utf-8') for arg in argv]
+    return list(argv)
+
+
+def _new_buffer():
+    raw = io.BytesIO()
+    if sys.version_info[0] < 3:
+        return raw, raw
+    return io.TextIOWrapper(raw, 'utf-8', write_through=True), raw
+
+
+class _CheckHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            argv = _native_args(request['argv'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+        stream, raw = _new_buffer()
+        try:
+            ret = self.server.run_check(argv, stream)
+        except SystemExit as exc:
+            ret = exc.code if isinstance(exc.code, int) else 2
+        stream.flush()
+        self.wfile.write('{0}\n'.format(ret).encode('ascii'))
+        self.wfile.write(raw.getvalue())
+
+
+class CheckServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Listens on a Unix domain socket, running each request on its own
+    thread. A stale socket file left at the path is replaced.
+
+    :param path: The path of the socket file.
+    :type path: str
+    :param run_check: Called with the command-line arguments of each request
+                      and a stream to write output to, and returns the exit
+                      code.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, run_check):
+        self.path = path
+        self.run_check = run_check
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except OSError:
+            pass
+        socketserver.UnixStreamServer.__init__(self, path, _CheckHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def send_check(path, argv):
+    """Sends a check to a :class:`CheckServer` and waits for it to finish.
+
+    :param path: The path of the server's socket file.
+    :type path: str
+    :param argv: The command-line arguments of the check.
+    :type argv: list
+    :returns: The exit code and the output of the check, as bytes.
+    :rtype: tuple
+    :raises: :exc:`socket.error` if the server could not be reached,
+             :exc:`ValueError` if it did not respond.
+
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        request = json.dumps({'argv': list(argv)}) + '\n'
+        sock.sendall(request.encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        parts = []
+        while True:
+            part = sock.recv(65536)
+            if not part:
+                break
+            parts.append(part)
+    finally:
+        sock.close()
+    ret, sep, output = b''.join(parts).partition(b'\n')
+    if not sep:
+        raise ValueError('The check server did not respond.')
+    return int(ret), output
+
+
+# vim:et:sts=4:sw=4:ts=4
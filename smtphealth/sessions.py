@@ -0,0 +1,429 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing pools of SMTP sessions that are kept open between
+probes. Probing a server every few seconds with a full DNS, TCP, SSL and
+banner cycle churns through connections on both ends. Instead, a probe sends
+a ``NOOP`` or ``EHLO`` command on a session that is already open, and times
+the round trip.
+
+"""
+
+from __future__ import absolute_import
+
+import socket
+import threading
+
+from . import SmtpHealthCheck, Timeout, BannerSyntaxError, monotonic, \
+    _split_lines
+from .results import CheckResults
+from . import failures
+
+#: Probes with a ``NOOP`` command.
+NOOP = 'NOOP'
+
+#: Probes with an ``EHLO`` command, which also makes the server list its
+#: extensions.
+EHLO = 'EHLO'
+
+#: Every probe command.
+COMMANDS = (NOOP, EHLO)
+
+#: The longest a session is kept idle by :func:`default_max_idle`, in
+#: seconds. RFC 5321 only asks servers to wait five minutes for a command.
+MAX_IDLE = 300.0
+
+_REPLY_FAILURES = {'4': failures.REPLY_4XX, '5': failures.REPLY_5XX}
+
+
+def default_max_idle(interval):
+    """Returns how long sessions may be idle and still be reused, when each
+    server is probed about every ``interval`` seconds. This leaves room for
+    the next probe to be delayed by jitter, up to :data:`MAX_IDLE`.
+
+    :param interval: The number of seconds between probes of a server.
+    :type interval: float
+    :rtype: float
+
+    """
+    return min(interval * 1.5, MAX_IDLE)
+
+
+def _quit(check):
+    # Saying goodbye is a courtesy, so failures are ignored.
+    try:
+        check.sock.settimeout(0.0)
+        check.sock.send(b'QUIT\r\n')
+    except (socket.error, ValueError):
+        pass
+
+
+class SessionPool(object):
+    """Keeps up to ``size`` SMTP sessions open to one server, and probes the
+    server on them. Each session is opened by a full
+    :class:`~smtphealth.SmtpHealthCheck`, whose results are reported by the
+    probe that opened it. Later probes reuse the session.
+
+    A session that turns out to be broken when it is reused, e.g. because
+    the server closed it, is replaced by a new one transparently. The probe
+    then reports the results of the new session. Sessions left idle longer
+    than ``max_idle`` are closed rather than reused, because servers close
+    idle sessions themselves. Idle sessions do not hold a slot under the caps
+    of a :class:`~smtphealth.limits.ConnectionLimiter`.
+
+    The pool is thread-safe. Concurrent probes use separate sessions, and
+    sessions beyond ``size`` are closed after their probe.
+
+    :param host: The hostname or IP address of the SMTP server.
+    :type host: str
+    :param port: The port number of the SMTP server.
+    :type port: int
+    :param with_ssl: If ``True``, SSL is initiated on each new session.
+    :type with_ssl: bool
+    :param size: The maximum number of idle sessions to keep.
+    :type size: int
+    :param command: The probe command, :data:`NOOP` or :data:`EHLO`.
+    :type command: str
+    :param max_idle: The number of seconds a session may be idle and still be
+                     reused.
+    :type max_idle: float
+    :param check_kwargs: Keyword arguments passed in to the constructor of
+                         each :class:`~smtphealth.SmtpHealthCheck` that opens
+                         a session. Its ``banner_timeout`` is also the
+                         timeout of each probe.
+
+    """
+
+    #: The class instantiated to open each session.
+    check_class = SmtpHealthCheck
+
+    #: The weight of each new round trip in the smoothed :attr:`.rtt`.
+    gain = 0.125
+
+    def __init__(self, host, port=25, with_ssl=False, size=2, command=NOOP,
+                 max_idle=60.0, **check_kwargs):
+        super(SessionPool, self).__init__()
+        if size < 1:
+            raise ValueError('Size must be at least one.')
+        if command not in COMMANDS:
+            raise ValueError('Unknown probe command: ' + repr(command))
+        self.host = host
+        self.port = port
+        self.with_ssl = with_ssl
+        self.size = size
+        self.command = command
+        self.max_idle = max_idle
+        self.check_kwargs = check_kwargs
+
+        #: The smoothed round-trip time of probes, in seconds, or ``None``
+        #: before the first successful probe.
+        self.rtt = None
+
+        #: The number of broken sessions that were replaced.
+        self.reconnects = 0
+
+        self._line = self._get_line(command)
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _get_line(self, command):
+        if command == EHLO:
+            command = 'EHLO ' + socket.gethostname()
+        return (command + '\r\n').encode('ascii')
+
+    def __len__(self):
+        return self._open
+
+    def _take(self):
+        now = monotonic()
+        stale = []
+        check = None
+        with self._lock:
+            while self._idle:
+                check, since = self._idle.pop()
+                if now - since <= self.max_idle:
+                    break
+                stale.append(check)
+                check = None
+        for old in stale:
+            self._discard(old)
+        if check is not None:
+            check.resume_limit()
+        return check
+
+    def _connect(self):
+        check = self.check_class(**self.check_kwargs)
+        if not check.open(self.host, self.port, self.with_ssl):
+            return None, check.results
+        with self._lock:
+            self._open += 1
+        return check, check.results
+
+    def _keep(self, check):
+        # Idle sessions do not count against the limiter's caps, or a full
+        # check of the same server could wait on them forever.
+        check.suspend_limit()
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append((check, monotonic()))
+                return
+        self._discard(check)
+
+    def _discard(self, check):
+        with self._lock:
+            self._open -= 1
+        _quit(check)
+        check.close()
+
+    def _exchange(self, check):
+        with Timeout(check.banner_timeout, 'Probe timed out.') as timer:
+            check.sock.settimeout(timer.remaining())
+            check.sock.sendall(self._line)
+            reply = check._read_reply(timer)
+        lines = _split_lines(reply)
+        matches = [check.banner_pattern.match(line) for line in lines]
+        if not lines or not all(matches):
+            raise BannerSyntaxError('Invalid reply received: '+repr(reply))
+        return matches[0].group(1), matches[0].group(2), timer.elapsed
+
+    def _finish(self, results, check, code, message, elapsed):
+        results['Session-Rtt'] = elapsed
+        results['Reply-Code'] = code
+        results['Reply-Message'] = message
+        if code.startswith('2'):
+            results['Status'] = 'OK'
+            with self._lock:
+                if self.rtt is None:
+                    self.rtt = elapsed
+                else:
+                    self.rtt += self.gain * (elapsed - self.rtt)
+            self._keep(check)
+        else:
+            results['Failure'] = _REPLY_FAILURES.get(code[0:1],
+                                                     failures.SESSION_FAILED)
+            self._discard(check)
+        results['Pool-Rtt'] = self.rtt
+        results['Pool-Sessions'] = self._open
+        return results
+
+    def _record_exception(self, results, exc):
+        if isinstance(exc, (Timeout, socket.timeout)):
+            results['Failure'] = failures.SESSION_TIMEOUT
+        elif isinstance(exc, BannerSyntaxError):
+            results['Failure'] = failures.REPLY_SYNTAX
+        else:
+            results['Failure'] = failures.SESSION_FAILED
+        results['Exception-Type'] = str(type(exc).__name__)
+        results['Exception-Value'] = str(exc)
+        results['Pool-Sessions'] = self._open
+
+    def probe(self):
+        """Probes the server on an idle session, or on a new session if none
+        is idle or the idle session is broken.
+
+        :returns: The results of the probe, in the same form as
+                  :attr:`smtphealth.SmtpHealthCheck.results`. The
+                  ``Session-Rtt`` is the round-trip time of the probe, and
+                  ``Pool-Rtt`` the smoothed round-trip time of the pool. If a
+                  new session was opened, the results of the check that
+                  opened it are included.
+        :rtype: :class:`~smtphealth.results.CheckResults`
+
+        """
+        results = CheckResults(Status='CRITICAL')
+        check = self._take()
+        if check is not None:
+            try:
+                reply = self._exchange(check)
+            except Exception:
+                reply = None
+            # Servers may close idle sessions, sometimes with a 421 reply
+            # that is only read by the next probe, so any failure on a
+            # reused session is retried on a new one.
+            if reply is not None and reply[0].startswith('2'):
+                results['Session-Reused'] = True
+                return self._finish(results, check, *reply)
+            self._discard(check)
+            with self._lock:
+                self.reconnects += 1
+            results['Session-Reconnected'] = True
+        check, check_results = self._connect()
+        results.update(check_results)
+        results['Session-Reused'] = False
+        if check is None:
+            results['Pool-Sessions'] = self._open
+            return results
+        results['Status'] = 'CRITICAL'
+        try:
+            reply = self._exchange(check)
+        except Exception as exc:
+            self._discard(check)
+            self._record_exception(results, exc)
+            return results
+        return self._finish(results, check, *reply)
+
+    def close(self):
+        """Closes every idle session. Sessions in use by a probe are closed
+        once it finishes.
+
+        """
+        with self._lock:
+            self._closed = True
+            idle = [check for check, since in self._idle]
+            del self._idle[:]
+        for check in idle:
+            self._discard(check)
+
+
+class SessionPools(object):
+    """Keeps a :class:`SessionPool` for every server probed by a
+    :class:`SessionCheck`, and decides when each server is due for a full
+    check instead of a probe. The pools are thread-safe.
+
+    :param size: The maximum number of idle sessions kept to each server.
+    :type size: int
+    :param command: The probe command, :data:`NOOP` or :data:`EHLO`.
+    :type command: str
+    :param deep_interval: The number of seconds between full checks of each
+                          server.
+    :type deep_interval: float
+    :param max_idle: The number of seconds a session may be idle and still be
+                     reused.
+    :type max_idle: float
+
+    """
+
+    def __init__(self, size=2, command=NOOP, deep_interval=300.0,
+                 max_idle=60.0):
+        super(SessionPools, self).__init__()
+        if command not in COMMANDS:
+            raise ValueError('Unknown probe command: ' + repr(command))
+        self.size = size
+        self.command = command
+        self.deep_interval = deep_interval
+        self.max_idle = max_idle
+        self._pools = {}
+        self._deep_at = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pools)
+
+    def get(self, host, port, with_ssl, check_kwargs):
+        """Returns the pool of sessions to a server, creating it if needed.
+
+        :param host: The hostname or IP address of the SMTP server.
+        :type host: str
+        :param port: The port number of the SMTP server.
+        :type port: int
+        :param with_ssl: If ``True``, SSL is initiated on each new session.
+        :type with_ssl: bool
+        :param check_kwargs: Keyword arguments for each
+                             :class:`~smtphealth.SmtpHealthCheck` that opens
+                             a session.
+        :type check_kwargs: dict
+        :rtype: :class:`SessionPool`
+
+        """
+        key = (host, port, with_ssl)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = SessionPool(
+                    host, port, with_ssl, self.size, self.command,
+                    self.max_idle, **check_kwargs)
+            return pool
+
+    def deep_due(self, host, port, with_ssl, now=None):
+        """Decides whether a server is due for a full check, in which case
+        the time of the check is recorded.
+
+        :param host: The hostname or IP address of the SMTP server.
+        :type host: str
+        :param port: The port number of the SMTP server.
+        :type port: int
+        :param with_ssl: Whether SSL is initiated.
+        :type with_ssl: bool
+        :param now: The current :func:`~smtphealth.monotonic` time.
+        :type now: float
+        :rtype: bool
+
+        """
+        if now is None:
+            now = monotonic()
+        key = (host, port, with_ssl)
+        with self._lock:
+            last = self._deep_at.get(key)
+            if last is not None and now - last < self.deep_interval:
+                return False
+            self._deep_at[key] = now
+            return True
+
+    def close(self):
+        """Closes the idle sessions of every pool."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+
+class SessionCheck(SmtpHealthCheck):
+    """A health check that probes a kept-alive session from
+    :class:`SessionPools`, except every ``deep_interval`` seconds, when it
+    runs the full check of :class:`~smtphealth.SmtpHealthCheck` instead.
+    Other keyword arguments are the same as those of
+    :class:`~smtphealth.SmtpHealthCheck`, and are also used to open each
+    session.
+
+    :param sessions: The pools shared by every check.
+    :type sessions: :class:`SessionPools`
+
+    """
+
+    def __init__(self, sessions, **kwargs):
+        super(SessionCheck, self).__init__(**kwargs)
+        self.sessions = sessions
+        self._check_kwargs = kwargs
+
+    def run(self, host, port=25, with_ssl=False):
+        """Probes the host on a kept-alive session, or runs the full check if
+        it is due. This method may only be called once per object.
+
+        :param host: The hostname or IP address of the SMTP server to check.
+        :type host: str
+        :param port: The port number of the SMTP server to check.
+        :type port: int
+        :param with_ssl: If ``True``, SSL will be initiated before attempting
+                         to get the banner message.
+        :type with_ssl: bool
+
+        """
+        if self.sessions.deep_due(host, port, with_ssl):
+            super(SessionCheck, self).run(host, port, with_ssl)
+            return
+        pool = self.sessions.get(host, port, with_ssl, self._check_kwargs)
+        self.results = pool.probe()
+
+
+# vim:et:sts=4:sw=4:ts=4
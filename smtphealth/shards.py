@@ -0,0 +1,256 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Module containing an engine that spreads health checks across several
+processes, for sweeps too large for one CPU.
+
+"""
+
+from __future__ import absolute_import
+
+import signal
+import resource
+import threading
+import multiprocessing
+from collections import namedtuple
+
+try:
+    from Queue import Empty, Full
+except ImportError:
+    from queue import Empty, Full
+
+from . import monotonic
+from .engine import _POLL_INTERVAL
+
+
+class ShardStats(namedtuple('ShardStats', 'shard checks healthy elapsed '
+                                          'cpu exitcode')):
+    """The throughput of one worker process of a :class:`ShardedEngine`.
+
+    :param shard: The index of the worker process.
+    :param checks: The number of checks the worker finished.
+    :param healthy: The number of those checks with an ``OK`` status.
+    :param elapsed: The seconds from the start of the worker to its last
+                    check.
+    :param cpu: The CPU seconds used by the worker.
+    :param exitcode: ``None`` if the worker finished normally, otherwise the
+                     exit code it died with.
+
+    """
+    __slots__ = ()
+
+    @property
+    def rate(self):
+        """The number of checks finished per second."""
+        if self.elapsed <= 0.0:
+            return 0.0
+        return self.checks / self.elapsed
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _put(queue, item, stop=None):
+    while stop is None or not stop.is_set():
+        try:
+            queue.put(item, True, _POLL_INTERVAL)
+        except Full:
+            continue
+        return True
+    return False
+
+
+def _read_batches(tasks):
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        for target in batch:
+            yield target
+
+
+def _worker(shard, engine, tasks, finished):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    start = monotonic()
+    checks = healthy = 0
+    for target, check in engine.run(_read_batches(tasks)):
+        _put(finished, (shard, target, check))
+        checks += 1
+        if check.results['Status'] == 'OK':
+            healthy += 1
+    stats = ShardStats(shard, checks, healthy, monotonic() - start,
+                       _cpu_time(), None)
+    _put(finished, (shard, None, stats))
+
+
+class ShardedEngine(object):
+    """Splits the targets of a sweep across a pool of worker processes, each
+    running its own copy of a :class:`~smtphealth.engine.CheckEngine`. This
+    spreads the CPU cost of SSL handshakes across every core.
+
+    Targets are handed to the workers in batches, as the workers ask for
+    them, and finished checks are sent back to this process as soon as they
+    finish. Both queues are bounded, so a slow consumer of :meth:`.run`
+    pauses the workers rather than growing their memory.
+
+    Worker processes are forked, so any caches given to the engine, e.g. a
+    :class:`~smtphealth.dnscache.DnsCache`, are copied rather than shared.
+
+    :param engine: The engine run by each worker.
+    :type engine: :class:`~smtphealth.engine.CheckEngine`
+    :param processes: The number of worker processes, by default the number
+                      of CPUs.
+    :type processes: int
+    :param batch_size: The number of targets handed to a worker at a time.
+    :type batch_size: int
+
+    """
+
+    def __init__(self, engine, processes=None, batch_size=64):
+        super(ShardedEngine, self).__init__()
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes < 1:
+            raise ValueError('Processes must be at least one.')
+        self.engine = engine
+        self.processes = processes
+        self.batch_size = batch_size
+
+        #: After :meth:`.run` finishes, the :class:`ShardStats` of each
+        #: worker process, in shard order.
+        self.stats = []
+
+    def _feed(self, targets, tasks, stop):
+        batch = []
+        try:
+            for target in targets:
+                if stop.is_set():
+                    return
+                batch.append(target)
+                if len(batch) >= self.batch_size:
+                    if not _put(tasks, batch, stop):
+                        return
+                    batch = []
+            if batch:
+                _put(tasks, batch, stop)
+        finally:
+            for i in range(self.processes):
+                _put(tasks, None, stop)
+
+    def _start(self, tasks, finished):
+        workers = []
+        for shard in range(self.processes):
+            process = multiprocessing.Process(
+                target=_worker, args=(shard, self.engine, tasks, finished))
+            process.daemon = True
+            process.start()
+            workers.append(process)
+        return workers
+
+    def _receive(self, workers, finished, stats, counts):
+        while len(stats) < self.processes:
+            try:
+                item = finished.get(True, _POLL_INTERVAL)
+            except Empty:
+                pass
+            else:
+                yield item
+                continue
+            dead = [shard for shard, process in enumerate(workers)
+                    if shard not in stats and not process.is_alive()]
+            if not dead:
+                continue
+            # A worker may send its last checks and its stats just before
+            # exiting, after the poll above gave up, so anything already
+            # sent is read before deciding which workers died without it.
+            while True:
+                try:
+                    item = finished.get(False)
+                except Empty:
+                    break
+                yield item
+            for shard in dead:
+                if shard not in stats:
+                    stats[shard] = ShardStats(shard, counts[shard], 0, 0.0,
+                                              0.0, workers[shard].exitcode)
+
+    def _drain(self, tasks):
+        # Once the workers are gone, nothing reads any remaining batches.
+        # They are drained so the queue does not write to a closed pipe.
+        tasks.cancel_join_thread()
+        while True:
+            try:
+                tasks.get(True, 0.05)
+            except Empty:
+                break
+
+    def run(self, targets):
+        """Checks every target, yielding each one as soon as its check
+        finishes in any worker. Results are therefore produced in completion
+        order, not in the order of ``targets``.
+
+        :param targets: Iterable of ``(host, port, with_ssl)`` tuples. This
+                        is consumed lazily, so it may be a generator. Each
+                        target must be picklable.
+        :returns: Generator of ``(target, check)`` tuples, where ``check``
+                  holds the :attr:`~smtphealth.SmtpHealthCheck.results` of
+                  the finished check.
+
+        """
+        queue_size = self.processes * 2
+        tasks = multiprocessing.Queue(queue_size)
+        finished = multiprocessing.Queue(queue_size * self.batch_size)
+        stop = threading.Event()
+        workers = self._start(tasks, finished)
+        feeder = threading.Thread(target=self._feed,
+                                  args=(targets, tasks, stop))
+        feeder.daemon = True
+        feeder.start()
+        stats = {}
+        counts = [0] * self.processes
+        try:
+            for shard, target, check in self._receive(workers, finished,
+                                                      stats, counts):
+                if target is None:
+                    stats[shard] = check
+                else:
+                    counts[shard] += 1
+                    yield target, check
+            for process in workers:
+                process.join()
+        finally:
+            stop.set()
+            for process in workers:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            feeder.join(_POLL_INTERVAL)
+            self._drain(tasks)
+            self.stats = [stats.get(shard, ShardStats(shard, counts[shard], 0,
+                                                      0.0, 0.0, None))
+                          for shard in range(self.processes)]
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,264 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing routines for checking an SMTP server repeatedly and
+summarizing the latency of each stage of the checks.
+
+"""
+
+from __future__ import absolute_import
+
+import math
+import time
+from array import array
+from collections import OrderedDict
+
+from . import SmtpHealthCheck, monotonic
+from .output import get_writer
+
+
+class LatencyHistogram(object):
+    """Records latencies into a fixed number of logarithmically sized
+    buckets, in the style of an HDR histogram. Memory use does not grow with
+    the number of values recorded, and every percentile is accurate to within
+    the given relative ``precision``.
+
+    :param lowest: The smallest distinguishable latency, in seconds. Smaller
+                   values are counted in the first bucket.
+    :type lowest: float
+    :param highest: The largest trackable latency, in seconds. Larger values
+                    are counted in the last bucket.
+    :type highest: float
+    :param precision: The relative width of each bucket, e.g. ``0.01`` for
+                      1%.
+    :type precision: float
+
+    """
+
+    def __init__(self, lowest=1e-6, highest=3600.0, precision=0.01):
+        super(LatencyHistogram, self).__init__()
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        size = self._index(highest) + 1
+        self._counts = array('L', [0]) * size
+
+        #: The number of values recorded.
+        self.count = 0
+
+        #: The smallest value recorded, or ``None``.
+        self.min = None
+
+        #: The largest value recorded, or ``None``.
+        self.max = None
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self._log_base) + 1
+
+    def _value(self, index):
+        if index == 0:
+            return self.lowest
+        return self.lowest * math.exp(index * self._log_base)
+
+    def record(self, value):
+        """Records one latency.
+
+        :param value: The latency, in seconds.
+        :type value: float
+
+        """
+        index = min(self._index(value), len(self._counts) - 1)
+        self._counts[index] += 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Returns the latency below which the given percentage of recorded
+        values fall. The result is the upper bound of the bucket holding that
+        value, clamped to the exact minimum and maximum recorded.
+
+        :param percent: The percentile, from 0 to 100.
+        :type percent: float
+        :returns: The latency in seconds, or ``None`` if nothing is recorded.
+        :rtype: float
+
+        """
+        if self.count == 0:
+            return None
+        elif percent <= 0.0:
+            return self.min
+        elif percent >= 100.0:
+            return self.max
+        target = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= target:
+                return max(self.min, min(self.max, self._value(index)))
+        return self.max
+
+
+class StageLatencies(object):
+    """Collects the results of many checks of the same server, recording the
+    elapsed time of each stage into a :class:`LatencyHistogram`.
+
+    :param histogram_kwargs: Keyword arguments given to each
+                             :class:`LatencyHistogram`.
+
+    """
+
+    #: The result keys of the stages that are recorded.
+    stages = ('Dns-Elapsed', 'Connect-Elapsed', 'Ssl-Elapsed',
+              'Banner-Elapsed')
+
+    #: The percentiles that are summarized, and the suffix of their keys.
+    percentiles = ((50.0, 'P50'), (90.0, 'P90'), (99.0, 'P99'))
+
+    def __init__(self, **histogram_kwargs):
+        super(StageLatencies, self).__init__()
+        self.histograms = OrderedDict((stage,
+                                       LatencyHistogram(**histogram_kwargs))
+                                      for stage in self.stages)
+
+        #: The number of checks recorded.
+        self.checks = 0
+
+        #: The number of checks recorded with an ``OK`` status.
+        self.healthy = 0
+
+    def add(self, results):
+        """Records the results of one check.
+
+        :param results: The :attr:`~smtphealth.SmtpHealthCheck.results` of a
+                        finished check.
+        :type results: dict
+
+        """
+        self.checks += 1
+        if results.get('Status') == 'OK':
+            self.healthy += 1
+        for stage, histogram in self.histograms.items():
+            elapsed = results.get(stage)
+            if elapsed is not None:
+                histogram.record(elapsed)
+
+    @property
+    def results(self):
+        """The summary of all recorded checks, including the minimum,
+        percentiles, and maximum of each stage that was reached. The
+        ``Status`` is ``OK`` only if every check was healthy.
+
+        :rtype: :class:`~collections.OrderedDict`
+
+        """
+        ret = OrderedDict()
+        if self.checks and self.healthy == self.checks:
+            ret['Status'] = 'OK'
+        else:
+            ret['Status'] = 'CRITICAL'
+        ret['Checks'] = self.checks
+        ret['Checks-Ok'] = self.healthy
+        for stage, histogram in self.histograms.items():
+            if histogram.count == 0:
+                continue
+            ret[stage + '-Min'] = histogram.min
+            for percent, suffix in self.percentiles:
+                ret[stage + '-' + suffix] = histogram.percentile(percent)
+            ret[stage + '-Max'] = histogram.max
+        return ret
+
+    def write(self, writer, target=None):
+        """Writes the summary :attr:`.results` using the given writer. See
+        :meth:`smtphealth.SmtpHealthCheck.write`.
+
+        :param writer: The writer for the desired output format.
+        :type writer: :class:`~smtphealth.output.ResultWriter`
+        :param target: If given, the target that was checked is included in
+                       the output.
+        :returns: A return code that would be appropriate to return to the
+                  operating system.
+        :rtype: int
+
+        """
+        return writer.write(self.results, target)
+
+    def output(self, stream, fmt='header'):
+        """Outputs the summary :attr:`.results` in the same formats as
+        :meth:`smtphealth.SmtpHealthCheck.output`.
+
+        :param stream: The output file to write to.
+        :param fmt: The output format, one of the keys of
+                    :data:`smtphealth.output.FORMATS`.
+        :type fmt: str
+        :returns: A return code that would be appropriate to return to the
+                  operating system.
+        :rtype: int
+
+        """
+        writer = get_writer(fmt, stream)
+        ret = self.write(writer)
+        writer.flush()
+        return ret
+
+
+def repeat_check(host, port=25, with_ssl=False, count=10, interval=1.0,
+                 check_class=SmtpHealthCheck, **check_kwargs):
+    """Checks the same SMTP server repeatedly, starting a new check every
+    ``interval`` seconds, and summarizes the latency of each stage.
+
+    :param host: The hostname or IP address of the SMTP server to check.
+    :type host: str
+    :param port: The port number of the SMTP server to check.
+    :type port: int
+    :param with_ssl: If ``True``, SSL will be initiated before attempting to
+                     get the banner message.
+    :type with_ssl: bool
+    :param count: The number of checks to run.
+    :type count: int
+    :param interval: The number of seconds from the start of one check to the
+                     start of the next.
+    :type interval: float
+    :param check_class: The class instantiated for each check.
+    :param check_kwargs: Keyword arguments passed in to the constructor of
+                         each check.
+    :rtype: :class:`StageLatencies`
+
+    """
+    latencies = StageLatencies()
+    next_start = monotonic()
+    for i in range(count):
+        if i > 0:
+            next_start += interval
+            delay = next_start - monotonic()
+            if delay > 0.0:
+                time.sleep(delay)
+        check = check_class(**check_kwargs)
+        check.run(host, port, with_ssl)
+        latencies.add(check.results)
+    return latencies
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,129 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing routines for parsing lists of SMTP servers to check.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+
+
+class Target(namedtuple('Target', 'host port with_ssl')):
+    """Describes one SMTP server to check, as a tuple that may be given
+    directly to :meth:`~smtphealth.engine.CheckEngine.run`.
+
+    :param host: The hostname or IP address of the SMTP server.
+    :type host: str
+    :param port: The port number of the SMTP server.
+    :type port: int
+    :param with_ssl: If ``True``, SSL is initiated before the banner.
+    :type with_ssl: bool
+
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        host = self.host
+        if ':' in host:
+            host = '[{0}]'.format(host)
+        ret = '{0}:{1}'.format(host, self.port)
+        if self.with_ssl:
+            ret += ',ssl'
+        return ret
+
+
+def parse_target(line, default_port=25, default_ssl=False):
+    """Parses a target string of the form ``host[:port][,ssl]``. IPv6
+    addresses must be enclosed in brackets when a port is given, e.g.
+    ``[::1]:25``.
+
+    :param line: The target string to parse.
+    :type line: str
+    :param default_port: The port to use if none is given.
+    :type default_port: int
+    :param default_ssl: Whether to use SSL if ``,ssl`` is not given.
+    :type default_ssl: bool
+    :rtype: :class:`Target`
+    :raises: ValueError
+
+    """
+    hostport, sep, flags = line.strip().partition(',')
+    with_ssl = default_ssl
+    if sep:
+        flags = flags.strip().lower()
+        if flags not in ('ssl', 'nossl'):
+            raise ValueError('Invalid target flags: ' + repr(line))
+        with_ssl = (flags == 'ssl')
+    port = default_port
+    if hostport.startswith('['):
+        host, sep, rest = hostport[1:].partition(']')
+        if not sep:
+            raise ValueError('Invalid target address: ' + repr(line))
+        if rest:
+            if not rest.startswith(':'):
+                raise ValueError('Invalid target address: ' + repr(line))
+            port = rest[1:]
+    elif hostport.count(':') == 1:
+        host, port = hostport.split(':')
+    else:
+        host = hostport
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Invalid target port: ' + repr(line))
+    if not host:
+        raise ValueError('Invalid target host: ' + repr(line))
+    return Target(host, port, with_ssl)
+
+
+def read_targets(stream, default_port=25, default_ssl=False, errors=None):
+    """Lazily reads targets from a stream, one per line, as parsed by
+    :func:`parse_target`. Blank lines and lines starting with ``#`` are
+    ignored.
+
+    :param stream: The input file to read from.
+    :param default_port: The port to use if a line does not give one.
+    :type default_port: int
+    :param default_ssl: Whether to use SSL if a line does not say.
+    :type default_ssl: bool
+    :param errors: If given, invalid lines are passed to this function along
+                   with their :exc:`ValueError` and skipped. Otherwise, the
+                   :exc:`ValueError` is raised.
+    :returns: Generator of :class:`Target` objects.
+
+    """
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield parse_target(line, default_port, default_ssl)
+        except ValueError as exc:
+            if errors is None:
+                raise
+            errors(line, exc)
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,141 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2013 Ian Good
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Module containing the SSL configuration that may be shared by many health
+checks, including a cache of SSL sessions for resumption.
+
+"""
+
+from __future__ import absolute_import
+
+import ssl
+import threading
+from collections import OrderedDict
+
+_default_context = None
+_default_context_lock = threading.Lock()
+
+
+def create_context(verify=False, cafile=None):
+    """Creates an :class:`ssl.SSLContext` suitable for health checks. The
+    context may be shared by any number of checks, which avoids loading
+    certificates and configuring a new context for every check.
+
+    :param verify: If ``True``, the server certificate and hostname are
+                   verified. Otherwise, as with a plain
+                   :func:`ssl.wrap_socket`, they are not.
+    :type verify: bool
+    :param cafile: With ``verify``, a file of CA certificates to trust instead
+                   of the system defaults.
+    :type cafile: str
+    :rtype: :class:`ssl.SSLContext`
+
+    """
+    if verify:
+        return ssl.create_default_context(cafile=cafile)
+    protocol = getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23)
+    context = ssl.SSLContext(protocol)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def get_default_context():
+    """Returns a context created by :func:`create_context` with the default
+    arguments. It is created on first use and then shared.
+
+    :rtype: :class:`ssl.SSLContext`
+
+    """
+    global _default_context
+    with _default_context_lock:
+        if _default_context is None:
+            _default_context = create_context()
+        return _default_context
+
+
+class SslSessionCache(object):
+    """Remembers the most recent SSL session negotiated with each server, so
+    that the next check of that server can resume it with an abbreviated
+    handshake. The cache is thread-safe and may be passed to any number of
+    :class:`~smtphealth.SmtpHealthCheck` objects.
+
+    Session resumption requires Python 3.6 or later; on older versions, the
+    cache is never populated.
+
+    :param max_size: The maximum number of sessions to keep. Once full, the
+                     least recently used session is evicted.
+    :type max_size: int
+
+    """
+
+    #: Whether this version of Python supports resuming SSL sessions.
+    supported = hasattr(ssl.SSLSocket, 'session')
+
+    def __init__(self, max_size=1024):
+        super(SslSessionCache, self).__init__()
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        """Returns the session to resume for a server.
+
+        :param key: Identifies the server, e.g. its address and port.
+        :returns: The :class:`ssl.SSLSession`, or ``None``.
+
+        """
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self._sessions[key] = session
+            return session
+
+    def set(self, key, session):
+        """Remembers the session negotiated with a server.
+
+        :param key: Identifies the server, e.g. its address and port.
+        :param session: The :class:`ssl.SSLSession` to remember.
+
+        """
+        if session is None or self.max_size < 1:
+            return
+        with self._lock:
+            self._sessions.pop(key, None)
+            while len(self._sessions) >= self.max_size:
+                self._sessions.popitem(last=False)
+            self._sessions[key] = session
+
+    def discard(self, key):
+        """Forgets the session for a server, e.g. because it was rejected.
+
+        :param key: Identifies the server, e.g. its address and port.
+
+        """
+        with self._lock:
+            self._sessions.pop(key, None)
+
+
+# vim:et:sts=4:sw=4:ts=4
@@ -0,0 +1,38 @@
+
+import time
+
+
+class FakeCheck(object):
+    """Stands in for :class:`smtphealth.SmtpHealthCheck`. Checks of hosts
+    and addresses starting with ``bad`` fail, all others pass.
+
+    """
+
+    created = 0
+    runs = 0
+    delay = 0.0
+
+    def __init__(self, **kwargs):
+        FakeCheck.created += 1
+        self.kwargs = kwargs
+        self.host = None
+        self.results = {'Status': 'CRITICAL'}
+
+    def run(self, host, port=25, with_ssl=False):
+        FakeCheck.runs += 1
+        if self.delay:
+            time.sleep(self.delay)
+        self.host = host
+        if not host.startswith('bad'):
+            self.results['Status'] = 'OK'
+
+    def run_address(self, address, with_ssl=False, host=None):
+        self.results['Address'] = address[4][0]
+        if not address[4][0].startswith('bad'):
+            self.results['Status'] = 'OK'
+
+    def write(self, writer, target=None):
+        return writer.write(self.results, target)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
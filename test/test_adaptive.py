@@ -0,0 +1,103 @@
+
+from mox import MoxTestBase
+
+from smtphealth import SmtpHealthCheck
+from smtphealth.adaptive import AdaptiveTimeouts
+
+
+class TestAdaptiveTimeouts(MoxTestBase):
+
+    def setUp(self):
+        super(TestAdaptiveTimeouts, self).setUp()
+        self.timeouts = AdaptiveTimeouts(floor=0.1, min_samples=3)
+
+    def test_get_default(self):
+        self.assertEqual(10.0, self.timeouts.get('test', 'connect', 10.0))
+        self.assertEqual(None, self.timeouts.get('test', 'connect'))
+        timeouts = AdaptiveTimeouts(ceiling=5.0)
+        self.assertEqual(5.0, timeouts.get('test', 'connect', 10.0))
+        self.assertEqual(3.0, timeouts.get('test', 'connect', 3.0))
+
+    def test_sample(self):
+        for i in range(2):
+            self.timeouts.sample('test', 'connect', 0.04)
+        self.assertEqual(10.0, self.timeouts.get('test', 'connect', 10.0))
+        self.timeouts.sample('test', 'connect', 0.04)
+        timeout = self.timeouts.get('test', 'connect', 10.0)
+        self.assertTrue(0.1 <= timeout < 0.2)
+        self.assertEqual(10.0, self.timeouts.get('other', 'connect', 10.0))
+
+    def test_sample_floor_and_ceiling(self):
+        for i in range(3):
+            self.timeouts.sample('fast', 'banner', 0.001)
+            self.timeouts.sample('slow', 'banner', 30.0)
+        self.assertEqual(0.1, self.timeouts.get('fast', 'banner', 10.0))
+        self.assertEqual(10.0, self.timeouts.get('slow', 'banner', 10.0))
+
+    def test_sample_variance(self):
+        for elapsed in (0.1, 0.1, 0.1):
+            self.timeouts.sample('steady', 'banner', elapsed)
+        for elapsed in (0.1, 1.0, 0.1):
+            self.timeouts.sample('jittery', 'banner', elapsed)
+        self.assertTrue(self.timeouts.get('jittery', 'banner', 10.0) >
+                        self.timeouts.get('steady', 'banner', 10.0))
+
+    def test_timed_out(self):
+        for i in range(3):
+            self.timeouts.sample('test', 'banner', 0.1)
+        before = self.timeouts.get('test', 'banner', 10.0)
+        self.timeouts.timed_out('test', 'banner')
+        self.assertAlmostEqual(before * 2,
+                               self.timeouts.get('test', 'banner', 10.0))
+        self.timeouts.sample('test', 'banner', 0.1)
+        self.assertTrue(self.timeouts.get('test', 'banner', 10.0) < before)
+
+    def test_update(self):
+        results = {'Status': 'CRITICAL', 'Exception-Type': 'Timeout',
+                   'Dns-Elapsed': 0.01, 'Dns-Cached': True,
+                   'Connect-Elapsed': 0.02}
+        self.mox.StubOutWithMock(self.timeouts, 'sample')
+        self.mox.StubOutWithMock(self.timeouts, 'timed_out')
+        self.timeouts.sample('test', 'connect', 0.02)
+        self.timeouts.timed_out('test', 'banner')
+        self.timeouts.sample('test', 'connect', 0.02)
+        self.timeouts.timed_out('test', 'ssl')
+        self.mox.ReplayAll()
+        self.timeouts.update('test', results)
+        self.timeouts.update('test', results, True)
+
+    def test_update_without_dns(self):
+        results = {'Status': 'OK', 'Connect-Elapsed': 0.02,
+                   'Banner-Elapsed': 0.03}
+        self.mox.StubOutWithMock(self.timeouts, 'sample')
+        self.timeouts.sample('test', 'connect', 0.02)
+        self.timeouts.sample('test', 'banner', 0.03)
+        self.mox.ReplayAll()
+        self.timeouts.update('test', results, with_dns=False)
+
+    def test_check_run(self):
+        for i in range(3):
+            self.timeouts.sample(('test', 25), 'banner', 0.01)
+        check = SmtpHealthCheck(banner_timeout=10.0, connect_timeout=5.0,
+                                adaptive_timeouts=self.timeouts)
+        self.mox.StubOutWithMock(check, '_run')
+        check._run(False, 'test', 25)
+        self.mox.ReplayAll()
+        check.run('test', 25)
+        self.assertEqual(0.1, check.banner_timeout)
+        self.assertEqual(5.0, check.connect_timeout)
+
+    def test_check_run_address(self):
+        for i in range(3):
+            self.timeouts.sample(('127.0.0.1', 25), 'banner', 0.01)
+        check = SmtpHealthCheck(banner_timeout=10.0,
+                                adaptive_timeouts=self.timeouts)
+        address = (2, 1, 6, '', ('127.0.0.1', 25))
+        self.mox.StubOutWithMock(check, '_run')
+        check._run(False, 'test', gai=[address])
+        self.mox.ReplayAll()
+        check.run_address(address, host='test')
+        self.assertEqual(0.1, check.banner_timeout)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,77 @@
+
+from cStringIO import StringIO
+
+from mox import MoxTestBase
+
+from smtphealth.addresses import AllAddressesCheck
+
+from fakes import FakeCheck
+
+
+class TestAllAddressesCheck(MoxTestBase):
+
+    def setUp(self):
+        super(TestAllAddressesCheck, self).setUp()
+        self.check = AllAddressesCheck(connect_timeout=5)
+        self.check.check_class = FakeCheck
+        self.mox.StubOutWithMock(self.check, '_lookup')
+
+    def test_run(self):
+        self.check._lookup('test', 13).AndReturn([(2, 1, 6, '', ('one', 13)),
+                                                  (2, 1, 6, '', ('two', 13))])
+        self.mox.ReplayAll()
+        self.check.run('test', 13)
+        self.assertEqual('OK', self.check.results['Status'])
+        self.assertEqual(2, self.check.results['Addresses'])
+        self.assertEqual(2, self.check.results['Addresses-Ok'])
+        self.assertEqual(['one', 'two'], [check.results['Address']
+                                          for check in self.check.checks])
+
+    def test_run_failure(self):
+        self.check._lookup('test', 13).AndReturn([(2, 1, 6, '', ('one', 13)),
+                                                  (2, 1, 6, '', ('bad', 13))])
+        self.mox.ReplayAll()
+        self.check.run('test', 13)
+        self.assertEqual('CRITICAL', self.check.results['Status'])
+        self.assertEqual(1, self.check.results['Addresses-Ok'])
+        f = StringIO()
+        self.assertEqual(1, self.check.output(f))
+        self.assertEqual("""\
+Status: CRITICAL
+Addresses: 2
+Addresses-Ok: 1
+Failure: ADDRESSES_FAILED
+
+Status: OK
+Address: one
+
+Status: CRITICAL
+Address: bad
+""", f.getvalue())
+
+    def test_run_no_addresses(self):
+        self.check._lookup('test', 13).AndReturn([])
+        self.mox.ReplayAll()
+        self.check.run('test', 13)
+        self.assertEqual('CRITICAL', self.check.results['Status'])
+        self.assertEqual('DNSError', self.check.results['Exception-Type'])
+
+    def test_run_adaptive(self):
+        adaptive = self.mox.CreateMockAnything()
+        self.check.adaptive_timeouts = adaptive
+        adaptive.apply(('test', 13), self.check)
+        self.check._lookup('test', 13).AndReturn([(2, 1, 6, '', ('one', 13))])
+        adaptive.update(('test', 13), self.check.results, False)
+        self.mox.ReplayAll()
+        self.check.run('test', 13)
+        self.assertEqual('OK', self.check.results['Status'])
+
+    def test_run_dns_failure(self):
+        self.check._lookup('test', 13).AndRaise(Exception('test test'))
+        self.mox.ReplayAll()
+        self.check.run('test', 13)
+        self.assertEqual('test test', self.check.results['Exception-Value'])
+        self.assertEqual([], self.check.checks)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,102 @@
+
+from mox import MoxTestBase
+
+from smtphealth.engine import CheckEngine
+from smtphealth.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+from fakes import FakeCheck
+
+
+class RejectedCheck(FakeCheck):
+
+    def run(self, host, port=25, with_ssl=False):
+        super(RejectedCheck, self).run(host, port, with_ssl)
+        self.results['Banner-Code'] = '421'
+
+
+class TestCircuitBreaker(MoxTestBase):
+
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        self.breaker = CircuitBreaker(failures=2, delay=10.0,
+                                      max_delay=30.0, jitter=0.0)
+        self.failed = {'Status': 'CRITICAL', 'Banner-Code': '421'}
+
+    def test_bad_failures(self):
+        with self.assertRaises(ValueError):
+            CircuitBreaker(0)
+
+    def test_open(self):
+        self.assertTrue(self.breaker.allow('test', 0.0))
+        self.breaker.record('test', self.failed, 0.0)
+        self.assertEqual(CLOSED, self.breaker.state('test'))
+        self.assertTrue(self.breaker.allow('test', 1.0))
+        self.breaker.record('test', self.failed, 1.0)
+        self.assertEqual(OPEN, self.breaker.state('test'))
+        self.assertFalse(self.breaker.allow('test', 5.0))
+        skipped = self.breaker.skipped('test', 5.0)
+        self.assertEqual('CRITICAL', skipped['Status'])
+        self.assertEqual('421', skipped['Banner-Code'])
+        self.assertEqual(OPEN, skipped['Circuit'])
+        self.assertEqual(6.0, skipped['Circuit-Retry'])
+        self.assertFalse('Circuit' in self.failed)
+
+    def test_backoff(self):
+        self.breaker.record('test', self.failed, 0.0)
+        self.breaker.record('test', self.failed, 0.0)
+        self.assertTrue(self.breaker.allow('test', 10.0))
+        self.assertEqual(HALF_OPEN, self.breaker.state('test'))
+        self.assertFalse(self.breaker.allow('test', 10.0))
+        self.breaker.record('test', self.failed, 10.0)
+        self.assertEqual(OPEN, self.breaker.state('test'))
+        self.assertFalse(self.breaker.allow('test', 29.0))
+        self.assertTrue(self.breaker.allow('test', 30.0))
+        self.breaker.record('test', self.failed, 30.0)
+        self.assertFalse(self.breaker.allow('test', 59.0))
+        self.assertTrue(self.breaker.allow('test', 60.0))
+
+    def test_close(self):
+        self.breaker.record('test', self.failed, 0.0)
+        self.breaker.record('test', self.failed, 0.0)
+        self.assertTrue(self.breaker.allow('test', 10.0))
+        self.breaker.record('test', {'Status': 'OK'}, 10.0)
+        self.assertEqual(CLOSED, self.breaker.state('test'))
+        self.assertEqual(0, len(self.breaker))
+        self.breaker.record('test', self.failed, 11.0)
+        self.assertTrue(self.breaker.allow('test', 11.0))
+
+    def test_skip(self):
+        self.breaker.record('test', self.failed, 0.0)
+        self.assertEqual(None, self.breaker.skip('test', 1.0))
+        self.breaker.record('test', self.failed, 1.0)
+        skipped = self.breaker.skip('test', 5.0)
+        self.assertEqual(OPEN, skipped['Circuit'])
+        self.assertEqual(6.0, skipped['Circuit-Retry'])
+        self.assertEqual(None, self.breaker.skip('test', 11.0))
+        skipped = self.breaker.skip('test', 12.0)
+        self.assertEqual(HALF_OPEN, skipped['Circuit'])
+        self.breaker.record('test', {'Status': 'OK'}, 12.0)
+        self.assertEqual(None, self.breaker.skip('test', 12.0))
+
+    def test_jitter(self):
+        breaker = CircuitBreaker(failures=1, delay=10.0, jitter=0.5)
+        breaker.record('test', self.failed, 0.0)
+        retry = breaker.skipped('test', 0.0)['Circuit-Retry']
+        self.assertTrue(5.0 <= retry <= 10.0)
+
+    def test_engine(self):
+        FakeCheck.runs = 0
+        engine = CheckEngine(2, CircuitBreaker(failures=1, delay=60.0))
+        engine.check_class = RejectedCheck
+        targets = [('good', 25, False), ('bad', 25, False)]
+        engine.run_all(targets)
+        self.assertEqual(2, FakeCheck.runs)
+        good, bad = engine.run_all(targets)
+        self.assertEqual(3, FakeCheck.runs)
+        self.assertEqual('OK', good.results['Status'])
+        self.assertFalse('Circuit' in good.results)
+        self.assertEqual(OPEN, bad.results['Circuit'])
+        self.assertEqual('421', bad.results['Banner-Code'])
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,107 @@
+
+import socket
+
+from mox import MoxTestBase
+
+import smtphealth.dnscache
+from smtphealth import SmtpHealthCheck
+from smtphealth.dnscache import DnsCache
+
+
+class TestDnsCache(MoxTestBase):
+
+    def setUp(self):
+        super(TestDnsCache, self).setUp()
+        self.now = 100.0
+        self.stubs.Set(smtphealth.dnscache, 'monotonic', lambda: self.now)
+
+    def test_miss(self):
+        cache = DnsCache()
+        with self.assertRaises(KeyError):
+            cache.get('test')
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_hit(self):
+        cache = DnsCache()
+        cache.set('test', 'beep')
+        self.assertEqual('beep', cache.get('test'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def test_expired(self):
+        cache = DnsCache(ttl=10.0)
+        cache.set('test', 'beep')
+        self.now += 10.0
+        with self.assertRaises(KeyError):
+            cache.get('test')
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(0, len(cache))
+
+    def test_negative(self):
+        cache = DnsCache(negative_ttl=5.0)
+        cache.set_error('test', socket.gaierror(-2, 'test error'))
+        with self.assertRaises(socket.gaierror) as cm:
+            cache.get('test')
+        self.assertEqual((-2, 'test error'), cm.exception.args)
+        self.now += 5.0
+        with self.assertRaises(KeyError):
+            cache.get('test')
+
+    def test_negative_disabled(self):
+        cache = DnsCache(negative_ttl=0.0)
+        cache.set_error('test', socket.gaierror(-2, 'test error'))
+        self.assertEqual(0, len(cache))
+
+    def test_lru(self):
+        cache = DnsCache(max_size=2)
+        cache.set('one', 1)
+        cache.set('two', 2)
+        cache.get('one')
+        cache.set('three', 3)
+        self.assertEqual(1, cache.get('one'))
+        self.assertEqual(3, cache.get('three'))
+        with self.assertRaises(KeyError):
+            cache.get('two')
+
+    def test_clear(self):
+        cache = DnsCache()
+        cache.set('test', 'beep')
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+
+class TestCachedLookup(MoxTestBase):
+
+    def setUp(self):
+        super(TestCachedLookup, self).setUp()
+        self.cache = DnsCache()
+        self.mox.StubOutWithMock(socket, 'getaddrinfo')
+
+    def test_lookup(self):
+        socket.getaddrinfo('test', 13, socket.AF_INET, socket.SOCK_STREAM) \
+            .AndReturn('beep')
+        self.mox.ReplayAll()
+        check = SmtpHealthCheck(dns_cache=self.cache)
+        self.assertEqual('beep', check._lookup('test', 13))
+        self.assertFalse(check.results['Dns-Cached'])
+        check = SmtpHealthCheck(dns_cache=self.cache)
+        self.assertEqual('beep', check._lookup('test', 13))
+        self.assertTrue(check.results['Dns-Cached'])
+        self.assertIn('Dns-Elapsed', check.results)
+
+    def test_lookup_error(self):
+        socket.getaddrinfo('test', 13, socket.AF_INET, socket.SOCK_STREAM) \
+            .AndRaise(socket.gaierror(-2, 'test error'))
+        self.mox.ReplayAll()
+        check = SmtpHealthCheck(dns_cache=self.cache)
+        with self.assertRaises(socket.gaierror):
+            check._lookup('test', 13)
+        self.assertFalse(check.results['Dns-Cached'])
+        check = SmtpHealthCheck(dns_cache=self.cache)
+        with self.assertRaises(socket.gaierror):
+            check._lookup('test', 13)
+        self.assertTrue(check.results['Dns-Cached'])
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,63 @@
+
+import time
+
+from mox import MoxTestBase
+
+from smtphealth.engine import CheckEngine
+
+from fakes import FakeCheck
+
+
+class SlowCheck(FakeCheck):
+
+    def run(self, host, port=25, with_ssl=False):
+        time.sleep(port / 100.0)
+        super(SlowCheck, self).run(host, port, with_ssl)
+
+
+class TestCheckEngine(MoxTestBase):
+
+    def setUp(self):
+        super(TestCheckEngine, self).setUp()
+        self.engine = CheckEngine(3, connect_timeout=5)
+        self.engine.check_class = SlowCheck
+
+    def test_bad_concurrency(self):
+        with self.assertRaises(ValueError):
+            CheckEngine(0)
+
+    def test_run(self):
+        targets = [('slow', 20, False), ('fast', 0, False),
+                   ('medium', 10, True)]
+        hosts = [target[0] for target, check in self.engine.run(targets)]
+        self.assertEqual(['fast', 'medium', 'slow'], hosts)
+
+    def test_run_generator(self):
+        targets = (('test{0}'.format(i), 0, False) for i in range(20))
+        checks = [check for target, check in self.engine.run(targets)]
+        self.assertEqual(20, len(checks))
+        for check in checks:
+            self.assertEqual('OK', check.results['Status'])
+            self.assertEqual({'connect_timeout': 5}, check.kwargs)
+
+    def test_run_slow_consumer(self):
+        FakeCheck.created = 0
+        targets = (('test', 0, False) for i in range(100))
+        results = self.engine.run(targets)
+        next(results)
+        time.sleep(0.2)
+        self.assertTrue(FakeCheck.created <= 8)
+        self.assertEqual(99, len(list(results)))
+
+    def test_run_all(self):
+        targets = [('slow', 20, False), ('fast', 0, False),
+                   ('fast', 0, False), ('medium', 10, True)]
+        checks = self.engine.run_all(targets)
+        hosts = [check.host for check in checks]
+        self.assertEqual(['slow', 'fast', 'fast', 'medium'], hosts)
+
+    def test_run_empty(self):
+        self.assertEqual([], self.engine.run_all([]))
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,106 @@
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+from mox import MoxTestBase
+
+from smtphealth.exporter import MetricsExporter, CONTENT_TYPE
+
+
+class TestMetricsExporter(MoxTestBase):
+
+    def setUp(self):
+        super(TestMetricsExporter, self).setUp()
+        self.exporter = MetricsExporter(buckets=(0.1, 1.0))
+
+    def test_render_empty(self):
+        metrics = self.exporter.render().decode('utf-8')
+        self.assertTrue(metrics.endswith('# EOF\n'))
+        self.assertIn('# TYPE smtp_health_up gauge\n', metrics)
+
+    def test_render(self):
+        self.exporter.update('one:25', {'Status': 'OK',
+                                        'Banner-Code': '220',
+                                        'Dns-Elapsed': 0.05,
+                                        'Connect-Elapsed': 0.5})
+        self.exporter.update('one:25', {'Status': 'CRITICAL',
+                                        'Dns-Elapsed': 2.0,
+                                        'Exception-Type': 'Timeout'})
+        lines = self.exporter.render().decode('utf-8').splitlines()
+        self.assertIn('smtp_health_up{banner_code="",target="one:25"} 0',
+                      lines)
+        self.assertIn('smtp_health_checks_total{target="one:25"} 2', lines)
+        self.assertIn('smtp_health_exceptions_total'
+                      '{target="one:25",type="Timeout"} 1', lines)
+        self.assertIn('smtp_health_stage_seconds_bucket'
+                      '{le="0.1",stage="dns",target="one:25"} 1', lines)
+        self.assertIn('smtp_health_stage_seconds_bucket'
+                      '{le="1.0",stage="dns",target="one:25"} 1', lines)
+        self.assertIn('smtp_health_stage_seconds_bucket'
+                      '{le="+Inf",stage="dns",target="one:25"} 2', lines)
+        self.assertIn('smtp_health_stage_seconds_count'
+                      '{stage="dns",target="one:25"} 2', lines)
+        self.assertIn('smtp_health_stage_seconds_sum'
+                      '{stage="dns",target="one:25"} 2.05', lines)
+        self.assertFalse([line for line in lines if 'stage="ssl"' in line])
+
+    def test_render_escaping(self):
+        self.exporter.update('a"b\\c', {'Status': 'OK'})
+        metrics = self.exporter.render().decode('utf-8')
+        self.assertIn(r'target="a\"b\\c"', metrics)
+
+    def test_render_snapshot(self):
+        self.exporter.update('one:25', {'Status': 'OK'})
+        first = self.exporter.render()
+        self.assertIs(first, self.exporter.render())
+        self.exporter.update('one:25', {'Status': 'OK'})
+        self.assertIsNot(first, self.exporter.render())
+
+    def test_render_cached(self):
+        self.exporter.update('one:25', {'Status': 'OK'})
+        self.exporter.update('two:25', {'Status': 'OK'})
+        self.exporter.render()
+        one = self.exporter._targets['one:25'].rendered
+        two = self.exporter._targets['two:25'].rendered
+        self.exporter.update('two:25', {'Status': 'CRITICAL'})
+        metrics = self.exporter.render().decode('utf-8')
+        self.assertIs(one, self.exporter._targets['one:25'].rendered)
+        self.assertIsNot(two, self.exporter._targets['two:25'].rendered)
+        self.assertIn('smtp_health_up{banner_code="",target="two:25"} 0',
+                      metrics)
+
+    def test_render_aggregate(self):
+        exporter = MetricsExporter(buckets=(0.1, 1.0),
+                                   target_histograms=False)
+        exporter.update('one:25', {'Status': 'OK', 'Dns-Elapsed': 0.05})
+        exporter.update('two:25', {'Status': 'OK', 'Dns-Elapsed': 0.5})
+        lines = exporter.render().decode('utf-8').splitlines()
+        self.assertIn('smtp_health_stage_seconds_bucket'
+                      '{le="0.1",stage="dns"} 1', lines)
+        self.assertIn('smtp_health_stage_seconds_count{stage="dns"} 2',
+                      lines)
+        self.assertIn('smtp_health_checks_total{target="two:25"} 1', lines)
+        self.assertEqual('# EOF', lines[-1])
+
+    def test_remove(self):
+        self.exporter.update('one:25', {'Status': 'OK'})
+        self.exporter.remove('one:25')
+        self.assertNotIn(b'one:25', self.exporter.render())
+
+    def test_serve(self):
+        self.exporter.update('one:25', {'Status': 'OK'})
+        server = self.exporter.serve('127.0.0.1', 0)
+        try:
+            port = server.server_address[1]
+            response = urlopen('http://127.0.0.1:{0}/metrics'.format(port))
+            self.assertEqual(CONTENT_TYPE,
+                             response.info().get('Content-Type'))
+            self.assertEqual(self.exporter.render(), response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
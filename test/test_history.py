@@ -0,0 +1,110 @@
+
+import os
+import shutil
+import tempfile
+
+from mox import MoxTestBase
+
+from smtphealth.targets import Target
+from smtphealth.history import ResultHistory
+
+
+class TestResultHistory(MoxTestBase):
+
+    def setUp(self):
+        super(TestResultHistory, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'history')
+        self.target = Target('test', 25, False)
+
+    def tearDown(self):
+        super(TestResultHistory, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def _results(self, status, code=None):
+        return {'Status': status, 'Banner-Code': code, 'Dns-Elapsed': 0.5,
+                'Dns-Cached': True, 'Connect-Elapsed': 0.25}
+
+    def test_bad_size(self):
+        with self.assertRaises(ValueError):
+            ResultHistory(size=0)
+
+    def test_append(self):
+        history = ResultHistory(size=4)
+        history.append(self.target, self._results('OK', '220'), 100.0)
+        self.assertEqual(1, len(history))
+        self.assertTrue(self.target in history)
+        self.assertEqual(['test:25'], history.targets())
+        record = history.last(self.target)
+        self.assertEqual(100.0, record.timestamp)
+        self.assertEqual('OK', record.status)
+        self.assertTrue(record.healthy)
+        self.assertEqual('220', record.banner_code)
+        self.assertTrue(record.dns_cached)
+        self.assertFalse(record.ssl_resumed)
+        self.assertEqual(0.5, record.dns_elapsed)
+        self.assertEqual(0.25, record.connect_elapsed)
+        self.assertEqual(None, record.ssl_elapsed)
+        self.assertEqual(None, record.banner_elapsed)
+        self.assertEqual(None, record.failure)
+
+    def test_append_failure(self):
+        history = ResultHistory(size=4)
+        results = self._results('CRITICAL', '421')
+        results['Failure'] = 'BANNER_4XX'
+        history.append(self.target, results, 100.0)
+        results['Failure'] = 'SOMETHING_NEW'
+        history.append(self.target, results, 101.0)
+        self.assertEqual(['BANNER_4XX', None],
+                         [record.failure for record
+                          in history.recent(self.target)])
+
+    def test_recent(self):
+        history = ResultHistory(size=3)
+        self.assertEqual([], history.recent(self.target))
+        self.assertEqual(None, history.last(self.target))
+        for i in range(5):
+            history.append(self.target, self._results('OK'), float(i))
+        self.assertEqual([2.0, 3.0, 4.0], [record.timestamp for record
+                                           in history.recent(self.target)])
+        self.assertEqual([3.0, 4.0], [record.timestamp for record
+                                      in history.recent(self.target, 2)])
+        self.assertEqual(4.0, history.last(self.target).timestamp)
+
+    def test_transitions(self):
+        history = ResultHistory(size=8)
+        for status in ('OK', 'CRITICAL', 'CRITICAL', 'OK', 'OK'):
+            history.append(self.target, self._results(status))
+        self.assertEqual(2, history.transitions(self.target))
+        self.assertEqual(0, history.transitions(self.target, 2))
+
+    def test_full(self):
+        history = ResultHistory(size=2, max_targets=1)
+        history.append('one', self._results('OK'))
+        with self.assertRaises(ValueError):
+            history.append('two', self._results('OK'))
+        with self.assertRaises(ValueError):
+            ResultHistory(size=2).append('x' * 300, self._results('OK'))
+
+    def test_persistence(self):
+        history = ResultHistory(self.filename, size=4, max_targets=8)
+        history.append(self.target, self._results('OK', '220'), 1.0)
+        history.append('other', self._results('CRITICAL', '421'), 2.0)
+        history.close()
+        history = ResultHistory(self.filename, size=4, max_targets=8)
+        self.assertEqual(2, len(history))
+        self.assertEqual('220', history.last(self.target).banner_code)
+        history.append('other', self._results('OK'), 3.0)
+        self.assertEqual([2.0, 3.0], [record.timestamp for record
+                                      in history.recent('other')])
+        history.close()
+
+    def test_persistence_mismatch(self):
+        ResultHistory(self.filename, size=4, max_targets=8).close()
+        with self.assertRaises(ValueError):
+            ResultHistory(self.filename, size=8, max_targets=8)
+        with self.assertRaises(ValueError):
+            ResultHistory(self.filename, size=4, max_targets=4)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
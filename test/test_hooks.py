@@ -0,0 +1,111 @@
+
+import socket
+import threading
+
+from mox import MoxTestBase
+
+from smtphealth import SmtpHealthCheck, monotonic_ns
+from smtphealth.hooks import StageHooks, StageEvent, STAGES
+
+
+class TestStageHooks(MoxTestBase):
+
+    def setUp(self):
+        super(TestStageHooks, self).setUp()
+        self.hooks = StageHooks()
+        self.started = []
+        self.ended = []
+        self.hooks.on_start(lambda check, stage, start:
+                            self.started.append((stage, start)))
+        self.hooks.on_end(lambda check, event: self.ended.append(event))
+
+    def test_bad_stage(self):
+        with self.assertRaises(ValueError):
+            self.hooks.on_start(lambda check, stage, start: None, ['bad'])
+
+    def test_monotonic_ns(self):
+        first = monotonic_ns()
+        self.assertTrue(monotonic_ns() >= first)
+
+    def test_run(self):
+        check = SmtpHealthCheck(hooks=self.hooks)
+        self.mox.StubOutWithMock(check, '_lookup')
+        self.mox.StubOutWithMock(check, '_connect')
+        self.mox.StubOutWithMock(check, '_wrap_ssl')
+        self.mox.StubOutWithMock(check, '_get_banner')
+        self.mox.StubOutWithMock(check, '_check_banner')
+        check._lookup('test', 25).AndReturn(['gai'])
+        check._connect(['gai'])
+        check._wrap_ssl('test')
+        check._get_banner().AndReturn('220 test\r\n')
+        check._check_banner('220 test\r\n')
+        self.mox.ReplayAll()
+        check.run('test', 25, True)
+        self.assertEqual(list(STAGES), [stage for stage, start
+                                        in self.started])
+        self.assertEqual(list(STAGES), [event.stage for event in self.ended])
+        for event in self.ended:
+            self.assertTrue(event.elapsed >= 0)
+            self.assertEqual(None, event.exception)
+            self.assertEqual(0, event.bytes_received)
+
+    def test_run_failure(self):
+        check = SmtpHealthCheck(hooks=self.hooks)
+        self.mox.StubOutWithMock(check, '_lookup')
+        self.mox.StubOutWithMock(check, '_connect')
+        check._lookup('test', 25).AndReturn(['gai'])
+        exc = socket.error('test')
+        check._connect(['gai']).AndRaise(exc)
+        self.mox.ReplayAll()
+        check.run('test', 25)
+        self.assertEqual(['dns', 'connect'],
+                         [event.stage for event in self.ended])
+        self.assertEqual(exc, self.ended[1].exception)
+        self.assertEqual('error', check.results['Exception-Type'])
+
+    def test_run_stages(self):
+        hooks = StageHooks()
+        ended = []
+        hooks.on_end(lambda check, event: ended.append(event), ['banner'])
+        check = SmtpHealthCheck(hooks=hooks)
+        self.mox.StubOutWithMock(check, '_connect')
+        self.mox.StubOutWithMock(check, '_get_banner')
+        self.mox.StubOutWithMock(check, '_check_banner')
+        check._connect(['gai'])
+        check._get_banner().AndReturn('220 test\r\n')
+        check._check_banner('220 test\r\n')
+        self.mox.ReplayAll()
+        check.run_address('gai')
+        self.assertEqual(['banner'], [event.stage for event in ended])
+
+    def test_run_bytes(self):
+        banner = b'220 test ESMTP\r\n'
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+
+        def serve():
+            sock, addr = listener.accept()
+            sock.sendall(banner)
+            sock.recv(1)
+            sock.close()
+        thread = threading.Thread(target=serve)
+        thread.start()
+        check = SmtpHealthCheck(banner_timeout=5, connect_timeout=5,
+                                hooks=self.hooks)
+        check.run('127.0.0.1', listener.getsockname()[1])
+        thread.join()
+        listener.close()
+        self.assertEqual('OK', check.results['Status'])
+        received = [event.bytes_received for event in self.ended]
+        sent = [event.bytes_sent for event in self.ended]
+        if None not in received:
+            self.assertEqual(len(banner), sum(received))
+            self.assertEqual(0, sum(sent))
+
+    def test_event_elapsed(self):
+        event = StageEvent('dns', 100, 350, 0, 0, None)
+        self.assertEqual(250, event.elapsed)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,153 @@
+
+import time
+import threading
+
+from mox import MoxTestBase, Func
+
+from smtphealth.limits import TokenBucket, ConnectionLimiter, \
+    destination_domain
+
+
+class TestDestinationDomain(MoxTestBase):
+
+    def test_hostname(self):
+        self.assertEqual('google.com',
+                         destination_domain('alt1.aspmx.l.google.com'))
+        self.assertEqual('google.com', destination_domain('Google.COM.'))
+        self.assertEqual('localhost', destination_domain('localhost'))
+
+    def test_second_level(self):
+        self.assertEqual('example.co.uk',
+                         destination_domain('mx.example.co.uk'))
+        self.assertEqual('example.com.au',
+                         destination_domain('mx1.mail.example.com.au'))
+        self.assertEqual('co.uk', destination_domain('co.uk'))
+        self.assertEqual('example.com',
+                         destination_domain('mx.co.example.com'))
+
+    def test_labels(self):
+        self.assertEqual('example.co.uk',
+                         destination_domain('mx.example.co.uk', 3))
+        self.assertEqual('co.uk', destination_domain('mx.example.co.uk', 2))
+
+    def test_address(self):
+        self.assertEqual('1.2.3.4', destination_domain('1.2.3.4'))
+        self.assertEqual('2001:db8::1', destination_domain('2001:db8::1'))
+
+
+class TestTokenBucket(MoxTestBase):
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+        with self.assertRaises(ValueError):
+            TokenBucket(1.0, 0.5)
+
+    def test_burst(self):
+        bucket = TokenBucket(2.0, 3)
+        self.assertEqual(0.0, bucket.reserve(10.0))
+        self.assertEqual(0.0, bucket.reserve(10.0))
+        self.assertEqual(0.0, bucket.reserve(10.0))
+        self.assertAlmostEqual(0.5, bucket.reserve(10.0))
+        self.assertAlmostEqual(1.0, bucket.reserve(10.0))
+
+    def test_refill(self):
+        bucket = TokenBucket(2.0)
+        self.assertEqual(2.0, bucket.burst)
+        bucket.reserve(10.0)
+        bucket.reserve(10.0)
+        self.assertFalse(bucket.idle(10.5))
+        self.assertEqual(0.0, bucket.reserve(10.5))
+        self.assertAlmostEqual(0.5, bucket.reserve(10.5))
+        self.assertTrue(bucket.idle(20.0))
+        self.assertEqual(2.0, bucket.tokens)
+
+    def test_slow_rate(self):
+        bucket = TokenBucket(0.25)
+        self.assertEqual(1.0, bucket.burst)
+        self.assertEqual(0.0, bucket.reserve(10.0))
+        self.assertAlmostEqual(4.0, bucket.reserve(10.0))
+
+
+class TestConnectionLimiter(MoxTestBase):
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            ConnectionLimiter(rate=0)
+        with self.assertRaises(ValueError):
+            ConnectionLimiter(destination_rate=-1.0)
+        with self.assertRaises(ValueError):
+            ConnectionLimiter(per_address=0)
+
+    def test_unlimited(self):
+        limiter = ConnectionLimiter()
+        self.assertLess(limiter.acquire('1.2.3.4', 'test'), 0.1)
+        limiter.release('1.2.3.4', 'test')
+
+    def test_rate(self):
+        limiter = ConnectionLimiter(rate=5.0, burst=1)
+        self.mox.StubOutWithMock(time, 'sleep')
+        time.sleep(Func(lambda delay: 0.1 < delay <= 0.2))
+        self.mox.ReplayAll()
+        limiter.acquire('1.2.3.4')
+        limiter.acquire('5.6.7.8')
+
+    def test_destination_rate(self):
+        limiter = ConnectionLimiter(destination_rate=1.0)
+        self.mox.StubOutWithMock(time, 'sleep')
+        time.sleep(Func(lambda delay: 0.9 < delay <= 1.0))
+        self.mox.ReplayAll()
+        limiter.acquire('1.2.3.4')
+        limiter.acquire('5.6.7.8')
+        limiter.acquire('1.2.3.4')
+
+    def test_prune(self):
+        limiter = ConnectionLimiter(destination_rate=1000.0)
+        limiter.min_prune_size = 2
+        limiter._prune_size = 2
+        limiter.acquire('1.2.3.4')
+        limiter.acquire('5.6.7.8')
+        time.sleep(0.01)
+        limiter.acquire('9.10.11.12')
+        self.assertEqual(['9.10.11.12'], list(limiter._buckets))
+
+    def _acquire_later(self, limiter, address, host):
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire(address, host)
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.daemon = True
+        thread.start()
+        return thread, acquired
+
+    def test_per_address(self):
+        limiter = ConnectionLimiter(per_address=1)
+        limiter.acquire('1.2.3.4', 'mx1.example.com')
+        limiter.acquire('5.6.7.8', 'mx1.example.com')
+        thread, acquired = self._acquire_later(limiter, '1.2.3.4',
+                                               'mx2.example.com')
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release('1.2.3.4', 'mx1.example.com')
+        thread.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEqual({'1.2.3.4': 1, '5.6.7.8': 1}, limiter._addresses)
+
+    def test_per_domain(self):
+        limiter = ConnectionLimiter(per_domain=2)
+        limiter.acquire('1.2.3.4', 'mx1.example.com')
+        limiter.acquire('5.6.7.8', 'mx2.example.com')
+        limiter.acquire('1.2.3.4', 'mx1.example.net')
+        thread, acquired = self._acquire_later(limiter, '9.10.11.12',
+                                               'mx3.example.com')
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release('1.2.3.4', 'mx1.example.net')
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release('5.6.7.8', 'mx2.example.com')
+        thread.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEqual({'example.com': 2}, limiter._domains)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,105 @@
+
+import threading
+from cStringIO import StringIO
+
+from mox import MoxTestBase
+
+import smtphealth.monitor
+from smtphealth.monitor import ProbeScheduler, Monitor, \
+    parse_inventory_line, read_inventory
+from smtphealth.engine import CheckEngine
+
+from fakes import FakeCheck
+
+
+class TestProbeScheduler(MoxTestBase):
+
+    def setUp(self):
+        super(TestProbeScheduler, self).setUp()
+        self.now = 1000.0
+        self.stubs.Set(smtphealth.monitor, 'monotonic', lambda: self.now)
+
+    def test_add_spread(self):
+        scheduler = ProbeScheduler()
+        for i in range(100):
+            scheduler.add(i, 60.0)
+        self.assertEqual(100, len(scheduler))
+        self.assertGreaterEqual(scheduler.next_due(), 1000.0)
+        self.assertEqual(100, len(scheduler.pop_due(1060.0)))
+
+    def test_add_invalid(self):
+        scheduler = ProbeScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.add('test', 0.0)
+
+    def test_pop_due(self):
+        scheduler = ProbeScheduler(jitter=0.0)
+        scheduler.add('one', 10.0, 5.0)
+        scheduler.add('two', 30.0, 1.0)
+        self.assertEqual([], scheduler.pop_due(1000.5))
+        self.assertEqual(['two', 'one'], scheduler.pop_due(1005.0))
+        self.assertEqual(1015.0, scheduler.next_due())
+        self.assertEqual(['one'], scheduler.pop_due(1015.0))
+        self.assertEqual(['one', 'two'], scheduler.pop_due(1031.0))
+
+    def test_jitter(self):
+        scheduler = ProbeScheduler(jitter=0.1)
+        scheduler.add('test', 100.0, 0.0)
+        scheduler.pop_due(1000.0)
+        self.assertGreaterEqual(scheduler.next_due(), 1090.0)
+        self.assertLessEqual(scheduler.next_due(), 1110.0)
+
+    def test_behind_schedule(self):
+        scheduler = ProbeScheduler(jitter=0.0)
+        scheduler.add('test', 10.0, 0.0)
+        self.assertEqual(['test'], scheduler.pop_due(1100.0))
+        self.assertEqual(1100.0, scheduler.next_due())
+
+    def test_iter_stop(self):
+        scheduler = ProbeScheduler(jitter=0.0)
+        scheduler.add('test', 10.0, 0.0)
+        probes = iter(scheduler)
+        self.assertEqual('test', next(probes))
+        scheduler.stop()
+        with self.assertRaises(StopIteration):
+            next(probes)
+
+
+class TestMonitor(MoxTestBase):
+
+    def test_run(self):
+        engine = CheckEngine(2)
+        engine.check_class = FakeCheck
+        mon = Monitor(engine, jitter=0.0)
+        mon.scheduler.add(('one', 25, False), 0.01, 0.0)
+        mon.scheduler.add(('two', 25, False), 0.01, 0.0)
+        seen = []
+        for target, check in mon.run():
+            seen.append(target[0])
+            if len(seen) >= 6:
+                mon.stop()
+        self.assertGreaterEqual(seen.count('one'), 2)
+        self.assertGreaterEqual(seen.count('two'), 2)
+
+
+class TestInventory(MoxTestBase):
+
+    def test_parse_inventory_line(self):
+        self.assertEqual((('test', 25, False), 60.0),
+                         parse_inventory_line('test'))
+        self.assertEqual((('test', 465, True), 2.5),
+                         parse_inventory_line('test:465,ssl  2.5'))
+
+    def test_parse_inventory_line_invalid(self):
+        for line in ('test abc', 'test 0', 'test 10 20', 'test:abc 10'):
+            with self.assertRaises(ValueError):
+                parse_inventory_line(line)
+
+    def test_read_inventory(self):
+        stream = StringIO('# comment\none 30\n\ntwo\n')
+        self.assertEqual([(('one', 25, False), 30.0),
+                          (('two', 25, False), 10.0)],
+                         list(read_inventory(stream, 10.0)))
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,234 @@
+
+import sys
+import time
+import types
+import socket
+import pickle
+from cStringIO import StringIO
+
+from mox import MoxTestBase
+
+from smtphealth.mx import MxCheck, MxRecord, StaticResolver, \
+    DnsPythonResolver, ALL, ANY, PRIMARY
+
+from fakes import FakeCheck
+
+
+class TestStaticResolver(MoxTestBase):
+
+    def test_resolve_mx(self):
+        resolver = StaticResolver({'example.com': [(20, 'mx2.example.com'),
+                                                   (10, 'mx1.example.com'),
+                                                   (30, 'mx1.example.com')]})
+        self.assertEqual([MxRecord(10, 'mx1.example.com'),
+                          MxRecord(20, 'mx2.example.com')],
+                         resolver.resolve_mx('Example.com.'))
+
+    def test_resolve_mx_unknown(self):
+        resolver = StaticResolver({})
+        with self.assertRaises(socket.gaierror):
+            resolver.resolve_mx('example.com')
+
+
+class FakeName(object):
+
+    def __init__(self, text):
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, FakeName) and self.text == other.text
+
+    def __ne__(self, other):
+        return not self == other
+
+    def to_text(self, omit_final_dot=False):
+        if omit_final_dot and self.text != '.':
+            return self.text.rstrip('.')
+        return self.text
+
+
+class FakeRdata(object):
+
+    def __init__(self, preference, exchange):
+        self.preference = preference
+        self.exchange = FakeName(exchange)
+
+
+def _fake_dns():
+    # Just enough of dnspython for DnsPythonResolver.
+    dns = types.ModuleType('dns')
+    dns.name = types.ModuleType('dns.name')
+    dns.name.root = FakeName('.')
+    dns.exception = types.ModuleType('dns.exception')
+    dns.exception.DNSException = type('DNSException', (Exception, ), {})
+    dns.resolver = types.ModuleType('dns.resolver')
+    dns.resolver.NXDOMAIN = type('NXDOMAIN', (dns.exception.DNSException, ),
+                                 {})
+    dns.resolver.NoAnswer = type('NoAnswer', (dns.exception.DNSException, ),
+                                 {})
+    dns.resolver.Resolver = object
+    return dns
+
+
+class TestDnsPythonResolver(MoxTestBase):
+
+    def setUp(self):
+        super(TestDnsPythonResolver, self).setUp()
+        self.dns = dns = _fake_dns()
+        fakes = {'dns': dns, 'dns.name': dns.name,
+                 'dns.exception': dns.exception, 'dns.resolver': dns.resolver}
+        self.modules = {}
+        for name, module in fakes.items():
+            self.modules[name] = sys.modules.get(name)
+            sys.modules[name] = module
+        self.answers = {}
+        self.resolver = DnsPythonResolver(self)
+
+    def tearDown(self):
+        super(TestDnsPythonResolver, self).tearDown()
+        for name, module in self.modules.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+
+    def resolve(self, domain, rdtype):
+        answer = self.answers[domain.rstrip('.')]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def test_resolve_mx(self):
+        self.answers['example.com'] = [FakeRdata(20, 'mx2.example.com.'),
+                                       FakeRdata(10, 'mx1.example.com.')]
+        self.assertEqual([MxRecord(10, 'mx1.example.com'),
+                          MxRecord(20, 'mx2.example.com')],
+                         self.resolver.resolve_mx('example.com'))
+
+    def test_resolve_mx_null(self):
+        self.answers['example.com'] = [FakeRdata(0, '.')]
+        self.assertEqual([], self.resolver.resolve_mx('example.com'))
+
+    def test_resolve_mx_implicit(self):
+        self.answers['example.com'] = self.dns.resolver.NoAnswer()
+        self.assertEqual([MxRecord(0, 'example.com')],
+                         self.resolver.resolve_mx('example.com.'))
+
+    def test_resolve_mx_errors(self):
+        self.answers['missing.com'] = self.dns.resolver.NXDOMAIN()
+        self.answers['broken.com'] = self.dns.exception.DNSException('bad')
+        with self.assertRaises(socket.gaierror) as cm:
+            self.resolver.resolve_mx('missing.com')
+        self.assertEqual(socket.EAI_NONAME, cm.exception.args[0])
+        with self.assertRaises(socket.gaierror) as cm:
+            self.resolver.resolve_mx('broken.com')
+        self.assertEqual(socket.EAI_FAIL, cm.exception.args[0])
+
+
+class TestMxCheck(MoxTestBase):
+
+    def setUp(self):
+        super(TestMxCheck, self).setUp()
+        self.resolver = StaticResolver({
+            'good.test': [(10, 'mx1.good.test'), (20, 'mx2.good.test')],
+            'mixed.test': [(10, 'mx1.mixed.test'), (20, 'bad1.mixed.test'),
+                           (30, 'mx2.mixed.test')],
+            'backup.test': [(10, 'bad1.backup.test'),
+                            (20, 'mx1.backup.test')],
+            'bad.test': [(10, 'bad1.bad.test'), (20, 'bad2.bad.test')],
+            'null.test': []})
+        FakeCheck.delay = 0.0
+
+    def _run(self, domain, policy=ALL, backups=0):
+        check = MxCheck(policy, backups, self.resolver, connect_timeout=5)
+        check.check_class = FakeCheck
+        check.run(domain, 2525, True)
+        return check
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            MxCheck('most')
+
+    def test_run(self):
+        check = self._run('good.test')
+        self.assertEqual('OK', check.results['Status'])
+        self.assertEqual(2, check.results['Mx-Hosts'])
+        self.assertEqual(2, check.results['Mx-Hosts-Ok'])
+        self.assertIn('Dns-Elapsed', check.results)
+        self.assertEqual(['mx1.good.test', 'mx2.good.test'],
+                         [record.host for record in check.records])
+        self.assertEqual([10, 20], [c.results['Mx-Preference']
+                                    for c in check.checks])
+
+    def test_policy_all(self):
+        check = self._run('mixed.test')
+        self.assertEqual('CRITICAL', check.results['Status'])
+        self.assertEqual('MX_FAILED', check.results['Failure'])
+        self.assertEqual(2, check.results['Mx-Hosts-Ok'])
+
+    def test_policy_any(self):
+        self.assertEqual('OK', self._run('mixed.test', ANY)
+                         .results['Status'])
+        self.assertEqual('CRITICAL', self._run('bad.test', ANY)
+                         .results['Status'])
+
+    def test_policy_primary(self):
+        self.assertEqual('OK', self._run('mixed.test', PRIMARY, 1)
+                         .results['Status'])
+        self.assertEqual('CRITICAL', self._run('mixed.test', PRIMARY, 2)
+                         .results['Status'])
+        self.assertEqual('OK', self._run('good.test', PRIMARY, 5)
+                         .results['Status'])
+        self.assertEqual('CRITICAL', self._run('backup.test', PRIMARY)
+                         .results['Status'])
+
+    def test_parallel(self):
+        FakeCheck.delay = 0.2
+        start = time.time()
+        check = self._run('mixed.test')
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(3, len(check.checks))
+
+    def test_nxdomain(self):
+        check = self._run('missing.test')
+        self.assertEqual('CRITICAL', check.results['Status'])
+        self.assertEqual('DNS_NXDOMAIN', check.results['Failure'])
+        self.assertEqual([], check.checks)
+
+    def test_null_mx(self):
+        check = self._run('null.test')
+        self.assertEqual('CRITICAL', check.results['Status'])
+        self.assertEqual('MX_NULL', check.results['Failure'])
+
+    def test_output(self):
+        check = self._run('mixed.test', ANY)
+        del check.results['Dns-Elapsed']
+        f = StringIO()
+        self.assertEqual(0, check.output(f))
+        self.assertEqual("""\
+Status: OK
+Mx-Hosts: 3
+Mx-Hosts-Ok: 2
+
+Target: mx1.mixed.test:2525,ssl
+Status: OK
+Mx-Preference: 10
+
+Target: bad1.mixed.test:2525,ssl
+Status: CRITICAL
+Mx-Preference: 20
+
+Target: mx2.mixed.test:2525,ssl
+Status: OK
+Mx-Preference: 30
+""", f.getvalue())
+
+    def test_pickle(self):
+        check = self._run('good.test')
+        check.checks = []
+        copy = pickle.loads(pickle.dumps(check, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(check.results, copy.results)
+        self.assertEqual(check.records, copy.records)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,213 @@
+
+import json
+import time
+from cStringIO import StringIO
+from collections import OrderedDict
+
+from mox import MoxTestBase
+
+from smtphealth.targets import Target
+from smtphealth.output import HeaderWriter, JsonLinesWriter, BinaryWriter, \
+    ChangeWriter, get_writer, ordered_items, read_binary_records
+
+
+class TestOutput(MoxTestBase):
+
+    def setUp(self):
+        super(TestOutput, self).setUp()
+        self.results = {'Exception-Type': 'Timeout',
+                        'Status': 'CRITICAL',
+                        'Zebra': 7,
+                        'Connect-Elapsed': 0.25,
+                        'Dns-Cached': False,
+                        'Banner-Code': None,
+                        'Address': '127.0.0.1'}
+
+    def test_ordered_items(self):
+        self.assertEqual(['Target', 'Status', 'Address', 'Dns-Cached',
+                          'Connect-Elapsed', 'Banner-Code',
+                          'Exception-Type', 'Zebra'],
+                         [key for key, val in
+                          ordered_items(self.results, 'test')])
+        ordered = OrderedDict([('Status', 'OK'), ('B', 1), ('A', 2)])
+        self.assertEqual(['Status', 'B', 'A'],
+                         [key for key, val in ordered_items(ordered)])
+
+    def test_header(self):
+        f = StringIO()
+        writer = HeaderWriter(f)
+        self.assertEqual(1, writer.write(self.results, Target('test', 25,
+                                                              True)))
+        self.assertEqual(0, writer.write({'Status': 'OK'}))
+        self.assertEqual('', f.getvalue())
+        writer.flush()
+        self.assertEqual("""\
+Target: test:25,ssl
+Status: CRITICAL
+Address: 127.0.0.1
+Dns-Cached: False
+Connect-Elapsed: 0.25000
+Banner-Code: 
+Exception-Type: Timeout
+Zebra: 7
+
+Status: OK
+""", f.getvalue())
+
+    def test_header_multiline(self):
+        f = StringIO()
+        writer = HeaderWriter(f)
+        writer.write({'Status': 'OK',
+                      'Banner': '220-C:\\one\r\n220 two\r\n',
+                      'Banner-Message': 'C:\\one'})
+        writer.flush()
+        self.assertEqual('Status: OK\n'
+                         'Banner-Message: C:\\one\n'
+                         'Banner: 220-C:\\\\one\\r\\n220 two\\r\\n\n',
+                         f.getvalue())
+
+    def test_json(self):
+        f = StringIO()
+        writer = JsonLinesWriter(f)
+        writer.write(self.results)
+        writer.write({'Status': 'OK'}, 'test')
+        writer.flush()
+        lines = f.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('{"Status":"CRITICAL",'))
+        self.assertEqual(self.results, json.loads(lines[0]))
+        self.assertEqual('{"Target":"test","Status":"OK"}', lines[1])
+
+    def test_binary(self):
+        f = StringIO()
+        writer = BinaryWriter(f)
+        writer.write(self.results, 'test')
+        writer.write({'Status': 'OK', 'Banner-Message': u'caf\xe9'})
+        writer.flush()
+        records = list(read_binary_records(StringIO(f.getvalue())))
+        self.assertEqual(2, len(records))
+        expected = dict(self.results, Target='test')
+        self.assertEqual(expected, records[0])
+        self.assertEqual(list(records[0].keys()),
+                         [key for key, val in
+                          ordered_items(self.results, 'test')])
+        self.assertEqual({'Status': 'OK', 'Banner-Message': u'caf\xe9'},
+                         records[1])
+
+    def test_changes_max_delay(self):
+        f = StringIO()
+        writer = ChangeWriter(JsonLinesWriter(f, max_delay=0.05))
+        writer.write({'Status': 'OK'}, 'one')
+        for i in range(100):
+            writer.write({'Status': 'OK'}, 'one')
+            if f.getvalue():
+                break
+            time.sleep(0.01)
+        self.assertEqual(['new'], [json.loads(line)['Change']
+                                   for line in f.getvalue().splitlines()])
+        self.assertEqual(i + 1, writer.unchanged)
+
+    def test_non_ascii_banner(self):
+        results = {'Status': 'OK', 'Banner-Message': 'Servidor \xf1 listo'}
+        f = StringIO()
+        writer = JsonLinesWriter(f)
+        writer.write(results)
+        writer.flush()
+        self.assertEqual(u'Servidor \xf1 listo',
+                         json.loads(f.getvalue())['Banner-Message'])
+        f = StringIO()
+        writer = BinaryWriter(f)
+        writer.write(results)
+        writer.write({'Status': 'OK', 'Banner': u'\xf1' * 40000})
+        writer.flush()
+        records = list(read_binary_records(StringIO(f.getvalue())))
+        self.assertEqual(u'Servidor \xf1 listo', records[0]['Banner-Message'])
+        self.assertEqual(u'\xf1' * 32767, records[1]['Banner'])
+
+    def test_buffer_size(self):
+        f = self.mox.CreateMockAnything()
+        f.write('Status: OK\n\nStatus: OK\n')
+        f.flush()
+        f.flush()
+        self.mox.ReplayAll()
+        writer = HeaderWriter(f, buffer_size=20)
+        writer.write({'Status': 'OK'})
+        writer.write({'Status': 'OK'})
+        writer.flush()
+
+    def test_max_delay(self):
+        f = StringIO()
+        writer = HeaderWriter(f, max_delay=0.0)
+        writer.write({'Status': 'OK'})
+        self.assertEqual('Status: OK\n', f.getvalue())
+
+    def test_max_delay_idle(self):
+        f = StringIO()
+        writer = HeaderWriter(f, max_delay=0.05)
+        writer.write({'Status': 'OK'})
+        self.assertEqual('', f.getvalue())
+        for i in range(100):
+            if f.getvalue():
+                break
+            time.sleep(0.01)
+        self.assertEqual('Status: OK\n', f.getvalue())
+
+    def test_changes(self):
+        f = StringIO()
+        writer = ChangeWriter(JsonLinesWriter(f))
+        ok = {'Status': 'OK', 'Banner-Code': 220, 'Banner-Elapsed': 0.1}
+        self.assertEqual(0, writer.write(ok, 'one'))
+        self.assertEqual(0, writer.write(ok, 'two'))
+        slower = dict(ok)
+        slower['Banner-Elapsed'] = 0.2
+        self.assertEqual(0, writer.write(slower, 'one'))
+        self.assertEqual(1, writer.write(dict(ok, Status='CRITICAL'), 'one'))
+        self.assertEqual(1, writer.write({'Status': 'CRITICAL'}))
+        writer.flush()
+        lines = [json.loads(line) for line in f.getvalue().splitlines()]
+        self.assertEqual([('one', 'OK', 'new'), ('two', 'OK', 'new'),
+                          ('one', 'CRITICAL', 'changed'),
+                          (None, 'CRITICAL', None)],
+                         [(line.get('Target'), line['Status'],
+                           line.get('Change')) for line in lines])
+        self.assertEqual(1, writer.unchanged)
+        self.assertNotIn('Change', ok)
+
+    def test_changes_sticky(self):
+        f = StringIO()
+        writer = ChangeWriter(JsonLinesWriter(f))
+        deep = {'Status': 'OK', 'Banner-Code': '220'}
+        probe = {'Status': 'OK', 'Reply-Code': '250'}
+        writer.write(deep, 'test')
+        writer.write(probe, 'test')
+        writer.write(deep, 'test')
+        writer.write(probe, 'test')
+        writer.write(dict(probe, **{'Reply-Code': '421'}), 'test')
+        writer.flush()
+        self.assertEqual(['new', 'changed'],
+                         [json.loads(line)['Change']
+                          for line in f.getvalue().splitlines()])
+
+    def test_changes_snapshot(self):
+        f = StringIO()
+        writer = ChangeWriter(JsonLinesWriter(f), 60.0)
+        self.mox.StubOutWithMock(writer, '_monotonic')
+        writer._monotonic().AndReturn(100.0)
+        writer._monotonic().AndReturn(150.0)
+        writer._monotonic().AndReturn(160.0)
+        self.mox.ReplayAll()
+        writer.write({'Status': 'OK'}, 'test')
+        writer.write({'Status': 'OK'}, 'test')
+        writer.write({'Status': 'OK'}, 'test')
+        writer.flush()
+        self.assertEqual(['new', 'snapshot'],
+                         [json.loads(line)['Change']
+                          for line in f.getvalue().splitlines()])
+
+    def test_get_writer(self):
+        f = StringIO()
+        self.assertTrue(isinstance(get_writer('json', f), JsonLinesWriter))
+        self.assertRaises(ValueError, get_writer, 'bad', f)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,94 @@
+
+import pickle
+
+from mox import MoxTestBase
+
+from smtphealth.results import CheckResults
+
+
+class TestCheckResults(MoxTestBase):
+
+    def test_known_keys(self):
+        results = CheckResults(Status='CRITICAL')
+        results['Dns-Elapsed'] = 0.5
+        results['Banner-Code'] = None
+        self.assertEqual('CRITICAL', results['Status'])
+        self.assertEqual(0.5, results['Dns-Elapsed'])
+        self.assertIsNone(results['Banner-Code'])
+        self.assertIn('Banner-Code', results)
+        self.assertNotIn('Connect-Elapsed', results)
+        self.assertEqual(3, len(results))
+        with self.assertRaises(KeyError):
+            results['Connect-Elapsed']
+        self.assertEqual('none', results.get('Connect-Elapsed', 'none'))
+        self.assertFalse(hasattr(results, '__dict__'))
+
+    def test_other_keys(self):
+        results = CheckResults([('Status', 'OK'), ('Zebra', 1)])
+        results['Apple'] = 2
+        self.assertEqual(2, results['Apple'])
+        self.assertEqual(2, results.get('Apple'))
+        self.assertIsNone(results.get('Missing'))
+        self.assertIn('Zebra', results)
+        self.assertNotIn('Missing', results)
+        with self.assertRaises(KeyError):
+            results['Missing']
+
+    def test_order(self):
+        results = CheckResults()
+        results['Zebra'] = 1
+        results['Banner-Code'] = '220'
+        results['Apple'] = 2
+        results['Status'] = 'OK'
+        results['Dns-Elapsed'] = 0.5
+        self.assertEqual(['Status', 'Dns-Elapsed', 'Banner-Code', 'Apple',
+                          'Zebra'], results.keys())
+        self.assertEqual(['OK', 0.5, '220', 2, 1], results.values())
+        self.assertEqual(('Status', 'OK'), results.items()[0])
+
+    def test_delete(self):
+        results = CheckResults({'Status': 'OK', 'Test': 1})
+        del results['Status']
+        del results['Test']
+        self.assertEqual(0, len(results))
+        with self.assertRaises(KeyError):
+            del results['Status']
+        with self.assertRaises(KeyError):
+            del results['Test']
+        results['Status'] = 'OK'
+        self.assertEqual('OK', results.pop('Status'))
+        self.assertEqual('none', results.pop('Status', 'none'))
+        with self.assertRaises(KeyError):
+            results.pop('Status')
+
+    def test_setdefault(self):
+        results = CheckResults()
+        self.assertEqual('OK', results.setdefault('Status', 'OK'))
+        self.assertEqual('OK', results.setdefault('Status', 'CRITICAL'))
+
+    def test_equality(self):
+        results = CheckResults({'Status': 'OK', 'Test': 1})
+        self.assertEqual({'Status': 'OK', 'Test': 1}, results)
+        self.assertEqual(results, {'Status': 'OK', 'Test': 1})
+        self.assertEqual(results, results.copy())
+        self.assertNotEqual({'Status': 'OK'}, results)
+        self.assertNotEqual(results, 'OK')
+        self.assertEqual({'Status': 'OK', 'Test': 1}, dict(results))
+
+    def test_copy(self):
+        results = CheckResults({'Status': 'OK', 'Test': 1})
+        copy = results.copy()
+        copy['Status'] = 'CRITICAL'
+        copy['Test'] = 2
+        self.assertEqual({'Status': 'OK', 'Test': 1}, results)
+
+    def test_pickle(self):
+        results = CheckResults({'Status': 'OK', 'Dns-Elapsed': 0.5,
+                                'Test': 1})
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(results, protocol))
+            self.assertIsInstance(copy, CheckResults)
+            self.assertEqual(results, copy)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
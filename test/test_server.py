@@ -0,0 +1,106 @@
+
+import os
+import sys
+import socket
+import shutil
+import tempfile
+import threading
+
+from mox import MoxTestBase, IgnoreArg
+
+from smtphealth import main
+from smtphealth.server import CheckServer, send_check
+
+
+class TestCheckServer(MoxTestBase):
+
+    def setUp(self):
+        super(TestCheckServer, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'server.sock')
+        self.server = None
+
+    def tearDown(self):
+        super(TestCheckServer, self).tearDown()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _serve(self, run_check):
+        self.server = CheckServer(self.path, run_check)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def test_send_check(self):
+        def run_check(argv, stream):
+            stream.write('Status: OK\n')
+            stream.write(' '.join(argv) + '\n')
+            return 0
+        self._serve(run_check)
+        ret, output = send_check(self.path, ['-p', '587', 'test'])
+        self.assertEqual(0, ret)
+        self.assertEqual(b'Status: OK\n-p 587 test\n', output)
+
+    def test_send_check_exit(self):
+        def run_check(argv, stream):
+            stream.write('Status: CRITICAL\n')
+            raise SystemExit(2)
+        self._serve(run_check)
+        ret, output = send_check(self.path, ['test'])
+        self.assertEqual(2, ret)
+        self.assertEqual(b'Status: CRITICAL\n', output)
+
+    def test_send_check_no_server(self):
+        with self.assertRaises(socket.error):
+            send_check(self.path, ['test'])
+
+    def _hang_up(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(1)
+
+        def hang_up():
+            conn, addr = listener.accept()
+            while conn.recv(4096):
+                pass
+            conn.close()
+            listener.close()
+        thread = threading.Thread(target=hang_up)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_send_check_no_response(self):
+        thread = self._hang_up()
+        with self.assertRaises(ValueError):
+            send_check(self.path, ['test'])
+        thread.join()
+
+    def test_main_no_response(self):
+        self.stubs.Set(sys, 'argv', ['smtp-health-check', '--server',
+                                     self.path, 'test'])
+        self.mox.StubOutWithMock(main, '_run_main')
+        main._run_main(IgnoreArg(), ['test'], sys.stdout).AndReturn(0)
+        self.mox.ReplayAll()
+        thread = self._hang_up()
+        self.assertEqual(0, main.main())
+        thread.join()
+
+    def test_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self._serve(lambda argv, stream: 0)
+        self.assertEqual((0, b''), send_check(self.path, ['test']))
+
+    def test_server_close(self):
+        self._serve(lambda argv, stream: 0)
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        self.assertFalse(os.path.exists(self.path))
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,214 @@
+
+import time
+import socket
+import threading
+
+from mox import MoxTestBase
+
+from smtphealth.limits import ConnectionLimiter
+from smtphealth.sessions import SessionPool, SessionPools, SessionCheck, \
+    EHLO, MAX_IDLE, default_max_idle
+
+
+class FakeServer(object):
+
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+        self.reply = b'250 2.0.0 OK\r\n'
+        self.connections = []
+        self.commands = []
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, addr = self.listener.accept()
+            except socket.error:
+                return
+            self.connections.append(conn)
+            thread = threading.Thread(target=self._serve, args=(conn, ))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        try:
+            conn.sendall(b'220 fake ESMTP\r\n')
+            f = conn.makefile('rb')
+            for line in iter(f.readline, b''):
+                self.commands.append(line)
+                if line.startswith(b'QUIT'):
+                    break
+                conn.sendall(self.reply)
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def hang_up(self):
+        for conn in self.connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def close(self):
+        self.hang_up()
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.listener.close()
+
+
+class TestSessionPool(MoxTestBase):
+
+    def setUp(self):
+        super(TestSessionPool, self).setUp()
+        self.server = FakeServer()
+        self.pool = SessionPool('127.0.0.1', self.server.port, size=1,
+                                banner_timeout=2.0)
+
+    def tearDown(self):
+        super(TestSessionPool, self).tearDown()
+        self.pool.close()
+        self.server.close()
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            SessionPool('test', size=0)
+        with self.assertRaises(ValueError):
+            SessionPool('test', command='RSET')
+
+    def test_probe(self):
+        results = self.pool.probe()
+        self.assertEqual('OK', results['Status'])
+        self.assertFalse(results['Session-Reused'])
+        self.assertEqual('220', results['Banner-Code'])
+        self.assertIn('Connect-Elapsed', results)
+        self.assertEqual('250', results['Reply-Code'])
+        self.assertEqual('2.0.0 OK', results['Reply-Message'])
+        self.assertEqual(results['Session-Rtt'], results['Pool-Rtt'])
+        self.assertEqual(1, results['Pool-Sessions'])
+        results = self.pool.probe()
+        self.assertEqual('OK', results['Status'])
+        self.assertTrue(results['Session-Reused'])
+        self.assertNotIn('Connect-Elapsed', results)
+        self.assertEqual(1, len(self.server.connections))
+        self.assertEqual([b'NOOP\r\n', b'NOOP\r\n'], self.server.commands)
+
+    def test_probe_ehlo(self):
+        self.pool = SessionPool('127.0.0.1', self.server.port, command=EHLO)
+        self.server.reply = b'250-fake\r\n250 PIPELINING\r\n'
+        results = self.pool.probe()
+        self.assertEqual('OK', results['Status'])
+        self.assertEqual('fake', results['Reply-Message'])
+        self.assertTrue(self.server.commands[0].startswith(b'EHLO '))
+
+    def test_reconnect(self):
+        self.pool.probe()
+        self.server.hang_up()
+        results = self.pool.probe()
+        self.assertEqual('OK', results['Status'])
+        self.assertTrue(results['Session-Reconnected'])
+        self.assertFalse(results['Session-Reused'])
+        self.assertEqual(1, self.pool.reconnects)
+        self.assertEqual(1, len(self.pool))
+        self.assertEqual(2, len(self.server.connections))
+
+    def test_reconnect_reply_failure(self):
+        self.pool.probe()
+        self.server.reply = b'421 4.4.2 Idle too long\r\n'
+        results = self.pool.probe()
+        self.assertEqual('CRITICAL', results['Status'])
+        self.assertTrue(results['Session-Reconnected'])
+        self.assertEqual('REPLY_4XX', results['Failure'])
+        self.assertEqual('421', results['Reply-Code'])
+        self.assertEqual(0, len(self.pool))
+
+    def test_max_idle(self):
+        self.pool.max_idle = 0.0
+        self.pool.probe()
+        results = self.pool.probe()
+        self.assertFalse(results['Session-Reused'])
+        self.assertNotIn('Session-Reconnected', results)
+        self.assertEqual(2, len(self.server.connections))
+
+    def test_max_idle_interval(self):
+        self.pool.max_idle = default_max_idle(60.0)
+        self.pool.probe()
+        check, since = self.pool._idle[0]
+        self.pool._idle[0] = (check, since - 66.0)
+        self.assertTrue(self.pool.probe()['Session-Reused'])
+        check, since = self.pool._idle[0]
+        self.pool._idle[0] = (check, since - 91.0)
+        self.assertFalse(self.pool.probe()['Session-Reused'])
+        self.assertEqual(MAX_IDLE, default_max_idle(3600.0))
+
+    def test_connect_failure(self):
+        self.server.close()
+        results = self.pool.probe()
+        self.assertEqual('CRITICAL', results['Status'])
+        self.assertEqual('CONNECT_REFUSED', results['Failure'])
+        self.assertEqual(0, results['Pool-Sessions'])
+
+
+class TestSessionCheck(MoxTestBase):
+
+    def test_run(self):
+        server = FakeServer()
+        sessions = SessionPools(size=1, deep_interval=60.0)
+        try:
+            check = SessionCheck(sessions, banner_timeout=2.0)
+            check.run('127.0.0.1', server.port)
+            self.assertEqual('OK', check.results['Status'])
+            self.assertNotIn('Session-Rtt', check.results)
+            check = SessionCheck(sessions, banner_timeout=2.0)
+            check.run('127.0.0.1', server.port)
+            self.assertEqual('OK', check.results['Status'])
+            self.assertIn('Session-Rtt', check.results)
+            self.assertEqual(1, len(sessions))
+        finally:
+            sessions.close()
+            server.close()
+
+    def test_run_limiter(self):
+        server = FakeServer()
+        limiter = ConnectionLimiter(per_address=1)
+        sessions = SessionPools(size=1, deep_interval=0.5)
+        kwargs = {'banner_timeout': 2.0, 'limiter': limiter}
+
+        def run():
+            check = SessionCheck(sessions, **kwargs)
+            thread = threading.Thread(target=check.run,
+                                      args=('127.0.0.1', server.port))
+            thread.daemon = True
+            thread.start()
+            thread.join(5.0)
+            self.assertFalse(thread.is_alive())
+            return check.results
+        try:
+            self.assertNotIn('Session-Rtt', run())
+            self.assertFalse(run()['Session-Reused'])
+            self.assertEqual({}, limiter._addresses)
+            self.assertTrue(run()['Session-Reused'])
+            time.sleep(0.5)
+            self.assertNotIn('Session-Rtt', run())
+            self.assertEqual({}, limiter._addresses)
+        finally:
+            sessions.close()
+            server.close()
+
+    def test_deep_due(self):
+        sessions = SessionPools(deep_interval=60.0)
+        self.assertTrue(sessions.deep_due('test', 25, False, 100.0))
+        self.assertFalse(sessions.deep_due('test', 25, False, 150.0))
+        self.assertTrue(sessions.deep_due('test', 25, True, 150.0))
+        self.assertTrue(sessions.deep_due('test', 25, False, 160.0))
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,122 @@
+
+import time
+import pickle
+
+from mox import MoxTestBase
+
+from smtphealth import SmtpHealthCheck, shards
+from smtphealth.addresses import AllAddressesCheck
+from smtphealth.engine import CheckEngine
+from smtphealth.shards import ShardedEngine, ShardStats
+
+from fakes import FakeCheck
+
+
+class ExitedProcess(object):
+
+    exitcode = 0
+
+    def __init__(self, shard, finished):
+        self.shard = shard
+        self.finished = finished
+        self.sent = False
+
+    def is_alive(self):
+        # Sends everything just as it is first asked, then exits.
+        if not self.sent:
+            self.sent = True
+            check = FakeCheck()
+            check.run('test')
+            self.finished.put((self.shard, ('test', 25, False), check))
+            self.finished.put((self.shard, None,
+                               ShardStats(self.shard, 1, 1, 0.1, 0.1, None)))
+            time.sleep(0.1)
+        return False
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        pass
+
+
+class ExitedEngine(ShardedEngine):
+
+    def _start(self, tasks, finished):
+        return [ExitedProcess(shard, finished)
+                for shard in range(self.processes)]
+
+
+class TestShardedEngine(MoxTestBase):
+
+    def setUp(self):
+        super(TestShardedEngine, self).setUp()
+        engine = CheckEngine(3)
+        engine.check_class = FakeCheck
+        self.engine = ShardedEngine(engine, 2, batch_size=4)
+
+    def test_bad_processes(self):
+        with self.assertRaises(ValueError):
+            ShardedEngine(CheckEngine(), 0)
+
+    def test_run(self):
+        targets = (('{0}{1}'.format('test' if i % 3 else 'bad', i), 25, False)
+                   for i in range(50))
+        results = list(self.engine.run(targets))
+        self.assertEqual(50, len(results))
+        for target, check in results:
+            self.assertEqual(target[0], check.host)
+        self.assertEqual(2, len(self.engine.stats))
+        self.assertEqual([0, 1], [stats.shard
+                                  for stats in self.engine.stats])
+        self.assertEqual(50, sum(stats.checks
+                                 for stats in self.engine.stats))
+        self.assertEqual(33, sum(stats.healthy
+                                 for stats in self.engine.stats))
+        for stats in self.engine.stats:
+            self.assertEqual(None, stats.exitcode)
+
+    def test_run_empty(self):
+        self.assertEqual([], list(self.engine.run([])))
+        self.assertEqual(0, sum(stats.checks
+                                for stats in self.engine.stats))
+
+    def test_run_stopped(self):
+        targets = (('test', 25, False) for i in range(10000))
+        results = self.engine.run(targets)
+        next(results)
+        results.close()
+        self.assertEqual(2, len(self.engine.stats))
+
+    def test_run_exited_after_sending(self):
+        self.stubs.Set(shards, '_POLL_INTERVAL', 0.05)
+        engine = ExitedEngine(CheckEngine(), 1)
+        results = list(engine.run([]))
+        self.assertEqual([('test', 25, False)],
+                         [target for target, check in results])
+        self.assertEqual([ShardStats(0, 1, 1, 0.1, 0.1, None)],
+                         engine.stats)
+
+    def test_stats_rate(self):
+        self.assertEqual(5.0, ShardStats(0, 10, 10, 2.0, 1.0, None).rate)
+        self.assertEqual(0.0, ShardStats(0, 0, 0, 0.0, 0.0, None).rate)
+
+
+class TestPickleCheck(MoxTestBase):
+
+    def test_pickle(self):
+        check = SmtpHealthCheck(connect_timeout=5)
+        check.results['Banner-Code'] = '220'
+        copy = pickle.loads(pickle.dumps(check, 2))
+        self.assertEqual(check.results, copy.results)
+        self.assertFalse(hasattr(copy, 'sock'))
+
+    def test_pickle_all_addresses(self):
+        check = AllAddressesCheck()
+        check.checks = [SmtpHealthCheck()]
+        copy = pickle.loads(pickle.dumps(check, 2))
+        self.assertEqual(1, len(copy.checks))
+        self.assertEqual(check.checks[0].results, copy.checks[0].results)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -1,6 +1,8 @@
 
 import time
+import errno
 import socket
+import threading
 import ssl
 from cStringIO import StringIO
 from collections import OrderedDict
@@ -8,6 +10,10 @@ from collections import OrderedDict
 from mox import MoxTestBase, IsA, IgnoreArg
 
 from smtphealth import Timeout, SmtpHealthCheck, DNSError, BannerSyntaxError, BannerError
+from smtphealth import _interleave_families
+from smtphealth.tls import SslSessionCache
+from smtphealth import failures
+import smtphealth
 
 
 class TestTimeout(MoxTestBase):
@@ -20,8 +26,41 @@ class TestTimeout(MoxTestBase):
 
     def test_failure(self):
         with self.assertRaises(Timeout):
-            with Timeout(1):
-                time.sleep(2.0)
+            with Timeout(0.25):
+                time.sleep(0.5)
+
+    def test_remaining(self):
+        with Timeout(None) as t:
+            self.assertEqual(None, t.remaining())
+        with Timeout(5.0) as t:
+            self.assertGreater(t.remaining(), 4.0)
+            self.assertLessEqual(t.remaining(), 5.0)
+        with self.assertRaises(Timeout):
+            with Timeout(0.0) as t:
+                t.remaining()
+
+    def test_socket_timeout(self):
+        with self.assertRaises(Timeout) as cm:
+            with Timeout(5.0, 'test timeout'):
+                raise socket.timeout()
+        self.assertEqual('test timeout', str(cm.exception))
+
+    def test_other_exception(self):
+        with self.assertRaises(ValueError):
+            with Timeout(5.0):
+                raise ValueError()
+
+    def test_thread(self):
+        timers = []
+        def run():
+            with Timeout(1) as t:
+                time.sleep(0.1)
+            timers.append(t)
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertEqual(1, len(timers))
+        self.assertGreater(timers[0].elapsed, 0.0)
 
 
 class TestSmtpHealthCheck(MoxTestBase):
@@ -38,36 +77,157 @@ class TestSmtpHealthCheck(MoxTestBase):
         check._lookup('test', 13)
         self.assertIn('Dns-Elapsed', check.results)
 
+    def test_lookup_timeout(self):
+        check = SmtpHealthCheck(dns_timeout=0.1)
+        self.stubs.Set(socket, 'getaddrinfo', lambda *args: time.sleep(0.5))
+        with self.assertRaises(Timeout):
+            check._lookup('test', 13)
+        self.assertNotIn('Dns-Elapsed', check.results)
+
+    def test_lookup_error(self):
+        check = SmtpHealthCheck(dns_timeout=1.0)
+        self.mox.StubOutWithMock(socket, 'getaddrinfo')
+        socket.getaddrinfo('test', 13, socket.AF_INET, socket.SOCK_STREAM) \
+            .AndRaise(socket.gaierror('test error'))
+        self.mox.ReplayAll()
+        with self.assertRaises(socket.gaierror):
+            check._lookup('test', 13)
+
     def test_connect(self):
         check = SmtpHealthCheck()
         self.mox.StubOutWithMock(socket, 'socket')
         sock = self.mox.CreateMockAnything()
         socket.socket(1, 2, 3).AndReturn(sock)
+        sock.settimeout(None)
         sock.connect(('test', 13))
         self.mox.ReplayAll()
         check._connect([(1, 2, 3, '', ('test', 13))])
         self.assertIn('Connect-Elapsed', check.results)
 
+    def test_connect_address(self):
+        check = SmtpHealthCheck()
+        self.mox.StubOutWithMock(socket, 'socket')
+        sock = self.mox.CreateMockAnything()
+        socket.socket(10, 2, 3).AndReturn(sock)
+        sock.settimeout(None)
+        sock.connect(('::1', 13, 0, 0))
+        self.mox.ReplayAll()
+        check._connect([(10, 2, 3, '', ('::1', 13, 0, 0)),
+                        (2, 2, 3, '', ('127.0.0.1', 13))])
+        self.assertEqual('::1', check.results['Address'])
+
+    def test_connect_race(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        refused = socket.socket()
+        refused.bind(('127.0.0.1', 0))
+        good_addr = listener.getsockname()
+        bad_addr = refused.getsockname()
+        check = SmtpHealthCheck(connect_timeout=5.0, happy_eyeballs=True)
+        try:
+            check._connect([(socket.AF_INET, socket.SOCK_STREAM, 0, '',
+                             bad_addr),
+                            (socket.AF_INET, socket.SOCK_STREAM, 0, '',
+                             good_addr)])
+            self.assertEqual(good_addr, check.sock.getpeername())
+            self.assertIn('Connect-Elapsed', check.results)
+        finally:
+            check._close(False)
+            listener.close()
+            refused.close()
+
+    def test_connect_race_failure(self):
+        refused = socket.socket()
+        refused.bind(('127.0.0.1', 0))
+        bad_addr = refused.getsockname()
+        check = SmtpHealthCheck(connect_timeout=5.0, happy_eyeballs=True)
+        try:
+            with self.assertRaises(socket.error):
+                check._connect([(socket.AF_INET, socket.SOCK_STREAM, 0, '',
+                                 bad_addr)] * 2)
+            self.assertEqual(None, check.sock)
+        finally:
+            refused.close()
+
+    def test_interleave_families(self):
+        gai = [(10, 1, 1, '', 'a'), (10, 1, 1, '', 'b'),
+               (10, 1, 1, '', 'c'), (2, 1, 1, '', 'd'),
+               (2, 1, 1, '', 'e')]
+        addresses = [entry[4] for entry in _interleave_families(gai)]
+        self.assertEqual(['a', 'd', 'b', 'e', 'c'], addresses)
+
     def test_connect_bad_dns(self):
         check = SmtpHealthCheck()
         with self.assertRaises(DNSError):
             check._connect([])
 
     def test_wrap_ssl(self):
+        context = self.mox.CreateMock(ssl.SSLContext)
+        check = SmtpHealthCheck(ssl_context=context)
+        sock = check.sock = self.mox.CreateMock(socket.socket)
+        ssl_sock = self.mox.CreateMock(ssl.SSLSocket)
+        sock.settimeout(None)
+        context.wrap_socket(sock, server_hostname='test',
+                            do_handshake_on_connect=False).AndReturn(ssl_sock)
+        ssl_sock.do_handshake()
+        self.mox.ReplayAll()
+        check._wrap_ssl('test')
+        self.assertEqual(ssl_sock, check.sock)
+        self.assertIn('Ssl-Elapsed', check.results)
+        self.assertNotIn('Ssl-Resumed', check.results)
+
+    def test_wrap_ssl_default_context(self):
         check = SmtpHealthCheck()
-        check.sock = 13
+        sock = check.sock = self.mox.CreateMock(socket.socket)
         ssl_sock = self.mox.CreateMock(ssl.SSLSocket)
-        self.mox.StubOutWithMock(ssl, 'wrap_socket')
-        ssl.wrap_socket(13).AndReturn(ssl_sock)
+        context = self.mox.CreateMock(ssl.SSLContext)
+        self.mox.StubOutWithMock(smtphealth, 'get_default_context')
+        smtphealth.get_default_context().AndReturn(context)
+        sock.settimeout(None)
+        context.wrap_socket(sock, server_hostname=None,
+                            do_handshake_on_connect=False).AndReturn(ssl_sock)
         ssl_sock.do_handshake()
         self.mox.ReplayAll()
         check._wrap_ssl()
         self.assertEqual(ssl_sock, check.sock)
 
+    def test_wrap_ssl_sessions(self):
+        context = self.mox.CreateMockAnything()
+        sessions = SslSessionCache()
+        sessions.supported = True
+        sessions.set(('test', '1.2.3.4', 465), 'session')
+        check = SmtpHealthCheck(ssl_context=context, ssl_sessions=sessions)
+        sock = check.sock = self.mox.CreateMock(socket.socket)
+        ssl_sock = self.mox.CreateMockAnything()
+        sock.getpeername().AndReturn(('1.2.3.4', 465))
+        sock.settimeout(None)
+        context.wrap_socket(sock, server_hostname='test',
+                            do_handshake_on_connect=False,
+                            session='session').AndReturn(ssl_sock)
+        ssl_sock.do_handshake()
+        ssl_sock.session_reused = True
+        ssl_sock.session = 'new session'
+        ssl_sock.unwrap().AndReturn(sock)
+        sock.close()
+        self.mox.ReplayAll()
+        check._wrap_ssl('test')
+        self.assertTrue(check.results['Ssl-Resumed'])
+        check._close(True)
+        self.assertEqual('new session',
+                         sessions.get(('test', '1.2.3.4', 465)))
+
+    def _expect_recv(self, sock, data):
+        def write(view):
+            view[0:len(data)] = data
+        sock.settimeout(None)
+        sock.recv_into(IsA(memoryview)).WithSideEffects(write) \
+            .AndReturn(len(data))
+
     def test_get_banner(self):
         check = SmtpHealthCheck()
         check.sock = self.mox.CreateMockAnything()
-        check.sock.recv(IsA(int)).AndReturn('220 Ok\r\n')
+        self._expect_recv(check.sock, '220 Ok\r\n')
         self.mox.ReplayAll()
         banner = check._get_banner()
         self.assertIn('Banner-Elapsed', check.results)
@@ -76,23 +236,20 @@ class TestSmtpHealthCheck(MoxTestBase):
     def test_get_banner_multiline(self):
         check = SmtpHealthCheck()
         check.sock = self.mox.CreateMockAnything()
-        check.sock.recv(IsA(int)).AndReturn('220-Part One\r\n')
+        self._expect_recv(check.sock, '220-Part One\r\n')
+        self._expect_recv(check.sock, '220-Part Two\r\n220 Part')
+        self._expect_recv(check.sock, ' Three\r\n')
         self.mox.ReplayAll()
         banner = check._get_banner()
         self.assertIn('Banner-Elapsed', check.results)
-        self.assertEqual('220-Part One\r\n', banner)
+        self.assertEqual('220-Part One\r\n220-Part Two\r\n220 Part Three\r\n',
+                         banner)
 
     def test_get_banner_slow(self):
         check = SmtpHealthCheck()
         check.sock = self.mox.CreateMockAnything()
-        check.sock.recv(IsA(int)).AndReturn('2')
-        check.sock.recv(IsA(int)).AndReturn('2')
-        check.sock.recv(IsA(int)).AndReturn('0')
-        check.sock.recv(IsA(int)).AndReturn(' ')
-        check.sock.recv(IsA(int)).AndReturn('O')
-        check.sock.recv(IsA(int)).AndReturn('k')
-        check.sock.recv(IsA(int)).AndReturn('\r')
-        check.sock.recv(IsA(int)).AndReturn('\n')
+        for char in '220 Ok\r\n':
+            self._expect_recv(check.sock, char)
         self.mox.ReplayAll()
         banner = check._get_banner()
         self.assertIn('Banner-Elapsed', check.results)
@@ -101,13 +258,30 @@ class TestSmtpHealthCheck(MoxTestBase):
     def test_get_banner_long(self):
         check = SmtpHealthCheck()
         check.sock = self.mox.CreateMockAnything()
-        check.sock.recv(IsA(int)).AndReturn('a'*5120)
-        check.sock.recv(IsA(int)).AndReturn('a'*5120)
-        check.sock.recv(IsA(int)).AndReturn('a')
+        self._expect_recv(check.sock, 'a'*5120)
+        self._expect_recv(check.sock, 'a'*5120)
+        self.mox.ReplayAll()
+        with self.assertRaises(BannerError):
+            check._get_banner()
+
+    def test_get_banner_long_multiline(self):
+        check = SmtpHealthCheck()
+        check.sock = self.mox.CreateMockAnything()
+        for i in range(640):
+            self._expect_recv(check.sock, '220-aaaaaaaaaa\r\n')
         self.mox.ReplayAll()
         with self.assertRaises(BannerError):
             check._get_banner()
 
+    def test_get_banner_closed(self):
+        check = SmtpHealthCheck()
+        check.sock = self.mox.CreateMockAnything()
+        self._expect_recv(check.sock, '220-Ok\r\n')
+        self._expect_recv(check.sock, '')
+        self.mox.ReplayAll()
+        with self.assertRaises(BannerSyntaxError):
+            check._get_banner()
+
     def test_check_banner(self):
         check = SmtpHealthCheck()
         check._check_banner('220 Ok\r\n')
@@ -115,6 +289,31 @@ class TestSmtpHealthCheck(MoxTestBase):
         self.assertEqual('Ok', check.results['Banner-Message'])
         self.assertEqual('OK', check.results['Status'])
 
+    def test_check_banner_multiline(self):
+        check = SmtpHealthCheck()
+        check._check_banner('220-One\r\n220-Two\r\n220 Three\r\n')
+        self.assertEqual('220', check.results['Banner-Code'])
+        self.assertEqual('One', check.results['Banner-Message'])
+        self.assertEqual('220-One\r\n220-Two\r\n220 Three\r\n',
+                         check.results['Banner'])
+        self.assertEqual('OK', check.results['Status'])
+
+    def test_check_banner_control_characters(self):
+        check = SmtpHealthCheck()
+        check._check_banner('220 One\x0cTwo\x1eThree\r\n')
+        self.assertEqual('One\x0cTwo\x1eThree',
+                         check.results['Banner-Message'])
+        self.assertNotIn('Banner', check.results)
+        self.assertEqual('OK', check.results['Status'])
+
+    def test_check_banner_multiline_invalid(self):
+        check = SmtpHealthCheck()
+        with self.assertRaises(BannerSyntaxError):
+            check._check_banner('220-One\r\nTwo\r\n220 Three\r\n')
+        with self.assertRaises(BannerSyntaxError):
+            check._check_banner('220-One\r\n554 Two\r\n')
+        self.assertEquals('CRITICAL', check.results['Status'])
+
     def test_check_banner_invalid(self):
         check = SmtpHealthCheck()
         with self.assertRaises(BannerSyntaxError):
@@ -185,8 +384,58 @@ class TestSmtpHealthCheck(MoxTestBase):
         check.sock.close()
         self.mox.ReplayAll()
         check.run('test', 13)
+        self.assertEqual('CONNECT_FAILED', check.results['Failure'])
         self.assertEqual('Exception', check.results['Exception-Type'])
         self.assertEqual('test test', check.results['Exception-Value'])
+        self.assertNotIn('Exception-Traceback', check.results)
+
+    def test_run_traceback(self):
+        check = SmtpHealthCheck(tracebacks=True)
+        self.mox.StubOutWithMock(check, '_lookup')
+        check._lookup('test', 13).AndRaise(Exception('test test'))
+        self.mox.ReplayAll()
+        check.run('test', 13)
+        self.assertEqual('DNS_FAILED', check.results['Failure'])
+        self.assertIn('test test', check.results['Exception-Traceback'])
+
+    def test_classify_failure(self):
+        check = SmtpHealthCheck()
+        nxdomain = socket.gaierror(socket.EAI_NONAME, 'Name not known')
+        refused = socket.error(errno.ECONNREFUSED, 'Connection refused')
+        unreachable = socket.error(errno.EHOSTUNREACH, 'No route to host')
+        reset = socket.error(errno.ECONNRESET, 'Connection reset')
+        classify = check._classify_failure
+        self.assertEqual(failures.DNS_NXDOMAIN, classify('dns', nxdomain))
+        self.assertEqual(failures.DNS_FAILED,
+                         classify('dns', socket.gaierror(socket.EAI_AGAIN)))
+        self.assertEqual(failures.DNS_TIMEOUT, classify('dns', Timeout(1)))
+        self.assertEqual(failures.DNS_NO_ADDRESS,
+                         classify('connect', DNSError()))
+        self.assertEqual(failures.CONNECT_REFUSED,
+                         classify('connect', refused))
+        self.assertEqual(failures.CONNECT_UNREACHABLE,
+                         classify('connect', unreachable))
+        self.assertEqual(failures.CONNECT_FAILED, classify('connect', reset))
+        self.assertEqual(failures.CONNECT_TIMEOUT,
+                         classify('connect', socket.timeout()))
+        self.assertEqual(failures.TLS_FAILED, classify('ssl', ssl.SSLError()))
+        self.assertEqual(failures.TLS_TIMEOUT, classify('ssl', Timeout(1)))
+        self.assertEqual(failures.BANNER_TIMEOUT,
+                         classify('banner', Timeout(1)))
+        self.assertEqual(failures.BANNER_FAILED, classify('banner', reset))
+        self.assertEqual(failures.BANNER_SYNTAX,
+                         classify('banner', BannerSyntaxError()))
+        self.assertEqual(failures.INTERNAL_ERROR,
+                         classify('check', KeyError()))
+
+    def test_classify_banner_failure(self):
+        check = SmtpHealthCheck()
+        for code, failure in (('421', failures.BANNER_4XX),
+                              ('554', failures.BANNER_5XX),
+                              ('300', failures.BANNER_FAILED)):
+            check.results['Banner-Code'] = code
+            self.assertEqual(failure,
+                             check._classify_failure('check', BannerError()))
 
     def test_run_ssl(self):
         check = SmtpHealthCheck()
@@ -198,7 +447,7 @@ class TestSmtpHealthCheck(MoxTestBase):
         self.mox.StubOutWithMock(check, '_check_banner')
         check._lookup('test', 13).AndReturn('beep')
         check._connect('beep')
-        check._wrap_ssl()
+        check._wrap_ssl('test')
         check._get_banner().AndReturn('beep beep')
         check._check_banner('beep beep')
         check.sock.unwrap().AndReturn(check.sock)
@@ -206,6 +455,37 @@ class TestSmtpHealthCheck(MoxTestBase):
         self.mox.ReplayAll()
         check.run('test', 13, with_ssl=True)
 
+    def test_run_limiter(self):
+        limiter = self.mox.CreateMockAnything()
+        check = SmtpHealthCheck(limiter=limiter)
+        check.sock = self.mox.CreateMockAnything()
+        gai = [(None, None, None, None, ('1.2.3.4', 13))]
+        self.mox.StubOutWithMock(check, '_lookup')
+        self.mox.StubOutWithMock(check, '_connect')
+        check._lookup('test', 13).AndReturn(gai)
+        limiter.acquire('1.2.3.4', 'test').AndReturn(0.5)
+        check._connect(gai).AndRaise(socket.error('test test'))
+        check.sock.close()
+        limiter.release('1.2.3.4', 'test')
+        self.mox.ReplayAll()
+        check.run('test', 13)
+        self.assertEqual(0.5, check.results['Limit-Elapsed'])
+        self.assertEqual('test test', check.results['Exception-Value'])
+
+    def test_run_address(self):
+        check = SmtpHealthCheck()
+        check.sock = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(check, '_lookup')
+        self.mox.StubOutWithMock(check, '_connect')
+        self.mox.StubOutWithMock(check, '_get_banner')
+        self.mox.StubOutWithMock(check, '_check_banner')
+        check._connect(['beep'])
+        check._get_banner().AndReturn('beep beep')
+        check._check_banner('beep beep')
+        check.sock.close()
+        self.mox.ReplayAll()
+        check.run_address('beep')
+
     def test_check_output(self):
         check = SmtpHealthCheck()
         check.results = OrderedDict([('Status', 'OK'),
@@ -0,0 +1,102 @@
+
+import time
+from cStringIO import StringIO
+
+from mox import MoxTestBase, IsA
+
+from smtphealth.stats import LatencyHistogram, StageLatencies, repeat_check
+
+from fakes import FakeCheck
+
+
+class TestLatencyHistogram(MoxTestBase):
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(0, histogram.count)
+        self.assertEqual(None, histogram.min)
+        self.assertEqual(None, histogram.percentile(50.0))
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 1001):
+            histogram.record(i / 1000.0)
+        self.assertEqual(1000, histogram.count)
+        self.assertEqual(0.001, histogram.min)
+        self.assertEqual(1.0, histogram.max)
+        self.assertAlmostEqual(0.5, histogram.percentile(50.0), delta=0.005)
+        self.assertAlmostEqual(0.9, histogram.percentile(90.0), delta=0.009)
+        self.assertAlmostEqual(0.99, histogram.percentile(99.0), delta=0.0099)
+        self.assertEqual(1.0, histogram.percentile(100.0))
+        self.assertEqual(0.001, histogram.percentile(0.0))
+
+    def test_out_of_range(self):
+        histogram = LatencyHistogram(lowest=0.001, highest=10.0)
+        histogram.record(0.0)
+        histogram.record(100.0)
+        self.assertEqual(0.001, histogram.percentile(50.0))
+        self.assertEqual(100.0, histogram.percentile(100.0))
+
+    def test_fixed_memory(self):
+        histogram = LatencyHistogram()
+        size = len(histogram._counts)
+        for i in range(10000):
+            histogram.record(i * 0.37)
+        self.assertEqual(size, len(histogram._counts))
+
+
+class TestStageLatencies(MoxTestBase):
+
+    def test_results(self):
+        latencies = StageLatencies()
+        latencies.add({'Status': 'OK', 'Dns-Elapsed': 0.5,
+                       'Connect-Elapsed': 0.25})
+        latencies.add({'Status': 'CRITICAL', 'Dns-Elapsed': 1.5})
+        results = latencies.results
+        self.assertEqual('CRITICAL', results['Status'])
+        self.assertEqual(2, results['Checks'])
+        self.assertEqual(1, results['Checks-Ok'])
+        self.assertEqual(0.5, results['Dns-Elapsed-Min'])
+        self.assertEqual(1.5, results['Dns-Elapsed-Max'])
+        self.assertEqual(0.25, results['Connect-Elapsed-P99'])
+        self.assertNotIn('Ssl-Elapsed-Min', results)
+
+    def test_output(self):
+        latencies = StageLatencies()
+        latencies.add({'Status': 'OK', 'Banner-Elapsed': 0.125})
+        f = StringIO()
+        self.assertEqual(0, latencies.output(f))
+        self.assertEqual("""\
+Status: OK
+Checks: 1
+Checks-Ok: 1
+Banner-Elapsed-Min: 0.12500
+Banner-Elapsed-P50: 0.12500
+Banner-Elapsed-P90: 0.12500
+Banner-Elapsed-P99: 0.12500
+Banner-Elapsed-Max: 0.12500
+""", f.getvalue())
+
+
+class TimedCheck(FakeCheck):
+
+    def run(self, host, port=25, with_ssl=False):
+        super(TimedCheck, self).run(host, port, with_ssl)
+        self.results['Connect-Elapsed'] = 0.1
+
+
+class TestRepeatCheck(MoxTestBase):
+
+    def test_repeat_check(self):
+        self.mox.StubOutWithMock(time, 'sleep')
+        time.sleep(IsA(float))
+        time.sleep(IsA(float))
+        self.mox.ReplayAll()
+        latencies = repeat_check('test', 13, False, 3, 60.0,
+                                 check_class=TimedCheck, connect_timeout=1.0)
+        self.assertEqual(3, latencies.checks)
+        self.assertEqual(3, latencies.healthy)
+        self.assertEqual(3, latencies.histograms['Connect-Elapsed'].count)
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
@@ -0,0 +1,70 @@
+
+from cStringIO import StringIO
+
+from mox import MoxTestBase
+
+from smtphealth.targets import Target, parse_target, read_targets
+
+
+class TestTarget(MoxTestBase):
+
+    def test_str(self):
+        self.assertEqual('test:25', str(Target('test', 25, False)))
+        self.assertEqual('test:465,ssl', str(Target('test', 465, True)))
+        self.assertEqual('[::1]:25', str(Target('::1', 25, False)))
+
+
+class TestParseTarget(MoxTestBase):
+
+    def test_host(self):
+        self.assertEqual(('test', 25, False), parse_target('test'))
+        self.assertEqual(('test', 587, True),
+                         parse_target(' test ', 587, True))
+
+    def test_port(self):
+        self.assertEqual(('test', 13, False), parse_target('test:13'))
+
+    def test_ssl(self):
+        self.assertEqual(('test', 465, True), parse_target('test:465,ssl'))
+        self.assertEqual(('test', 25, True), parse_target('test,SSL'))
+        self.assertEqual(('test', 25, False), parse_target('test,nossl', 25,
+                                                           True))
+
+    def test_ipv6(self):
+        self.assertEqual(('::1', 25, False), parse_target('::1'))
+        self.assertEqual(('::1', 13, False), parse_target('[::1]:13'))
+        self.assertEqual(('::1', 25, True), parse_target('[::1],ssl'))
+
+    def test_invalid(self):
+        for line in ('test:abc', ':25', 'test,tls', '[::1', '[::1]13'):
+            with self.assertRaises(ValueError):
+                parse_target(line)
+
+
+class TestReadTargets(MoxTestBase):
+
+    def test_read_targets(self):
+        stream = StringIO("""\
+# comment
+one
+
+two:13,ssl
+""")
+        self.assertEqual([('one', 25, False), ('two', 13, True)],
+                         list(read_targets(stream)))
+
+    def test_read_targets_errors(self):
+        stream = StringIO('one\ntwo:abc\nthree\n')
+        errors = []
+        targets = read_targets(stream, errors=lambda *args: errors.append(args))
+        self.assertEqual(['one', 'three'], [t.host for t in targets])
+        self.assertEqual('two:abc', errors[0][0])
+        self.assertIsInstance(errors[0][1], ValueError)
+
+    def test_read_targets_raises(self):
+        stream = StringIO('one\ntwo:abc\n')
+        with self.assertRaises(ValueError):
+            list(read_targets(stream))
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4
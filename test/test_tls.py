@@ -0,0 +1,58 @@
+
+import ssl
+
+from mox import MoxTestBase
+
+from smtphealth import tls
+from smtphealth.tls import create_context, get_default_context, \
+    SslSessionCache
+
+
+class TestContext(MoxTestBase):
+
+    def test_create_context(self):
+        context = create_context()
+        self.assertEqual(ssl.CERT_NONE, context.verify_mode)
+        self.assertFalse(context.check_hostname)
+
+    def test_create_context_verify(self):
+        context = create_context(verify=True)
+        self.assertEqual(ssl.CERT_REQUIRED, context.verify_mode)
+        self.assertTrue(context.check_hostname)
+
+    def test_get_default_context(self):
+        self.stubs.Set(tls, '_default_context', None)
+        context = get_default_context()
+        self.assertIs(context, get_default_context())
+        self.assertEqual(ssl.CERT_NONE, context.verify_mode)
+
+
+class TestSslSessionCache(MoxTestBase):
+
+    def test_get_set(self):
+        cache = SslSessionCache()
+        self.assertEqual(None, cache.get('test'))
+        cache.set('test', 'session')
+        self.assertEqual('session', cache.get('test'))
+        cache.set('test', None)
+        self.assertEqual('session', cache.get('test'))
+
+    def test_discard(self):
+        cache = SslSessionCache()
+        cache.set('test', 'session')
+        cache.discard('test')
+        cache.discard('test')
+        self.assertEqual(0, len(cache))
+
+    def test_lru(self):
+        cache = SslSessionCache(max_size=2)
+        cache.set('one', 1)
+        cache.set('two', 2)
+        cache.get('one')
+        cache.set('three', 3)
+        self.assertEqual(None, cache.get('two'))
+        self.assertEqual(1, cache.get('one'))
+        self.assertEqual(3, cache.get('three'))
+
+
+# vim:et:fdm=marker:sts=4:sw=4:ts=4